@@ -1,3 +1,4 @@
+import os
 from os.path import dirname, realpath, join, abspath
 
 APP_DIR = dirname(dirname(realpath(__file__)))
@@ -73,7 +74,79 @@ URI_CED_INSTANCE_BASE = '/'.join([DATA_URI_PREFIX, 'commonwealthelectoraldivisio
 
 
 
-WFS_SERVICE_BASE_URI = 'https://geo.abs.gov.au/arcgis/services/ASGS2016/{service}/MapServer/WFSServer'
+# Set ASGS_WFS_SERVICE_BASE_URI to point at another WFS, eg the local one from wfs_emulator.py
+WFS_SERVICE_BASE_URI = os.environ.get(
+    'ASGS_WFS_SERVICE_BASE_URI', 'https://geo.abs.gov.au/arcgis/services/ASGS2016/{service}/MapServer/WFSServer')
+WFS_POOL_SIZE = 10  # max connections open at once per WFS host, per worker. Idle ones are kept alive for reuse.
+WFS_POOL_TIMEOUT = 60.0  # seconds a request waits for a connection when WFS_POOL_SIZE are in use
+WFS_CONNECT_TIMEOUT = 10.0  # seconds
+WFS_READ_TIMEOUT = 300.0  # seconds, the big STATE and AUS features can take minutes
+# ASGS types with very large geometries. Their WFS responses are parsed as a stream, one gml:member at a time,
+# with lxml's huge_tree option, and feature_store_builder.py fetches them one feature per request.
+WFS_STREAMING_PARSE_TYPES = {"STATE", "AUS", "GCCSA", "SUA", "IREG", "SOS"}
+WFS_ASYNC_CONCURRENCY = 100  # max WFS requests in flight at once from one AsyncWFSClient
+WFS_BATCH_SIZE = 25  # max features requested in one batched GetFeature, keeps the GET URL a sane length
+# Local snapshot of the WFS features, built by feature_store_builder.py. Used whenever the file exists.
+FEATURE_STORE_PATH = join(dirname(APP_DIR), 'asgs_feature_store.sqlite3')
+# When True, features not in the feature store are NotFound, the WFS is never asked for them
+FEATURE_STORE_OFFLINE = False
+# Persistent cache of WFS responses, shared by all the workers. None to disable.
+WFS_DISK_CACHE_DIR = join(dirname(APP_DIR), 'wfs_cache')
+WFS_DISK_CACHE_TTL = 7 * 24 * 3600  # seconds, the 2016 ASGS doesn't change
+WFS_DISK_CACHE_MAX_BYTES = 2 * 1024 ** 3
+NOT_FOUND_CACHE_SIZE = 10000  # (asgs_type, identifier) pairs remembered as not found
+NOT_FOUND_CACHE_TTL = 3600  # seconds
+# Circuit breaker per WFS service, opens when this fraction of the recent requests failed
+WFS_BREAKER_FAILURE_RATE = 0.5
+WFS_BREAKER_WINDOW = 20  # recent requests the failure rate is measured over
+WFS_BREAKER_MIN_CALLS = 5
+WFS_BREAKER_RESET_TIMEOUT = 30.0  # seconds between recovery probes while open
+WFS_RETRY_MAX_DELAY = 4.0  # seconds, cap on the backoff between retries of one request
+# The HTML map geometry is simplified for drawing about this many pixels across the feature. None for full resolution.
+HTML_MAP_RESOLUTION = 4096
+# Decimal places of GeoJSON output coordinates. The ABS WFS serves EPSG:3857 metres, so 2 is to the centimetre.
+# None for full precision.
+GEOJSON_COORDINATE_PRECISION = 2
+# How the asgs and geosparql views serialize geometries: 'gml', 'wkt' or 'wkb'.
+# A request can choose another with the _geometry query parameter.
+GEOSPARQL_GEOMETRY_ENCODING = 'gml'
+# Per-feature geometry summaries (bbox, centroid, area, vertex count), built by lookup_builder.py
+GEOMETRY_SUMMARIES_PATH = join(dirname(APP_DIR), 'geometry_summaries.pickle.gz')
+# The wfs view serves the feature's WFS XML from the local copy, rather than redirecting to the WFS
+WFS_VIEW_PASSTHROUGH = True
+# The rendered asgs, loci and geosparql view responses, kept per (uri, view, format) so repeats skip rendering
+RESPONSE_CACHE_MAX_BYTES = 256 * 1024 ** 2  # in memory, per worker. 0 to disable.
+RESPONSE_CACHE_MAX_ITEM_BYTES = 16 * 1024 ** 2  # bigger responses only go in the disk tier
+# The disk tier, shared by all the workers. None to keep rendered responses in memory only.
+RESPONSE_CACHE_DIR = join(dirname(APP_DIR), 'response_cache')
+RESPONSE_CACHE_DISK_MAX_BYTES = 2 * 1024 ** 3
+RESPONSE_CACHE_DISK_TTL = 7 * 24 * 3600  # seconds, no longer than the WFS disk cache keeps what they're made from
+# Part of every response cache key, along with a hash of the package's code and templates.
+# Change it when the rendered output changes some other way, eg rebuilt lookup pickles.
+RESPONSE_CACHE_VERSION = '1'
+# Mapbox Vector Tiles of the feature store geometries, served at /tiles/<type>/<z>/<x>/<y>.mvt
+# The store needs its bounds index, build it and pre-render tiles with tile_builder.py
+TILE_CACHE_DIR = join(dirname(APP_DIR), 'tile_cache')  # None to render every request
+TILE_CACHE_MAX_BYTES = 1024 ** 3
+TILE_CACHE_TTL = 7 * 24 * 3600  # seconds, so tiles drawn before a feature store refresh are redrawn from the new data
+TILE_EXTENT = 4096  # tile coordinate range
+TILE_BUFFER = 64  # tile coordinates drawn past each tile edge
+TILE_MAX_ZOOM = 16  # clients overzoom past this
+# Below these zooms a type has too many features for a tile, its tiles are empty
+TILE_MIN_ZOOM = {
+    "MB": 12,
+    "SA1": 10,
+    "SA2": 8,
+    "SSC": 8,
+    "ILOC": 8,
+    "SA3": 6,
+    "LGA": 6,
+    "SOSR": 6,
+    "UCL": 6,
+    "IARE": 6,
+    "CED": 5,
+    "SA4": 4,
+}
 GEOMETRY_SERVICE_HOST = "http://gds.loci.cat"
 GEOMETRY_SERVICE_URI = '/'.join([GEOMETRY_SERVICE_HOST, "geometry/"])
 #geometry/asgs16_ste/
@@ -1,8 +1,12 @@
 # -*- coding: utf-8 -*-
+import json
 from flask import Blueprint, request, redirect, url_for, Response, render_template
 from pyldapi import RegisterOfRegistersRenderer
 from flask_cors import CORS
 from asgs_dataset.model.asgs_feature import ASGSFeature
+from asgs_dataset.model import NotFoundError
+from asgs_dataset.model.circuit_breaker import wfs_breakers
+from asgs_dataset.model.vector_tiles import get_tile
 from asgs_dataset.view.ldapi import ASGSRegisterRenderer
 from asgs_dataset.view.ldapi.asgs_feature import ASGSFeatureRenderer
 import asgs_dataset._config as conf
@@ -413,6 +417,22 @@ def ceds():
         super_register=conf.DATA_URI_PREFIX,
     ).render()
 
+@ctrl.route('/status/wfs')
+def wfs_status():
+    # circuit breaker state of each WFS service, for monitoring
+    return Response(json.dumps(wfs_breakers.snapshot(), indent=2), status=200, mimetype='application/json')
+
+@ctrl.route('/tiles/<string:asgs_type>/<int:z>/<int:x>/<int:y>.mvt')
+def vector_tile(asgs_type, z, x, y):
+    try:
+        tile = get_tile(asgs_type.upper(), z, x, y)
+    except NotFoundError:
+        return Response('No such tile.', status=404, mimetype='text/plain')
+    resp = Response(tile, status=200, mimetype='application/vnd.mapbox-vector-tile')
+    resp.cache_control.public = True
+    resp.cache_control.max_age = 86400
+    return resp
+
 #
 #   instances
 #
@@ -0,0 +1,412 @@
+# -*- coding: utf-8 -*-
+import struct
+
+import numpy as np
+
+WKB_POLYGON = 3
+WKB_MULTIPOLYGON = 6
+
+
+class CompactGeometry(object):
+    """
+    A Polygon or MultiPolygon held as one contiguous array of positions,
+    rather than GeoJSON's nested lists of coordinate tuples.
+
+    coords is an (N, dims) float64 array of every position of every ring.
+    Ring i is coords[ring_offsets[i]:ring_offsets[i + 1]].
+    Polygon j is rings part_offsets[j] to part_offsets[j + 1], its exterior ring first.
+    A Polygon has exactly one part.
+    """
+    __slots__ = ('type', 'coords', 'ring_offsets', 'part_offsets', 'dims', 'crs', '_split_bounds')
+
+    def __init__(self, geom_type, coords, ring_offsets, part_offsets, dims=2, crs=None):
+        self.type = geom_type
+        self.coords = coords
+        self.ring_offsets = ring_offsets
+        self.part_offsets = part_offsets
+        self.dims = dims
+        self.crs = crs
+        self._split_bounds = None
+
+    @classmethod
+    def from_polygons(cls, geom_type, polygons, dims=2, crs=None):
+        """
+        :param polygons: one list of ring arrays per polygon
+        :type polygons: list[list[np.ndarray]]
+        :rtype: CompactGeometry
+        """
+        rings = [r for p in polygons for r in p]
+        ring_offsets = np.zeros(len(rings) + 1, dtype=np.int64)
+        if rings:
+            np.cumsum([len(r) for r in rings], out=ring_offsets[1:])
+        part_offsets = np.zeros(len(polygons) + 1, dtype=np.int64)
+        if polygons:
+            np.cumsum([len(p) for p in polygons], out=part_offsets[1:])
+        if rings:
+            coords = np.concatenate([np.asarray(r, dtype=np.float64).reshape(-1, dims) for r in rings])
+        else:
+            coords = np.empty((0, dims), dtype=np.float64)
+        return cls(geom_type, coords, ring_offsets, part_offsets, dims=dims, crs=crs)
+
+    @classmethod
+    def from_geojson(cls, geojson):
+        """
+        :param geojson: a GeoJSON Polygon or MultiPolygon dict, as made by gml_extract_geom_to_geojson
+        :rtype: CompactGeometry
+        """
+        geom_type = geojson['type']
+        dims = geojson.get('dims', 2)
+        if geom_type == "Polygon":
+            polygons = [geojson['coordinates']]
+        elif geom_type == "MultiPolygon":
+            polygons = geojson['coordinates']
+        else:
+            raise NotImplementedError("Cannot make a CompactGeometry from a {}".format(geom_type))
+        polygons = [[np.array(r, dtype=np.float64).reshape(-1, dims) for r in p] for p in polygons]
+        return cls.from_polygons(geom_type, polygons, dims=dims, crs=geojson.get('crs', None))
+
+    @property
+    def num_rings(self):
+        return len(self.ring_offsets) - 1
+
+    @property
+    def num_parts(self):
+        return len(self.part_offsets) - 1
+
+    def ring(self, i):
+        return self.coords[self.ring_offsets[i]:self.ring_offsets[i + 1]]
+
+    def polygons(self):
+        """
+        :return: one list of ring arrays per polygon, the arrays are views on coords
+        :rtype: list[list[np.ndarray]]
+        """
+        po = self.part_offsets.tolist()
+        return [[self.ring(i) for i in range(po[j], po[j + 1])] for j in range(len(po) - 1)]
+
+    @staticmethod
+    def _ring_to_geojson(ring):
+        return list(zip(*ring.T.tolist()))
+
+    def to_geojson(self, precision=None):
+        """
+        :param precision: round the coordinates to this many decimal places, None for full precision
+        :return: the equivalent GeoJSON geometry dict, with its "dims" and "crs"
+        :rtype: dict
+        """
+        coords = self.coords if precision is None else np.round(self.coords, precision)
+        ro = self.ring_offsets.tolist()
+        po = self.part_offsets.tolist()
+        polygons = [[self._ring_to_geojson(coords[ro[i]:ro[i + 1]]) for i in range(po[j], po[j + 1])]
+                    for j in range(len(po) - 1)]
+        if self.type == "Polygon":
+            coords = polygons[0] if polygons else []
+            return {"type": "Polygon", "crs": self.crs, "dims": self.dims, "coordinates": coords}
+        return {"type": self.type, "coordinates": polygons, "dims": self.dims, "crs": self.crs}
+
+    def _wkt_tag(self):
+        tag = self.type.upper()
+        if self.dims == 3:
+            return tag + " Z"
+        elif self.dims == 4:
+            return tag + " ZM"
+        return tag
+
+    def to_wkt(self):
+        """
+        :return: the geometry as Well-Known Text, eg MULTIPOLYGON (((x y, x y, ...)))
+        :rtype: str
+        """
+        if not self:
+            return self._wkt_tag() + " EMPTY"
+        # %r is the shortest text that reads back to the same float
+        values = self.coords.ravel().tolist()
+        dims = self.dims
+        position_format = " ".join(["%r"] * dims)
+        ro = self.ring_offsets.tolist()
+        po = self.part_offsets.tolist()
+
+        def ring_text(i):
+            n = ro[i + 1] - ro[i]
+            return "(" + ", ".join([position_format] * n) % tuple(values[ro[i] * dims:ro[i + 1] * dims]) + ")"
+        polygons = ["(" + ", ".join(ring_text(i) for i in range(po[j], po[j + 1])) + ")"
+                    for j in range(len(po) - 1)]
+        if self.type == "Polygon":
+            return self._wkt_tag() + " " + polygons[0]
+        return self._wkt_tag() + " (" + ", ".join(polygons) + ")"
+
+    def to_wkb(self):
+        """
+        :return: the geometry as little-endian ISO Well-Known Binary
+        :rtype: bytes
+        """
+        z_offset = {3: 1000, 4: 3000}.get(self.dims, 0)
+        coords = np.ascontiguousarray(self.coords, dtype='<f8')
+        ro = self.ring_offsets.tolist()
+        po = self.part_offsets.tolist()
+        chunks = []
+        if self.type == "MultiPolygon":
+            chunks.append(struct.pack('<BII', 1, WKB_MULTIPOLYGON + z_offset, len(po) - 1))
+        for j in range(len(po) - 1):
+            chunks.append(struct.pack('<BII', 1, WKB_POLYGON + z_offset, po[j + 1] - po[j]))
+            for i in range(po[j], po[j + 1]):
+                chunks.append(struct.pack('<I', ro[i + 1] - ro[i]))
+                chunks.append(coords[ro[i]:ro[i + 1]].tobytes())
+        if self.type == "Polygon" and len(po) < 2:
+            chunks.append(struct.pack('<BII', 1, WKB_POLYGON + z_offset, 0))
+        return b"".join(chunks)
+
+    def split_bounds(self):
+        """
+        See split_bounds(), computed once then kept with the geometry.
+        """
+        if self._split_bounds is None:
+            self._split_bounds = split_bounds(self.coords)
+        return self._split_bounds
+
+    @property
+    def __geo_interface__(self):
+        return self.to_geojson()
+
+    @property
+    def nbytes(self):
+        return self.coords.nbytes + self.ring_offsets.nbytes + self.part_offsets.nbytes
+
+    def __bool__(self):
+        # an empty CompactGeometry is falsy, like an empty GeoJSON geometry dict
+        return len(self.coords) > 0
+
+    def __repr__(self):
+        return "<CompactGeometry {} parts={} rings={} positions={}>".format(
+            self.type, self.num_parts, self.num_rings, len(self.coords))
+
+
+def split_bounds(coords):
+    """
+    The bounds of the positions east and west of the antimeridian (x >= 0 and x < 0), computed separately.
+
+    :param coords: array of positions, x then y in the first two columns
+    :type coords: np.ndarray
+    :return: ((n, s, e, w) of the x >= 0 positions, (n, s, e, w) of the x < 0 positions),
+             either is all None if there are no such positions
+    :rtype: tuple[tuple, tuple]
+    """
+    xs = coords[:, 0]
+    ys = coords[:, 1]
+    bounds = []
+    for mask in (xs >= 0, xs < 0):
+        if mask.any():
+            x = xs[mask]
+            y = ys[mask]
+            bounds.append((float(y.max()), float(y.min()), float(x.max()), float(x.min())))
+        else:
+            bounds.append((None, None, None, None))
+    return tuple(bounds)
+
+
+def concatenate_geometries(geoms, geom_type="MultiPolygon"):
+    """
+    Join the parts of several CompactGeometries into one, without going through GeoJSON.
+
+    :type geoms: list[CompactGeometry]
+    :rtype: CompactGeometry
+    """
+    dims = geoms[0].dims
+    coords = np.concatenate([g.coords for g in geoms])
+    ring_offsets = [np.zeros(1, dtype=np.int64)]
+    part_offsets = [np.zeros(1, dtype=np.int64)]
+    pos_base = 0
+    ring_base = 0
+    for g in geoms:
+        ring_offsets.append(g.ring_offsets[1:] + pos_base)
+        part_offsets.append(g.part_offsets[1:] + ring_base)
+        pos_base += len(g.coords)
+        ring_base += g.num_rings
+    combined = CompactGeometry(geom_type, coords, np.concatenate(ring_offsets), np.concatenate(part_offsets),
+                               dims=dims, crs=geoms[0].crs)
+    # The parts are what get cached, so their bounds may already be known
+    combined._split_bounds = merge_split_bounds([g.split_bounds() for g in geoms])
+    return combined
+
+
+def merge_split_bounds(all_bounds):
+    """
+    :param all_bounds: results of split_bounds()
+    :return: the split_bounds() of all of them together
+    """
+    merged = []
+    for i in (0, 1):
+        parts = [b[i] for b in all_bounds if b[i][0] is not None]
+        if parts:
+            merged.append((max(p[0] for p in parts), min(p[1] for p in parts),
+                           max(p[2] for p in parts), min(p[3] for p in parts)))
+        else:
+            merged.append((None, None, None, None))
+    return tuple(merged)
+
+
+def douglas_peucker_mask(positions, tolerance):
+    """
+    Douglas-Peucker line simplification.
+
+    :param positions: (N, dims) array, only the first two columns are used
+    :param tolerance: max distance of a dropped position from the simplified line, in coordinate units
+    :return: boolean mask of the positions to keep, the first and last are always kept
+    :rtype: np.ndarray
+    """
+    n = len(positions)
+    keep = np.zeros(n, dtype=bool)
+    if n < 1:
+        return keep
+    keep[0] = keep[-1] = True
+    xy = positions[:, :2]
+    stack = [(0, n - 1)]
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+        a = xy[start]
+        d = xy[end] - a
+        rel = xy[start + 1:end] - a
+        length = np.hypot(d[0], d[1])
+        if length == 0.0:
+            # eg the start and end of a closed ring
+            dist = np.hypot(rel[:, 0], rel[:, 1])
+        else:
+            dist = np.abs(d[0] * rel[:, 1] - d[1] * rel[:, 0]) / length
+        i = int(np.argmax(dist))
+        if dist[i] > tolerance:
+            k = start + 1 + i
+            keep[k] = True
+            stack.append((start, k))
+            stack.append((k, end))
+    return keep
+
+
+def simplify_geometry(geom, tolerance):
+    """
+    Simplify every ring with Douglas-Peucker. Rings that collapse to fewer than 4 positions
+    are dropped, and a polygon is dropped with its exterior ring.
+    If every polygon would be dropped, the geometry is returned as it is.
+
+    :type geom: CompactGeometry
+    :rtype: CompactGeometry
+    """
+    if tolerance is None or tolerance <= 0:
+        return geom
+    polygons = []
+    for rings in geom.polygons():
+        simplified = []
+        for i, ring in enumerate(rings):
+            kept = ring[douglas_peucker_mask(ring, tolerance)]
+            if len(kept) < 4:
+                if i == 0:
+                    break  # the exterior is gone, so is the polygon
+                continue
+            simplified.append(kept)
+        if simplified:
+            polygons.append(simplified)
+    if len(polygons) < 1:
+        return geom
+    simple = CompactGeometry.from_polygons(geom.type, polygons, dims=geom.dims, crs=geom.crs)
+    simple._split_bounds = geom._split_bounds
+    return simple
+
+
+def extent_tolerance(geom, resolution):
+    """
+    A simplification tolerance for drawing the geometry about resolution pixels across.
+
+    :type geom: CompactGeometry
+    :rtype: float
+    """
+    if not geom:
+        return 0.0
+    mins = geom.coords[:, :2].min(axis=0)
+    maxs = geom.coords[:, :2].max(axis=0)
+    return float((maxs - mins).max()) / float(resolution)
+
+
+def clip_ring(ring, minx, miny, maxx, maxy):
+    """
+    Sutherland-Hodgman clip of a closed ring to a box.
+    Each box edge is one vectorized pass over the ring's edges.
+
+    :param ring: (N, dims) array, closed (the last position repeats the first)
+    :return: the clipped ring, closed, with only x and y. Fewer than 4 positions if nothing is left.
+    :rtype: np.ndarray
+    """
+    pts = ring[:, :2]
+    if len(pts) < 4:
+        return pts[:0]
+    rmin = pts.min(axis=0)
+    rmax = pts.max(axis=0)
+    if rmin[0] >= minx and rmin[1] >= miny and rmax[0] <= maxx and rmax[1] <= maxy:
+        return pts  # all inside
+    if rmax[0] < minx or rmax[1] < miny or rmin[0] > maxx or rmin[1] > maxy:
+        return pts[:0]  # all outside
+    pts = pts[:-1]
+    for axis, bound, keep_above in ((0, minx, True), (0, maxx, False), (1, miny, True), (1, maxy, False)):
+        if len(pts) < 1:
+            break
+        nxt = np.roll(pts, -1, axis=0)
+        if keep_above:
+            cur_in = pts[:, axis] >= bound
+            nxt_in = nxt[:, axis] >= bound
+        else:
+            cur_in = pts[:, axis] <= bound
+            nxt_in = nxt[:, axis] <= bound
+        crossing = cur_in != nxt_in
+        # where each edge crosses the box edge, edges that don't cross get a dummy denominator
+        span = np.where(crossing, nxt[:, axis] - pts[:, axis], 1.0)
+        t = (bound - pts[:, axis]) / span
+        cross_pts = pts + t[:, None] * (nxt - pts)
+        cross_pts[:, axis] = bound
+        # each edge emits its crossing point (if any), then its end point (if inside)
+        out = np.stack([cross_pts, nxt], axis=1)
+        mask = np.stack([crossing, nxt_in], axis=1)
+        pts = out[mask]
+    if len(pts) < 3:
+        return pts[:0]
+    return np.concatenate([pts, pts[:1]])
+
+
+def area_and_centroid(geom):
+    """
+    Planar area and area-weighted centroid of a polygonal geometry, in its CRS units.
+    Holes count against the area, whichever way the rings are wound.
+
+    :type geom: CompactGeometry
+    :return: (area, (x, y)), the centroid is None for a geometry with no area
+    :rtype: tuple
+    """
+    if not geom or geom.num_rings < 1:
+        return 0.0, None
+    # relative to one position, so the cross products don't lose precision to the big EPSG:3857 values
+    origin = geom.coords[0, :2]
+    xy = geom.coords[:, :2] - origin
+    x0 = xy[:-1, 0]
+    y0 = xy[:-1, 1]
+    x1 = xy[1:, 0]
+    y1 = xy[1:, 1]
+    cross = x0 * y1 - x1 * y0
+    if len(cross) < 1:
+        return 0.0, None
+    # the segment from each ring's last position to the next ring's first is not an edge
+    cross[geom.ring_offsets[1:-1] - 1] = 0.0
+    ring_starts = geom.ring_offsets[:-1]
+    nonempty = geom.ring_offsets[1:] > ring_starts
+    starts = np.minimum(ring_starts, len(cross) - 1)
+    ring_area2 = np.add.reduceat(cross, starts) * nonempty
+    ring_cx6 = np.add.reduceat((x0 + x1) * cross, starts) * nonempty
+    ring_cy6 = np.add.reduceat((y0 + y1) * cross, starts) * nonempty
+    # exterior rings add, interior rings take away
+    is_exterior = np.zeros(geom.num_rings, dtype=bool)
+    is_exterior[geom.part_offsets[:-1][geom.part_offsets[:-1] < geom.num_rings]] = True
+    sign = np.where(is_exterior, 1.0, -1.0) * np.sign(ring_area2)
+    area2 = float(np.sum(sign * ring_area2))
+    if area2 == 0.0:
+        return 0.0, None
+    cx = float(np.sum(sign * ring_cx6)) / (3.0 * area2) + float(origin[0])
+    cy = float(np.sum(sign * ring_cy6)) / (3.0 * area2) + float(origin[1])
+    return area2 / 2.0, (cx, cy)
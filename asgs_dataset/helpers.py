@@ -5,11 +5,14 @@ import pickle
 import gzip
 import lxml
 from os import path
+import numpy as np
 import rdflib
 from rdflib import Namespace
 from rdflib.namespace import RDF, RDFS, OWL, XSD
 from lxml import etree
 
+from asgs_dataset.geometry import CompactGeometry, concatenate_geometries, split_bounds
+
 GEO = Namespace("http://www.opengis.net/ont/geosparql#")
 GEOX = Namespace("http://linked.data.gov.au/def/geox#")
 GML = Namespace("http://www.opengis.net/ont/gml#")
@@ -45,6 +48,19 @@ def chunks(source, length):
     for i in range(0, source_len, length):
         yield source[i:i + length]
 
+def gml_poslist_to_array(text, dims=2):
+    """
+    Decode the text of a gml:posList into an array of positions, one row per position.
+    Values left over that don't make up a whole position are dropped.
+
+    :param text: whitespace separated coordinate values
+    :type text: str
+    :rtype: np.ndarray
+    """
+    values = np.array(text.split(), dtype=np.float64) if text else np.empty(0, dtype=np.float64)
+    n = len(values) - (len(values) % dims)
+    return values[:n].reshape(-1, dims)
+
 AsgsWfsTypeTuple = namedtuple('AsgsWfsType', ['service', 'typename', 'propertyname'])
 class AsgsWfsType(AsgsWfsTypeTuple):
     __slots__ = ()
@@ -58,12 +74,14 @@ ns = {
     'gml': "http://www.opengis.net/gml/3.2"
 }
 
-def gml_extract_geom_to_geojson(node, recursion=0, parent_srs=None):
+def gml_extract_geom_to_compact(node, recursion=0, parent_srs=None):
     """
+    Convert the GML geometry inside node to a CompactGeometry.
 
     :param node:
     :type node: etree._Element
     :return:
+    :rtype: CompactGeometry
     """
     if recursion >= 10:
         return []
@@ -83,42 +101,29 @@ def gml_extract_geom_to_geojson(node, recursion=0, parent_srs=None):
     pos = "{{{}}}pos".format(ns['gml'])
 
     geom = next(node.iterchildren())  # type: etree._Element
-    if geom.tag == "something_multigeometry":
-        srs_dims = int(geom.get('srsDimension', 2))
-        srs_name = geom.get('srsName', default_srs) #4326 is WGS84/Unprojected #3395 is WGS84/Mercator. #4283 is Australia
-        crs = {"type": "name", "properties": {"name": srs_name}}
-        geometries = []
-        member_elems = geom.iterchildren(tag=surface_member_tag)
-        for m in member_elems:
-            member = gml_extract_geom_to_geojson(m, recursion=recursion+1,
-                                                 parent_srs=srs_name)
-            geometries.append(member)
-        return {"type": "GeometryCollection", "geometries": geometries, "dims": srs_dims, "crs": crs}
     if geom.tag == MultiSurface:
         srs_dims = int(geom.get('srsDimension', 2))
         srs_name = geom.get('srsName', default_srs) #4326 is WGS84/Unprojected #3395 is WGS84/Mercator. #4283 is Australia
         crs = {"type": "name", "properties": {"name": srs_name}}
-        coords = []
+        polygons = []
         member_elems = geom.iterchildren(tag=surface_member_tag)
         for m in member_elems:
-            member = gml_extract_geom_to_geojson(m, recursion=recursion+1,
+            member = gml_extract_geom_to_compact(m, recursion=recursion+1,
                                                  parent_srs=srs_name)
-            if member['type'] == "Polygon":
-                coords.append(member['coordinates'])
-            elif member['type'] == "MultiPolygon":
-                coords.extend(member['coordinates'])
+            if member.type == "Polygon" or member.type == "MultiPolygon":
+                polygons.extend(member.polygons())
             else:
                 raise ValueError(
-                    "Multipolygon cannot have a member of type {}".format(member['type']))
-        return {"type": "MultiPolygon", "coordinates": coords, "dims": srs_dims, "crs": crs}
+                    "Multipolygon cannot have a member of type {}".format(member.type))
+        return CompactGeometry.from_polygons("MultiPolygon", polygons, dims=srs_dims, crs=crs)
     elif geom.tag == Polygon:
         def extract_poly_coords(node, dims=2, srs=None):
             """
 
             :param elem:
             :type elem: etree._Element
-            :return: poly coordinate tuples
-            :rtype: list[tuple[float]]
+            :return: ring positions
+            :rtype: np.ndarray
             """
             nonlocal LinearRing
             nonlocal posList, pos
@@ -127,11 +132,9 @@ def gml_extract_geom_to_geojson(node, recursion=0, parent_srs=None):
                 flip_xy = False
             elem = next(node.iterchildren())  # type: etree._Element
             if elem.tag == LinearRing:
-                coords = []
                 pos_list_elems = list(elem.iterchildren(tag=posList))
                 if len(pos_list_elems) > 0:
-                    pos_list = pos_list_elems[0]
-                    pos_list = str(pos_list.text).split()
+                    pos_text = pos_list_elems[0].text
                 else:
                     pos_list = []
                     pos_elems = list(elem.iterchildren(tag=pos))
@@ -142,61 +145,43 @@ def gml_extract_geom_to_geojson(node, recursion=0, parent_srs=None):
                                 "Dims = {:s} but pos has a different number of dimensions."\
                                     .format(str(dims)))
                         pos_list.extend(pos_members)
-                pos_remainder = len(pos_list) % dims
-                if pos_remainder != 0:
-                    for x in range(pos_remainder):
-                        pos_list.pop()
-                if dims == 2:
-                    if flip_xy:
-                        for x, y in chunks(pos_list, 2):
-                            coords.append((float(y), float(x)))
-                    else:
-                        for x, y in chunks(pos_list, 2):
-                            coords.append((float(x), float(y)))
-                elif dims == 3:
-                    if flip_xy:
-                        for x, y, z in chunks(pos_list, 3):
-                            coords.append((float(y), float(x), float(z)))
-                    else:
-                        for x, y, z in chunks(pos_list, 3):
-                            coords.append((float(x), float(y), float(z)))
-                elif dims == 4:
-                    if flip_xy:
-                        for x, y, z, w in chunks(pos_list, 4):
-                            coords.append(
-                                (float(y), float(x), float(z), float(w)))
-                    else:
-                        for x, y, z, w in chunks(pos_list, 4):
-                            coords.append(
-                                (float(x), float(y), float(z), float(w)))
-                return coords
+                    pos_text = " ".join(pos_list)
+                if dims not in (2, 3, 4):
+                    return np.empty((0, dims), dtype=np.float64)
+                positions = gml_poslist_to_array(pos_text, dims)
+                if flip_xy:
+                    positions = positions[:, [1, 0, 2, 3][:dims]]
+                return positions
             else:
                 raise NotImplementedError(
                     "Poly geom type {} is not implemented.".format(elem.tag))
-        poly_dict = {'exterior': None, 'interior': []}
         srs_dims = int(geom.get('srsDimension', 2))
         srs_name = geom.get('srsName', default_srs)  # 4326 is WGS84/Unprojected #3395 is WGS84/Mercator. #4283 is Australia
         crs = {"type": "name", "properties": {"name": srs_name}}
+        rings = []
         exterior_elems = list(geom.iterchildren(tag=exterior_tag))
         if len(exterior_elems) > 0:
-            exterior = exterior_elems[0]
-            poly_dict['exterior'] = extract_poly_coords(exterior, dims=srs_dims, srs=srs_name)
+            rings.append(extract_poly_coords(exterior_elems[0], dims=srs_dims, srs=srs_name))
+        else:
+            rings.append(np.empty((0, srs_dims), dtype=np.float64))
         interior_elems = list(geom.iterchildren(tag=interior_tag))
         for interior_elem in interior_elems:
-            interior = extract_poly_coords(interior_elem, dims=srs_dims, srs=srs_name)
-            poly_dict['interior'].append(interior)
-        coords = []
-        if poly_dict['exterior']:
-            coords.append(poly_dict['exterior'])
-        else:
-            coords.append([])
-        coords.extend(poly_dict['interior'])
-        return {"type": "Polygon", "crs": crs, "dims": srs_dims, "coordinates": coords}
+            rings.append(extract_poly_coords(interior_elem, dims=srs_dims, srs=srs_name))
+        return CompactGeometry.from_polygons("Polygon", [rings], dims=srs_dims, crs=crs)
 
     else:
         raise NotImplementedError(
             "Don't know how to convert geom type: {}".format(geom.tag))
 
+def gml_extract_geom_to_geojson(node, recursion=0, parent_srs=None):
+    """
+
+    :param node:
+    :type node: etree._Element
+    :return:
+    """
+    return gml_extract_geom_to_compact(node, recursion=recursion, parent_srs=parent_srs).to_geojson()
+
 def gml_extract_shapearea_to_geox_area(node, extra_transform=None, crs=None):
     val = str(node.text)
     triples = set()
@@ -213,11 +198,34 @@ def gml_extract_shapearea_to_geox_area(node, extra_transform=None, crs=None):
            triples.add((area, GEOX_inCRS, _c))
     return triples, area
 
-def gml_extract_geom_to_geosparql(node, recursion=0):
+def crs_to_uri(crs):
+    """
+    :param crs: the "crs" of a CompactGeometry, eg from srsName urn:ogc:def:crs:EPSG:6.9:3857
+    :return: the OGC CRS URI, eg http://www.opengis.net/def/crs/EPSG/0/3857, or None if it is unknown
+    :rtype: rdflib.URIRef | None
+    """
+    if not crs:
+        return None
+    name = str(crs['properties']['name'])
+    code = name.rsplit(':', 1)[-1].rsplit('/', 1)[-1]
+    if not code.isdigit():
+        return None
+    if code == "4326":
+        # gml_extract_geom_to_compact puts 4326 positions in lon, lat order, which is CRS84
+        return CRS_OGC.term('CRS84')
+    return CRS_EPSG.term(code)
+
+
+GEOMETRY_ENCODINGS = ('gml', 'wkt', 'wkb')
+
+
+def gml_extract_geom_to_geosparql(node, recursion=0, encoding='gml'):
     """
 
     :param node:
     :type node: etree._Element
+    :param encoding: 'gml' embeds the GML as a geo:gmlLiteral, 'wkt' gives a geo:wktLiteral,
+                     'wkb' gives hex encoded WKB as the geo:hasSerialization of the geometry
     :return:
     """
     if recursion >= 10:
@@ -225,15 +233,37 @@ def gml_extract_geom_to_geosparql(node, recursion=0):
 
     GEO_gmlLiteral = GEO.term('gmlLiteral')  # The literal datatype
     GEO_asGML = GEO.term('asGML')
+    GEO_wktLiteral = GEO.term('wktLiteral')
+    GEO_asWKT = GEO.term('asWKT')
     GEO_hasSerialization = GEO.term('hasSerialization')
-    geom = next(node.iterchildren())
-    lexical = lxml.etree.tostring(geom, xml_declaration=False, pretty_print=True)
-    lit = rdflib.Literal(lexical, datatype=GEO_gmlLiteral)
+    if encoding == 'gml':
+        geom = next(node.iterchildren())
+        lexical = lxml.etree.tostring(geom, xml_declaration=False, pretty_print=True)
+        lit = rdflib.Literal(lexical, datatype=GEO_gmlLiteral)
+        predicate = GEO_asGML
+    elif encoding == 'wkt':
+        compact = gml_extract_geom_to_compact(node, recursion=recursion)
+        lexical = compact.to_wkt()
+        crs_uri = crs_to_uri(compact.crs)
+        if crs_uri is not None:
+            lexical = "<{}> {}".format(crs_uri, lexical)
+        lit = rdflib.Literal(lexical, datatype=GEO_wktLiteral)
+        predicate = GEO_asWKT
+    elif encoding == 'wkb':
+        # GeoSPARQL has no WKB literal type, so this uses the generic serialization property
+        compact = gml_extract_geom_to_compact(node, recursion=recursion)
+        lit = rdflib.Literal(compact.to_wkb().hex(), datatype=XSD.hexBinary)
+        predicate = GEO_hasSerialization
+    else:
+        raise ValueError("Unknown geometry encoding: {}".format(encoding))
     triples = set()
     geometry_node = rdflib.BNode()
     triples.add((geometry_node, RDF_a, GEO_Geometry))
-    triples.add((geometry_node, GEO_asGML, lit))
-    #triples.add((geometry_node, GEO_hasSerialization, lit))
+    triples.add((geometry_node, predicate, lit))
+    if encoding == 'wkb':
+        crs_uri = crs_to_uri(compact.crs)
+        if crs_uri is not None:
+            triples.add((geometry_node, GEOX_inCRS, crs_uri))
     return triples, geometry_node
 
 
@@ -291,6 +321,76 @@ def wfs_find_features(tree, feature_ns, feature_type):
     return features
 
 
+def wfs_iterparse_features(source, feature_ns, feature_type, huge_tree=False):
+    """
+    Streaming alternative to wfs_find_features.
+    Parses the WFS FeatureCollection with iterparse and yields one feature at a time.
+    Once the consumer asks for the next feature, the previous gml:member is
+    cleared and dropped, so the whole document is never held in memory at once.
+
+    :param source: file-like object or filename of the WFS response
+    :param feature_type:
+    :type feature_type: str
+    :return: generator of (object_id, feature element)
+    """
+    member_tag = "{{{}}}member".format(ns['gml'])  # note gml, not wfs
+    SearchClass = "{{{}}}{}".format(feature_ns, feature_type)
+    objectid_tag = "{{{}}}OBJECTID".format(feature_ns)
+    context = etree.iterparse(source, events=('end',), tag=member_tag,
+                              huge_tree=huge_tree, recover=False)
+    for _, member in context:  # type: etree._Element
+        member_objects = member.getchildren()
+        if len(member_objects) > 0 and member_objects[0].tag == SearchClass:
+            member_object = member_objects[0]
+            try:
+                key = int(next(member_object.iterchildren(tag=objectid_tag)).text)
+            except StopIteration:
+                key = "unknown"
+            yield key, member_object
+        member.clear()
+        while member.getprevious() is not None:
+            del member.getparent()[0]
+    del context
+
+
+def wfs_split_features(tree, feature_ns, feature_type, property_name):
+    """
+    Split a WFS FeatureCollection holding many features into one
+    FeatureCollection tree per distinct value of the given property.
+    Note, the member elements are moved out of the source tree.
+
+    :param tree:
+    :type tree: etree._ElementTree | etree._Element
+    :param feature_type:
+    :type feature_type: str
+    :param property_name: local name of the identifying property, eg MB_CODE_2016
+    :type property_name: str
+    :return: property value -> FeatureCollection tree
+    :rtype: dict[str, etree._ElementTree]
+    """
+    features = wfs_find_features(tree, feature_ns, feature_type)
+    if features is None:
+        return {}
+    if isinstance(tree, etree._ElementTree):
+        root = tree.getroot()
+    else:
+        root = tree
+    property_tag = "{{{}}}{}".format(feature_ns, property_name)
+    split = {}
+    for member_object in features.values():
+        try:
+            code = str(next(member_object.iterchildren(tag=property_tag)).text).strip()
+        except StopIteration:
+            continue
+        try:
+            new_root = split[code]
+        except KeyError:
+            new_root = etree.Element(root.tag, attrib=dict(root.attrib), nsmap=root.nsmap)
+            split[code] = new_root
+        new_root.append(member_object.getparent())
+    return {code: etree.ElementTree(r) for code, r in split.items()}
+
+
 def wfs_extract_features_as_geojson(tree, feature_ns, feature_type, class_converter=None):
     """
 
@@ -316,51 +416,61 @@ def wfs_extract_features_as_geojson(tree, feature_ns, feature_type, class_conver
     return geojson_feature_collection
 
 def combine_geojson_geometries(geoms):
+    """
+    Merge the geometries of several members of one feature into one MultiPolygon.
+    Polygon and MultiPolygon members can be mixed. GeoJSON dicts are merged the same way,
+    by way of CompactGeometry, and give a GeoJSON dict back.
+
+    :type geoms: list[CompactGeometry | dict]
+    :rtype: CompactGeometry | dict
+    """
     if len(geoms) == 1:
         return geoms[0]
-    non_empty_geoms = tuple(geom for geom in geoms if "type" in geom)
-    if len(non_empty_geoms) < 1:
-        return {}
-    geoms = non_empty_geoms
-    all_dims = (geom['dims'] == geoms[0]['dims'] for geom in geoms)
-    if not all(all_dims):
+    as_geojson = not any(isinstance(geom, CompactGeometry) for geom in geoms)
+    compact = []
+    for geom in geoms:
+        if isinstance(geom, CompactGeometry):
+            if geom:
+                compact.append(geom)
+        elif "type" in geom:
+            compact.append(CompactGeometry.from_geojson(geom))
+    if len(compact) < 1:
+        return {} if as_geojson else geoms[0]
+    if not all(geom.dims == compact[0].dims for geom in compact):
         raise RuntimeError("Cannot combine geometries with different geometry dimensions")
-    all_multipolygon = all(geom['type'].lower() == "multipolygon" for geom in geoms)
-    if all_multipolygon:
-        geom = geoms[0]
-        for i in range(1, len(geoms)):
-            g2 = geoms[i]
-            geom['coordinates'].extend(g2['coordinates'])
-    else:
-        raise RuntimeError("For now, we can only combine geometries if they are all of type Multipolygon")
-    return geom
+    for geom in compact:
+        if geom.type not in ("Polygon", "MultiPolygon"):
+            raise RuntimeError("Cannot combine geometries of type {}".format(geom.type))
+    # a Polygon is already one part in the parts/offsets form, so the buffers just concatenate
+    combined = concatenate_geometries(compact, geom_type="MultiPolygon")
+    return combined.to_geojson() if as_geojson else combined
+
+def combine_feature_properties(properties_list):
+    """
+    Merge the properties of several members of one feature, the areas and lengths are summed,
+    everything else is taken from the first member.
 
-def combine_geojson_features(feature_collection):
+    :type properties_list: list[dict]
+    :rtype: dict
+    """
     can_add = ["albers_area", "shape_area", "shape_length"]
+    properties = {}
+    for p in can_add:
+        properties[p] = sum((f[p] for f in properties_list if f.get(p, None) is not None), 0.0)
+    for p, v in properties_list[0].items():
+        if p not in properties:
+            properties[p] = v
+    return properties
+
+def combine_geojson_features(feature_collection):
     features = feature_collection['features']
     if len(features) == 1:
         return features[0]
-    new_feature = {
+    return {
         "type": "Feature",
-        "geometry": {},
-        "properties": {}
+        "geometry": combine_geojson_geometries([f['geometry'] for f in features]),
+        "properties": combine_feature_properties([f['properties'] for f in features])
     }
-    first_feature = features[0]
-    for p in can_add:
-        new_feature['properties'][p] = 0.0
-    geoms = []
-    for f in features:
-        for p in can_add:
-            f_p = f['properties'].get(p, None)
-            if f_p is not None:
-                new_feature['properties'][p] += f_p
-        geoms.append(f['geometry'])
-    for p in first_feature['properties']:
-        if p not in new_feature['properties']:
-            new_feature['properties'][p] = first_feature['properties'][p]
-
-    new_feature['geometry'] = combine_geojson_geometries(geoms)
-    return new_feature
 
 
 
@@ -393,43 +503,45 @@ def mymin(a, b):
     return b
 
 
-def calculate_bboxes(g, bounds=None, pad=0, srs=None):
-    if bounds is None:
-        bounds = [[None, None, None, None], [None, None, None, None]]
-    for i in g:
-        if isinstance(i, list):
-            bounds = calculate_bboxes(i, bounds=bounds, srs=srs)
-        else:
-            pBounds = bounds[0]
-            nBounds = bounds[1]
-
-            lon = i[0]
-            lat = i[1]
-
-            curBounds = pBounds
-            if (lon < 0):
-                curBounds = nBounds
-
-            n = curBounds[0]
-            s = curBounds[1]
-            e = curBounds[2]
-            w = curBounds[3]
+def flatten_positions(g):
+    """
+    Collect the x, y of every position in GeoJSON style nested coordinate lists into one array.
 
-            n = mymax(lat, n)
-            s = mymin(lat, s)
-            e = mymax(lon, e)
-            w = mymin(lon, w)
+    :rtype: np.ndarray
+    """
+    rings = []
+    stack = [g]
+    while stack:
+        item = stack.pop()
+        if len(item) < 1:
+            continue
+        if isinstance(item[0], list):
+            stack.extend(item)
+        else:
+            rings.append(np.asarray(item, dtype=np.float64)[:, :2])
+    if len(rings) < 1:
+        return np.empty((0, 2), dtype=np.float64)
+    return np.concatenate(rings)
 
-            if lon < 0:
-                bounds = (pBounds, [n, s, e, w])
-            else:
-                bounds = ([n, s, e, w], nBounds)
-    return bounds
+def calculate_bboxes(g, bounds=None, pad=0, srs=None):
+    """
+    :param g: a CompactGeometry, or GeoJSON style nested coordinate lists
+    :return: ([n, s, e, w] of the positions with x >= 0, [n, s, e, w] of those with x < 0),
+             merged with the given bounds
+    """
+    if isinstance(g, CompactGeometry):
+        found = g.split_bounds()
+    else:
+        found = split_bounds(flatten_positions(g))
+    if bounds is None:
+        return [list(found[0]), list(found[1])]
+    merged = []
+    for b, f in zip(bounds, found):
+        merged.append([mymax(b[0], f[0]), mymin(b[1], f[1]), mymax(b[2], f[2]), mymin(b[3], f[3])])
+    return tuple(merged)
 
 def calculate_bbox(g, pad=0, srs=None):
-    twin_bounds = ([None, None, None, None], [None, None, None, None])
-    (nbounds, pbounds) = calculate_bboxes(g, bounds=twin_bounds, pad=pad,
-                                          srs=srs)
+    (nbounds, pbounds) = calculate_bboxes(g, pad=pad, srs=srs)
     if pbounds[0] is None:
         b = nbounds
     elif nbounds[0] is None:
@@ -5,6 +5,10 @@ class NotFoundError(Exception):
     def __init__(self, *args):
         super(NotFoundError, self).__init__(*args)
 
+class ServiceUnavailableError(RuntimeError):
+    def __init__(self, *args):
+        super(ServiceUnavailableError, self).__init__(*args)
+
 class ASGSModel:
     __metaclass__ = ABCMeta
 
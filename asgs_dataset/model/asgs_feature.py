@@ -1,11 +1,12 @@
 from datetime import datetime
 import gzip
+import io
 import os
+import random
 import time
-from functools import lru_cache, partial
-from urllib.error import HTTPError
-from urllib.parse import urlencode
-from urllib.request import Request, urlopen
+from functools import partial
+from urllib.parse import urlencode, quote_plus
+from xml.sax.saxutils import escape
 import rdflib
 from flask import url_for
 from rdflib import Graph, URIRef, RDFS, Literal, BNode
@@ -15,12 +16,20 @@ import asgs_dataset._config as conf
 from lxml import etree
 
 from asgs_dataset.helpers import wfs_extract_features_as_geojson, \
-    gml_extract_geom_to_geojson, gml_extract_geom_to_geosparql, RDF_a, \
+    gml_extract_geom_to_compact, gml_extract_geom_to_geosparql, RDF_a, \
     GEO, ASGS, GEO_Feature, GEO_hasGeometry, \
     wfs_extract_features_with_rdf_converter, calculate_bbox, GEOX, \
     gml_extract_shapearea_to_geox_area, DATA, CRS_EPSG, LOCI, ASGS_CAT, \
-    ASGS_ID, GEO_within, GEO_contains, AsgsWfsType, load_gz_pickle, FakeXMLElement, combine_geojson_features
-from asgs_dataset.model import ASGSModel, NotFoundError
+    ASGS_ID, GEO_within, GEO_contains, AsgsWfsType, load_gz_pickle, FakeXMLElement, combine_feature_properties, \
+    combine_geojson_geometries, wfs_find_features, wfs_split_features, wfs_iterparse_features, ns
+from asgs_dataset.geometry import CompactGeometry, simplify_geometry, extent_tolerance
+from asgs_dataset.model import ASGSModel, NotFoundError, ServiceUnavailableError
+from asgs_dataset.model.cache import LRUCache, SingleFlight, DiskCache
+from asgs_dataset.model.feature_store import get_feature_store
+from asgs_dataset.model.geometry_summary import get_geometry_summaries, summarize_geometry
+from asgs_dataset.model.wfs_client import wfs_pool
+from asgs_dataset.rdf_writer import TripleWriter
+from asgs_dataset.model.circuit_breaker import wfs_breakers
 
 ASGS_KNOWN_COUNTS = {
     "MB": 358009,
@@ -59,8 +68,36 @@ DERIVE_TOKEN = object()
 IGNORE_TOKEN = object()
 # Used when we want to acknowledge a data property's existence but not use it.
 
+SHAPE_TOKEN = object()
+# Stands in for the geometry converter in the RDF conversion maps, which depends on the request
+
 RDF_INCLUDE_UNKNOWN_PREDICATES = False
 
+FEATURE_CACHE = LRUCache(maxsize=128)
+# (asgs_type, identifier) -> parsed WFS FeatureCollection tree
+
+FEATURE_RECORD_CACHE = LRUCache(maxsize=128)
+# (asgs_type, identifier) -> FeatureRecords of the FEATURE_CACHE tree, they keep their geometry once it is decoded
+
+STREAMED_FEATURE_CACHE = LRUCache(maxsize=128)
+# (asgs_type, identifier) -> FeatureRecords with their geometry decoded, but no GML kept
+
+NOT_FOUND_CACHE = LRUCache(maxsize=conf.NOT_FOUND_CACHE_SIZE, ttl=conf.NOT_FOUND_CACHE_TTL)
+# (asgs_type, identifier) -> True, for features the WFS doesn't have, so they aren't asked for again
+
+SIMPLIFIED_GEOMETRY_CACHE = LRUCache(maxsize=256)
+# (asgs_type, identifier, resolution) -> simplified CompactGeometry for the HTML map
+
+IN_FLIGHT_FETCHES = SingleFlight()
+# Coalesces concurrent fetches of the same feature into one WFS request
+
+if conf.WFS_DISK_CACHE_DIR:
+    WFS_DISK_CACHE = DiskCache(conf.WFS_DISK_CACHE_DIR, ttl=conf.WFS_DISK_CACHE_TTL,
+                               max_bytes=conf.WFS_DISK_CACHE_MAX_BYTES)
+else:
+    WFS_DISK_CACHE = None
+# WFS request URL -> gzipped response body, survives restarts and is shared between workers
+
 STATES_USE_NAMEABBREV = False
 
 # WHY ARE THEY ALL WFS?!
@@ -640,371 +677,537 @@ state_id_map = {
     "8": "ACT",
     "9": "OT"
 }
+# The feature store is keyed by the WFS STATE_CODE_2016, this maps the name abbrevs back to it
+state_code_map = {v: k for k, v in state_id_map.items() if isinstance(k, str)}
+
+
+OPTIONAL_VARS = ('shape', 'albers_area')  # TODO: This should _not_ be optional!
+
+# Value conversions of the GeoJSON properties
+geojson_to_float = ('shape_length', 'shape_area', 'albers_area')
+geojson_to_int = ('object_id', 'category', 'state')
+geojson_to_datetime = tuple()
+
+# Value conversions of the RDF converter, per ontology mappings.
+# Each to_uri function takes the WFS element and gives the object URIRef, each to_converter function gives
+# (extra triples, object). The 'shape' converters need the request, see feature_record_to_triples.
+rdf_to_uri = {
+    'loci': {
+        'sa1': lambda x: URIRef(conf.URI_SA1_INSTANCE_BASE + x.text),
+        'sa2': lambda x: URIRef(conf.URI_SA2_INSTANCE_BASE + x.text),
+        'sa3': lambda x: URIRef(conf.URI_SA3_INSTANCE_BASE + x.text),
+        'sa4': lambda x: URIRef(conf.URI_SA4_INSTANCE_BASE + x.text),
+        'dzn': lambda x: URIRef(conf.URI_DZN_INSTANCE_BASE + x.text),
+        'ssc': lambda x: URIRef(conf.URI_SSC_INSTANCE_BASE + x.text),
+        'nrmr': lambda x: URIRef(conf.URI_NRMR_INSTANCE_BASE + x.text),
+        'gccsa': lambda x: URIRef(conf.URI_GCCSA_INSTANCE_BASE + x.text),
+        'iloc': lambda x: URIRef(conf.URI_ILOC_INSTANCE_BASE + x.text),
+        'iare': lambda x: URIRef(conf.URI_IARE_INSTANCE_BASE + x.text),
+        'ireg': lambda x: URIRef(conf.URI_IREG_INSTANCE_BASE + x.text),
+        'ucl': lambda x: URIRef(conf.URI_UCL_INSTANCE_BASE + x.text),
+        'sosr': lambda x: URIRef(conf.URI_SOSR_INSTANCE_BASE + x.text),
+        'sos': lambda x: URIRef(conf.URI_SOS_INSTANCE_BASE + x.text),
+        'sua': lambda x: URIRef(conf.URI_SUA_INSTANCE_BASE + x.text),
+        'ra': lambda x: URIRef(conf.URI_RA_INSTANCE_BASE + x.text),
+        'lga': lambda x: URIRef(conf.URI_LGA_INSTANCE_BASE + x.text),
+        'ced': lambda x: URIRef(conf.URI_CED_INSTANCE_BASE + x.text),
+        'state': lambda x: URIRef(conf.URI_STATE_INSTANCE_BASE + state_id_map.get(int(x.text),'OT')) if STATES_USE_NAMEABBREV \
+            else URIRef(conf.URI_STATE_INSTANCE_BASE + x.text),
+    },
+    'geosparql': {},
+}
+rdf_to_converter = {
+    'loci': {
+        'shape': SHAPE_TOKEN,
+        'shape_area': partial(gml_extract_shapearea_to_geox_area, crs=CRS_EPSG["3857"]),  # cartesian area from asgs using "pseudo-mercator" projection
+        'albers_area': partial(gml_extract_shapearea_to_geox_area, extra_transform=lambda x: (set(), float(x) * 1000000.0), crs=CRS_EPSG["3577"]),  # cartesian GDA-94 CRS using "Albers_Conic_Equal_Area" projection
+        'code': lambda x, asgs_type: (set(), Literal(x.text, datatype=feature_identification_types[asgs_type])),
+        'category_code': lambda x: (set(), ASGS_CAT.term(x.text))
+    },
+    'geosparql': {
+        'shape': SHAPE_TOKEN,
+        'shape_area': partial(gml_extract_shapearea_to_geox_area, crs=CRS_EPSG["3857"]), #cartesian area from asgs using "pseudo-mercator" projection
+        'albers_area': partial(gml_extract_shapearea_to_geox_area, extra_transform=lambda x: (set(), float(x)*1000000), crs=CRS_EPSG["3577"]) #cartesian GDA-94 CRS using "Albers_Conic_Equal_Area" projection
+    },
+}
+rdf_to_int = {
+    'loci': ('object_id',),
+    'geosparql': ('object_id', 'category', 'state'),
+}
+rdf_to_float = ('shape_length',)
+rdf_to_uri['asgs'] = rdf_to_uri['geosparql']
+rdf_to_converter['asgs'] = rdf_to_converter['geosparql']
+rdf_to_int['asgs'] = rdf_to_int['geosparql']
+
+_upper_tags = {}
+# WFS tag -> tag.upper(), for the tags no tag map knows
+_UNKNOWN_TAG = object()
+
+
+class ConversionPlan(object):
+    """
+    The tag map and predicate maps of one ASGS type, compiled once, so that features
+    are converted without re-interpreting the maps for every feature.
+
+    tags maps each WFS tag to (upper-cased tag, var), or to None for the tags that are looked up
+    or derived. checks holds the (upper-cased tag, kind, data) of every tag that must be seen on
+    the feature or else be looked up (kind LOCAL_LOOKUP_TOKEN) or derived (kind DERIVE_TOKEN)
+    afterwards, in tag map order. geojson maps each var to its property cast, rdf and derived
+    map each ontology mappings to the RDF handlers of the read vars, and of the looked up and
+    derived vars.
+    """
+
+    def __init__(self, asgs_type, tags, checks, ignore_geom, geojson, rdf, derived):
+        self.asgs_type = asgs_type
+        self.tags = tags
+        self.checks = checks
+        self.ignore_geom = ignore_geom
+        self.geojson = geojson
+        self.rdf = rdf
+        self.derived = derived
+
+
+def _compile_tag_map(asgs_type, tag_map):
+    """
+    :return: (tags, checks) of the ConversionPlan
+    """
+    tags = {}
+    checks = []
+    for t, var in tag_map.items():
+        upper = t.upper()
+        if isinstance(var, (list, tuple)):
+            tokens = var[0:-1]
+            var = var[-1]
+            if LOCAL_LOOKUP_TOKEN is tokens[0]:
+                lookup_name = "{}_to_{}".format(asgs_type.lower(), var.lower())
+                lookup_table = LOCAL_DATA_VAL_LOOKUPS.get(lookup_name, None)
+                # hardcoded "code" here for now, assume always lookup based on code
+                checks.append((upper, LOCAL_LOOKUP_TOKEN, (lookup_table, "code", var, lookup_name)))
+                tags[t] = None
+                continue
+            elif DERIVE_TOKEN is tokens[0]:
+                arg1, derive_fn = tokens[1]
+                checks.append((upper, DERIVE_TOKEN, (arg1, derive_fn, var)))
+                tags[t] = None
+                continue
+        tags[t] = (upper, var)
+        if var not in OPTIONAL_VARS:
+            checks.append((upper, None, t))
+    return tags, checks
+
+
+def _rdf_value_handler(asgs_type, mappings, var):
+    """
+    :return: (to_uri function or None, to_converter function or None) of the var
+    """
+    to_uri = rdf_to_uri[mappings].get(var, None)
+    if to_uri is not None:
+        return to_uri, None
+    conv = rdf_to_converter[mappings].get(var, None)
+    if conv is not None and var == 'code':
+        conv = partial(conv, asgs_type=asgs_type)
+    return None, conv
+
+
+def _predicates(predicate):
+    if not isinstance(predicate, list):
+        predicate = [predicate]
+    return tuple(p for p in predicate if p is not INVERSE_TOKEN)
+
+
+def _compile_rdf_handlers(asgs_type, mappings, read_vars, derived_vars):
+    """
+    :return: (var -> (to_uri, to_converter, cast, predicates, is_geom) or None for an ignored geometry,
+              looked up or derived var -> (to_uri, to_converter, predicates))
+    """
+    predicate_map = predicate_map_lookup[mappings].get(asgs_type, common_predicate_map_asgs)
+    ignore_geom = mappings != "loci" and (asgs_type == "STATE" or asgs_type == "AUS")
+    to_int = rdf_to_int[mappings]
+    handlers = {}
+    for var in read_vars:
+        is_geom = var == 'shape'
+        if is_geom and ignore_geom:
+            handlers[var] = None
+            continue
+        to_uri, conv = _rdf_value_handler(asgs_type, mappings, var)
+        if var in rdf_to_float:
+            cast = float
+        elif var in to_int:
+            cast = int
+        else:
+            cast = None
+        if is_geom:
+            predicates = (GEO_hasGeometry,)
+        elif var in predicate_map:
+            predicate = predicate_map[var]
+            if predicate is INVERSE_TOKEN or predicate is IGNORE_TOKEN:
+                predicates = tuple()
+            else:
+                predicates = _predicates(predicate)
+        elif mappings == "loci":
+            if var == "object_id":
+                predicates = tuple()  # we don't care about the internal ASGS object id
+            elif var == "shape_length":
+                predicates = tuple()  # we can't represent feature length in LOCI RDF yet
+            else:
+                predicates = None  # NotImplementedError, if the feature has it
+        elif RDF_INCLUDE_UNKNOWN_PREDICATES:
+            predicates = (URIRef("{}/{}".format("WFS", var)),)
+        else:
+            predicates = tuple()
+        handlers[var] = (to_uri, conv, cast, predicates, is_geom)
+    derived = {}
+    for var in derived_vars:
+        to_uri, conv = _rdf_value_handler(asgs_type, mappings, var)
+        if var in predicate_map:
+            predicate = predicate_map[var]
+            predicates = tuple() if predicate is INVERSE_TOKEN else _predicates(predicate)
+        else:
+            predicates = (URIRef(var),)
+        derived[var] = (to_uri, conv, predicates)
+    return handlers, derived
 
 
-def asgs_features_geojson_converter(asgs_type, wfs_features):
-    if len(wfs_features) < 1:
-        return None
-    to_converter = {
-        'shape': gml_extract_geom_to_geojson,
-    }
-    to_float = ('shape_length', 'shape_area', 'albers_area')
-    to_int = ('object_id', 'category', 'state')
-    to_datetime = tuple()
-    is_geom = ('shape',)
-    is_optional = ('albers_area','shape')  # TODO: This should _not_ be optional!
-    features_list = []
-    if isinstance(wfs_features, (dict,)):
-        features_source = wfs_features.items()
-    elif isinstance(wfs_features, (list, set)):
-        features_source = iter(wfs_features)
-    else:
-        features_source = [wfs_features]
-
+def compile_conversion_plan(asgs_type):
+    """
+    :rtype: ConversionPlan
+    """
     tag_map = tag_map_lookup.get(asgs_type, common_tag_map)
+    tags, checks = _compile_tag_map(asgs_type, tag_map)
+    read_vars = {tv[1] for tv in tags.values() if tv is not None}
+    derived_vars = {data[2] for (_upper, kind, data) in checks if kind is not None}
+    geojson = {}
+    for var in read_vars:
+        if var in geojson_to_datetime:
+            geojson[var] = datetime
+        elif var in geojson_to_float:
+            geojson[var] = float
+        elif var in geojson_to_int:
+            geojson[var] = int
+        else:
+            geojson[var] = None
+    rdf = {}
+    derived = {}
+    for mappings in predicate_map_lookup:
+        rdf[mappings], derived[mappings] = _compile_rdf_handlers(asgs_type, mappings, read_vars, derived_vars)
+    ignore_geom = asgs_type == "STATE" or asgs_type == "AUS"
+    return ConversionPlan(asgs_type, tags, checks, ignore_geom, geojson, rdf, derived)
 
-    ignore_geom = False
-    if asgs_type == "STATE" or asgs_type == "AUS":
-        ignore_geom = True
 
-    for object_id, feat_elem in features_source:  # type: int, etree._Element
-        gj_dict = {"type": "Feature", "id": object_id, "geometry": {},
-                   "properties": {}}
-        used_tags = set()
-        for r in feat_elem.iterchildren():  # type: etree._Element
-            try:
-                var = tag_map[r.tag]
-            except KeyError:
-                used_tags.add(r.tag.upper())
-                continue
-            if isinstance(var, (list, tuple)):
-                tokens = var[0:-1]
-                var = var[-1]
-                if LOCAL_LOOKUP_TOKEN in tokens:
-                    # Don't process this tag yet, do it after all of the other WFS tags
-                    continue
-                if DERIVE_TOKEN in tokens:
-                    # Don't process this tag yet, do it after all of the other WFS tags
-                    continue
-            used_tags.add(r.tag.upper())
-            if var in is_geom and ignore_geom:
-                continue
-            if var in to_converter:
-                conv_func = to_converter[var]
-                val = conv_func(r)
-            else:
-                val = r.text
-            if var in to_datetime:
-                if val.endswith('Z'):
-                    val = val[:-1]
-                try:
-                    val = datetime.strptime(val, "%Y-%m-%dT%H:%M:%S")
-                except ValueError:
-                    val = "Invalid time format"
-            elif var in to_float:
-                val = float(val)
-            elif var in to_int:
-                val = int(val)
-            if var in is_geom:
-                gj_dict['geometry'] = val
+CONVERSION_PLANS = {t: compile_conversion_plan(t) for t in tag_map_lookup}
+
+
+def get_conversion_plan(asgs_type):
+    plan = CONVERSION_PLANS.get(asgs_type, None)
+    if plan is None:
+        plan = CONVERSION_PLANS[asgs_type] = compile_conversion_plan(asgs_type)
+    return plan
+
+
+class FeatureRecord(object):
+    """
+    One WFS feature member, decoded once, for every output to be made from: its properties
+    (with the looked up and derived ones), the WFS elements the RDF converters read, and its
+    geometry, which is only decoded from the GML when it is first asked for.
+    When the GML has been dropped from the shape element, geometry_loader is called instead,
+    it must set_geometry() on the record.
+    """
+
+    def __init__(self, plan, object_id, elements, properties, extra, shape):
+        """
+        :type plan: ConversionPlan
+        :param elements: (var, element) of the feature's tags, in document order
+        :param properties: var -> value, for the GeoJSON properties
+        :param extra: var -> value of just the looked up and derived properties
+        :param shape: the feature's shape element, or None
+        """
+        self.plan = plan
+        self.object_id = object_id
+        self.elements = elements
+        self.properties = properties
+        self.extra = extra
+        self.shape = shape
+        self.geometry_loader = None
+        self._geometry = None
+
+    @property
+    def geometry(self):
+        """
+        :return: the decoded geometry, or an empty dict if the feature has none (or its type's is ignored)
+        :rtype: CompactGeometry | dict
+        """
+        if self._geometry is None:
+            if self.shape is None or self.plan.ignore_geom:
+                self._geometry = {}
+            elif self.geometry_loader is not None:
+                self.geometry_loader()
+                if self._geometry is None:
+                    raise RuntimeError("Cannot find the geometry of feature {}".format(self.object_id))
             else:
-                gj_dict['properties'][var] = val
-        to_lookup = []
-        to_derive = []
-        for t in tag_map:
-            if t.upper() not in used_tags:
-                var = tag_map[t]
-                lookup_tuple = None
-                derive_tuple = None
-                if isinstance(var, (list, tuple)):
-                    tokens = var[0:-1]
-                    var = var[-1]
-                    if LOCAL_LOOKUP_TOKEN is tokens[0]:
-                        lookup_name = "{}_to_{}".format(asgs_type.lower(), var.lower())
-                        lookup_table = LOCAL_DATA_VAL_LOOKUPS.get(lookup_name, None)
-                        if lookup_table is None:
-                            raise RuntimeError("No local lookup table available for {}".format(lookup_name))
-                        # hardcoded "code" here for now, assume always lookup based on code
-                        lookup_tuple = (lookup_table, "code", var)
-                        used_tags.add(t.upper())
-                    elif DERIVE_TOKEN is tokens[0]:
-                        arg1, derive_fn = tokens[1]
-                        derive_tuple = (arg1, derive_fn, var)
-                if lookup_tuple is None and derive_tuple is None:
-                    if var in is_optional:
-                        pass
-                    else:
-                        raise RuntimeError("Need but didn't find tag: {}\nFound tags:\n{}".format(t, used_tags))
-                if lookup_tuple is not None:
-                    to_lookup.append(lookup_tuple)
-                if derive_tuple is not None:
-                    to_derive.append(derive_tuple)
-        for l in to_lookup:
-            lookup_table, key, var = l
-            try:
-                key = gj_dict['properties'][key]
-            except LookupError:
-                raise
+                self._geometry = gml_extract_geom_to_compact(self.shape)
+        return self._geometry
+
+    def set_geometry(self, geometry):
+        self._geometry = geometry
+
+
+def extract_feature_record(plan, object_id, feat_elem):
+    """
+    Decode one WFS feature member, without its geometry.
+
+    :type plan: ConversionPlan
+    :type feat_elem: etree._Element
+    :rtype: FeatureRecord
+    """
+    tags = plan.tags
+    casts = plan.geojson
+    used_tags = set()
+    elements = []
+    properties = {}
+    shape = None
+    for c in feat_elem.iterchildren():  # type: etree._Element
+        tag_var = tags.get(c.tag, _UNKNOWN_TAG)
+        if tag_var is None:
+            continue  # looked up or derived, after all of the other WFS tags
+        if tag_var is _UNKNOWN_TAG:
+            upper = _upper_tags.get(c.tag, None)
+            if upper is None:
+                upper = _upper_tags[c.tag] = c.tag.upper()
+            used_tags.add(upper)
+            continue
+        upper, var = tag_var
+        used_tags.add(upper)
+        elements.append((var, c))
+        if var == 'shape':
+            shape = c
+            continue
+        val = c.text
+        cast = casts[var]
+        if cast is datetime:
+            if val.endswith('Z'):
+                val = val[:-1]
             try:
-                ikey = int(key)
+                val = datetime.strptime(val, "%Y-%m-%dT%H:%M:%S")
             except ValueError:
-                ikey = None
-            val = lookup_table.get(ikey, None) if ikey is not None else None
-            if val is None:
-                try:
-                    val = lookup_table[key]
-                except LookupError:
-                    raise RuntimeError("Cannot get local lookup value for item with key: {}".format(key))
-            gj_dict['properties'][var] = val
-        for d in to_derive:
-            p1, derive_fn, var = d
+                val = "Invalid time format"
+        elif cast is not None:
+            val = cast(val)
+        properties[var] = val
+    extra = _look_up_and_derive(plan, used_tags, properties)
+    return FeatureRecord(plan, object_id, elements, properties, extra, shape)
+
+
+def _look_up_and_derive(plan, used_tags, values):
+    """
+    Looks up and derives the vars the feature's tags left, from the values found on the
+    feature, and checks no required tag is missing.
+
+    :param values: var -> value, updated with the looked up and derived values
+    :return: var -> value of just the looked up and derived values
+    :rtype: dict
+    """
+    to_lookup = []
+    to_derive = []
+    for (upper, kind, data) in plan.checks:
+        if upper in used_tags:
+            continue
+        if kind is LOCAL_LOOKUP_TOKEN:
+            if data[0] is None:
+                raise RuntimeError("No local lookup table available for {}".format(data[3]))
+            to_lookup.append(data)
+        elif kind is DERIVE_TOKEN:
+            to_derive.append(data)
+        else:
+            raise RuntimeError("Need but didn't find tag: {}\nFound tags:\n{}".format(data, used_tags))
+    extra_data_keyvals = {}
+    for (lookup_table, key, var, _lookup_name) in to_lookup:
+        key = values[key]
+        try:
+            ikey = int(key)
+        except ValueError:
+            ikey = None
+        val = lookup_table.get(ikey, None) if ikey is not None else None
+        if val is None:
             try:
-                arg1 = gj_dict['properties'][p1]
+                val = lookup_table[key]
             except LookupError:
-                raise RuntimeError("Need to derive {} from {}, but we don't know {}".format(var, p1, p1))
+                raise RuntimeError("Cannot get local lookup value for item with key: {}".format(key))
+        values[var] = val
+        extra_data_keyvals[var] = val
+    for (p1, derive_fn, var) in to_derive:
+        try:
+            arg1 = values[p1]
+        except LookupError:
+            raise RuntimeError("Need to derive {} from {}, but we don't know {}".format(var, p1, p1))
+        try:
+            val = derive_fn(arg1)
+        except Exception as e:
+            raise RuntimeError("Cannot derive {} from {}, error:\n{}".format(var, p1, repr(e)))
+        values[var] = val
+        extra_data_keyvals[var] = val
+    return extra_data_keyvals
+
+
+def _features_source(wfs_features):
+    if isinstance(wfs_features, (dict,)):
+        return wfs_features.items()
+    elif isinstance(wfs_features, (list, set)):
+        return iter(wfs_features)
+    return [wfs_features]
+
+
+def extract_feature_records(asgs_type, wfs_features):
+    """
+    :param wfs_features: object_id -> feature element, as wfs_find_features gives them,
+                         or a list of (object_id, feature element)
+    :rtype: list[FeatureRecord]
+    """
+    plan = get_conversion_plan(asgs_type)
+    return [extract_feature_record(plan, object_id, feat_elem)
+            for object_id, feat_elem in _features_source(wfs_features)]
+
+
+def feature_record_to_geojson(record):
+    """
+    :type record: FeatureRecord
+    :return: a GeoJSON Feature dict, with the geometry decoded
+    """
+    geometry = record.geometry
+    if isinstance(geometry, CompactGeometry):
+        geometry = geometry.to_geojson(precision=conf.GEOJSON_COORDINATE_PRECISION)
+    return {"type": "Feature", "id": record.object_id, "geometry": geometry,
+            "properties": dict(record.properties)}
+
+
+def feature_record_to_triples(record, canonical_uri, mappings='geosparql', geometry_encoding='gml', triples=None,
+                              shape=None):
+    """
+    :type record: FeatureRecord
+    :param triples: a set to add the triples to
+    :param shape: the feature's full shape element, for a streamed record whose GML was dropped
+    :return: the set of triples
+    :rtype: set
+    """
+    if triples is None:
+        triples = set()
+    asgs_type = record.plan.asgs_type
+    handlers = record.plan.rdf[mappings]
+    derived = record.plan.derived[mappings]
+    feature_uri = rdflib.URIRef(canonical_uri)
+    triples.add((feature_uri, RDF_a, GEO_Feature))
+    triples.add((feature_uri, RDF_a, ASGS.Feature))
+
+    def convert_shape(x):
+        if mappings == 'loci':
+            lazy_id = str(canonical_uri).split('/')[-1]
+            return None, URIRef("".join([conf.GEOMETRY_SERVICE_URI, geometry_service_routes[asgs_type], lazy_id]))
+        if shape is not None:
+            x = shape
+        return gml_extract_geom_to_geosparql(x, encoding=geometry_encoding)
+
+    for var, c in record.elements:
+        handler = handlers[var]
+        if handler is None:
+            continue  # an ignored geometry
+        to_uri, conv_func, cast, predicates, is_geom = handler
+        if to_uri is not None:
+            val = to_uri(c)
+        elif conv_func is not None:
+            if conv_func is SHAPE_TOKEN:
+                conv_func = convert_shape
+            _triples, val = conv_func(c)
+            if _triples:
+                triples.update(_triples)
+        else:
+            val = c.text
+        if cast is float:
+            val = Literal(float(val))
+        elif cast is int:
             try:
-                gj_dict['properties'][var] = derive_fn(arg1)
-            except Exception as e:
-                raise RuntimeError("Cannot derive {} from {}, error:\n{}".format(var, p1, repr(e)))
-        features_list.append(gj_dict)
-    return features_list
+                val = int(val)
+            except ValueError:
+                val = str(val)
+            val = Literal(val)
+        elif not isinstance(val, (URIRef, Literal, BNode)):
+            val = Literal(str(val))
+        if predicates is None:
+            raise NotImplementedError(var)
+        for p in predicates:
+            triples.add((feature_uri, p, val))
+
+    for (var, val) in record.extra.items():
+        to_uri, conv_func, predicates = derived[var]
+        if to_uri is not None:
+            val = to_uri(FakeXMLElement(var, str(val)))
+        elif conv_func is not None:
+            if conv_func is SHAPE_TOKEN:
+                conv_func = convert_shape
+            _triples, val = conv_func(FakeXMLElement(var, str(val)))
+            if _triples:
+                triples.update(_triples)
+        for p in predicates:
+            triples.add((feature_uri, p, val))
+    return triples
+
+
+def asgs_features_geojson_converter(asgs_type, wfs_features):
+    if len(wfs_features) < 1:
+        return None
+    return [feature_record_to_geojson(r) for r in extract_feature_records(asgs_type, wfs_features)]
 
 
-def asgs_features_triples_converter(asgs_type, canonical_uri, *args, mappings='geosparql'):
+def asgs_features_triples_converter(asgs_type, canonical_uri, *args, mappings='geosparql', geometry_encoding='gml'):
     # this coverter is used for the "asgs" and "geosparql" ontology mappings
     if len(args) < 1:
         return None
     wfs_features = args[0]
     if len(wfs_features) < 1:
         return None
-    if mappings == 'loci':
-        lazy_id = str(canonical_uri).split('/')[-1]
-        no_triples = set()
-        to_uri = {
-            'sa1': lambda x: URIRef(conf.URI_SA1_INSTANCE_BASE + x.text),
-            'sa2': lambda x: URIRef(conf.URI_SA2_INSTANCE_BASE + x.text),
-            'sa3': lambda x: URIRef(conf.URI_SA3_INSTANCE_BASE + x.text),
-            'sa4': lambda x: URIRef(conf.URI_SA4_INSTANCE_BASE + x.text),
-            'dzn': lambda x: URIRef(conf.URI_DZN_INSTANCE_BASE + x.text),
-            'ssc': lambda x: URIRef(conf.URI_SSC_INSTANCE_BASE + x.text),
-            'nrmr': lambda x: URIRef(conf.URI_NRMR_INSTANCE_BASE + x.text),
-            'gccsa': lambda x: URIRef(conf.URI_GCCSA_INSTANCE_BASE + x.text),
-            'iloc': lambda x: URIRef(conf.URI_ILOC_INSTANCE_BASE + x.text),
-            'iare': lambda x: URIRef(conf.URI_IARE_INSTANCE_BASE + x.text),
-            'ireg': lambda x: URIRef(conf.URI_IREG_INSTANCE_BASE + x.text),
-            'ucl': lambda x: URIRef(conf.URI_UCL_INSTANCE_BASE + x.text),
-            'sosr': lambda x: URIRef(conf.URI_SOSR_INSTANCE_BASE + x.text),
-            'sos': lambda x: URIRef(conf.URI_SOS_INSTANCE_BASE + x.text),
-            'sua': lambda x: URIRef(conf.URI_SUA_INSTANCE_BASE + x.text),
-            'ra': lambda x: URIRef(conf.URI_RA_INSTANCE_BASE + x.text),
-            'lga': lambda x: URIRef(conf.URI_LGA_INSTANCE_BASE + x.text),
-            'ced': lambda x: URIRef(conf.URI_CED_INSTANCE_BASE + x.text),
-            'state': lambda x: URIRef(conf.URI_STATE_INSTANCE_BASE + state_id_map.get(int(x.text),'OT')) if STATES_USE_NAMEABBREV \
-                else URIRef(conf.URI_STATE_INSTANCE_BASE + x.text),
-        }
-        to_converter = {
-            'shape': lambda x: (no_triples, URIRef("".join([conf.GEOMETRY_SERVICE_URI, geometry_service_routes[asgs_type], lazy_id]))),
-            'shape_area': partial(gml_extract_shapearea_to_geox_area, crs=CRS_EPSG["3857"]),  # cartesian area from asgs using "pseudo-mercator" projection
-            'albers_area': partial(gml_extract_shapearea_to_geox_area, extra_transform=lambda x: (set(), float(x) * 1000000.0), crs=CRS_EPSG["3577"]),  # cartesian GDA-94 CRS using "Albers_Conic_Equal_Area" projection
-            'code': lambda x: (no_triples, Literal(x.text, datatype=feature_identification_types[asgs_type])),
-            'category_code': lambda x: (no_triples, ASGS_CAT.term(x.text))
-        }
-        to_int = ('object_id',)
-    else:
-        to_uri = {}
-        to_converter = {
-            'shape': gml_extract_geom_to_geosparql,
-            'shape_area': partial(gml_extract_shapearea_to_geox_area, crs=CRS_EPSG["3857"]), #cartesian area from asgs using "pseudo-mercator" projection
-            'albers_area': partial(gml_extract_shapearea_to_geox_area, extra_transform=lambda x: (set(), float(x)*1000000), crs=CRS_EPSG["3577"]) #cartesian GDA-94 CRS using "Albers_Conic_Equal_Area" projection
-        }
-        to_int = ('object_id', 'category', 'state')
-    to_float = ('shape_length',)
-    is_geom = ('shape',)
-    is_optional = ('shape','albers_area')  # TODO: This should _not_ be optional!
-
-    features_list = []
-    if isinstance(wfs_features, (dict,)):
-        features_source = wfs_features.items()
-    elif isinstance(wfs_features, (list, set)):
-        features_source = iter(wfs_features)
-    else:
-        features_source = [wfs_features]
-
-    tag_map = tag_map_lookup.get(asgs_type, common_tag_map)
-    predicate_map = predicate_map_lookup[mappings].get(asgs_type, common_predicate_map_asgs)
-    ignore_geom = False
-    if mappings != "loci" and (asgs_type == "STATE" or asgs_type == "AUS"):
-        ignore_geom = True
-
     triples = set()
     feature_nodes = []
-    for object_id, feat_elem in features_source:  # type: int, etree._Element
-        feature_uri = rdflib.URIRef(canonical_uri)
-        triples.add((feature_uri, RDF_a, GEO_Feature))
-        triples.add((feature_uri, RDF_a, ASGS.Feature))
-        used_tags = set()
-        kv_map = {}
-        for c in feat_elem.iterchildren():  # type: etree._Element
-            try:
-                var = tag_map[c.tag]
-            except KeyError:
-                used_tags.add(c.tag.upper())
-                continue
-            if isinstance(var, (list, tuple)):
-                tokens = var[0:-1]
-                var = var[-1]
-                if LOCAL_LOOKUP_TOKEN in tokens:
-                    continue
-                if DERIVE_TOKEN in tokens:
-                    continue
-            used_tags.add(c.tag.upper())
-            if var in is_geom and ignore_geom:
-                continue
-            if var in to_uri:
-                conv_func = to_uri[var]
-                val = conv_func(c)
-            elif var in to_converter:
-                conv_func = to_converter[var]
-                _triples, val = conv_func(c)
-                for (s, p, o) in iter(_triples):
-                    triples.add((s, p, o))
-            else:
-                val = c.text
-            if var in to_float:
-                val = Literal(float(val))
-            elif var in to_int:
-                try:
-                    val = int(val)
-                except ValueError:
-                    val = str(val)
-                val = Literal(val)
-            else:
-                if not isinstance(val, (URIRef, Literal, BNode)):
-                    val = Literal(str(val))
-            if var in is_geom:
-                triples.add((feature_uri, GEO_hasGeometry, val))
-            elif var in predicate_map.keys():
-                predicate = predicate_map[var]
-                if predicate is INVERSE_TOKEN or predicate is IGNORE_TOKEN:
-                    continue
-                if not isinstance(predicate, list):
-                    predicate = [predicate]
-                for p in predicate:
-                    if p is INVERSE_TOKEN:
-                        continue
-                    triples.add((feature_uri, p, val))
-                    kv_map[var] = val
-            else:
-                if mappings == "loci":
-                    if var == "object_id":
-                        pass  # we don't care about the internal ASGS object id
-                    elif var == "shape_length":
-                        pass  # we can't represent feature length in LOCI RDF yet
-                    else:
-                        raise NotImplementedError(var)
-                elif RDF_INCLUDE_UNKNOWN_PREDICATES:
-                        dummy_prop = URIRef("{}/{}".format("WFS", var))
-                        triples.add((feature_uri, dummy_prop, val))
-                else:
-                    pass
-
-        to_lookup = []
-        to_derive = []
-        for t in tag_map:
-            if t.upper() not in used_tags:
-                var = tag_map[t]
-                lookup_tuple = None
-                derive_tuple = None
-                if isinstance(var, (list, tuple)):
-                    tokens = var[0:-1]
-                    var = var[-1]
-                    if LOCAL_LOOKUP_TOKEN is tokens[0]:
-                        lookup_name = "{}_to_{}".format(asgs_type.lower(), var.lower())
-                        lookup_table = LOCAL_DATA_VAL_LOOKUPS.get(lookup_name, None)
-                        if lookup_table is None:
-                            raise RuntimeError("No local lookup table available for {}".format(lookup_name))
-                        # hardcoded "code" here for now, assume always lookup based on code
-                        lookup_tuple = (lookup_table, "code", var)
-                    elif DERIVE_TOKEN is tokens[0]:
-                        arg1, derive_fn = tokens[1]
-                        derive_tuple = (arg1, derive_fn, var)
-                if lookup_tuple is None and derive_tuple is None:
-                    if var in is_optional:
-                        pass
-                    else:
-                        raise RuntimeError("Need but didn't find tag: {}\nFound tags:\n{}".format(t, used_tags))
-                if lookup_tuple is not None:
-                    to_lookup.append(lookup_tuple)
-                if derive_tuple is not None:
-                    to_derive.append(derive_tuple)
-        extra_data_keyvals = {}
-        for l in to_lookup:
-            lookup_table, key, var = l
-            try:
-                key = kv_map[key]
-            except LookupError:
-                raise
-            try:
-                ikey = int(key)
-            except ValueError:
-                ikey = None
-            val = lookup_table.get(ikey, None) if ikey is not None else None
-            if val is None:
-                try:
-                    val = lookup_table[key]
-                except LookupError:
-                    raise RuntimeError("Cannot get local lookup value for item with key: {}".format(key))
-            kv_map[var] = val
-            extra_data_keyvals[var] = val
-        for d in to_derive:
-            p1, derive_fn, var = d
-            try:
-                arg1 = kv_map[p1]
-            except LookupError:
-                raise RuntimeError("Need to derive {} from {}, but we don't know {}".format(var, p1, p1))
-            try:
-                val = derive_fn(arg1)
-            except Exception as e:
-                raise RuntimeError("Cannot derive {} from {}, error:\n{}".format(var, p1, repr(e)))
-            kv_map[var] = val
-            extra_data_keyvals[var] = val
-        for (var, val) in extra_data_keyvals.items():
-            if var in to_uri:
-                conv_func = to_uri[var]
-                try:
-                    c = FakeXMLElement(var, str(val))
-                    val = conv_func(c)
-                except Exception as e:
-                    raise
-            elif var in to_converter:
-                conv_func = to_converter[var]
-                try:
-                    c = FakeXMLElement(var, str(val))
-                    _triples, val = conv_func(c)
-                except Exception as e:
-                    raise
-                for (s, p, o) in iter(_triples):
-                    triples.add((s, p, o))
-            if var in predicate_map:
-                found_predicates = []
-                predicate = predicate_map[var]
-                if predicate is INVERSE_TOKEN:
-                    continue
-                if not isinstance(predicate, list):
-                    predicate = [predicate]
-                for p in predicate:
-                    if p is INVERSE_TOKEN:
-                        continue
-                    found_predicates.append(p)
-            else:
-                found_predicates = [URIRef(var)]
-            for p in found_predicates:
-                triples.add((feature_uri, p, val))
-
-        features_list.append(feature_uri)
+    for record in extract_feature_records(asgs_type, wfs_features):
+        feature_record_to_triples(record, canonical_uri, mappings=mappings,
+                                  geometry_encoding=geometry_encoding, triples=triples)
     return triples, feature_nodes
 
 
+def extract_asgs_feature_records(asgs_type, tree):
+    """
+    :return: a FeatureRecord for each feature member in the WFS FeatureCollection tree
+    :rtype: list[FeatureRecord]
+    """
+    features = wfs_find_features(tree, 'WFS', asgs_type)
+    if not features:
+        return []
+    return extract_feature_records(asgs_type, features)
+
+
+def feature_records_to_rdf(records, canonical_uri, mappings='geosparql', geometry_encoding='gml', g=None,
+                           shapes=None):
+    """
+    :param shapes: (object_id, shape element) of each record, in the same order, for streamed records
+        whose GML was dropped. See iter_streamed_shapes.
+    """
+    if g is None:
+        g = TripleWriter()
+    triples = set()
+    if shapes is not None:
+        shapes = iter(shapes)
+    for record in records:
+        shape = None
+        if shapes is not None:
+            object_id, shape = next(shapes, (None, None))
+            if object_id != record.object_id:
+                raise RuntimeError("The WFS response for feature {} has changed".format(record.object_id))
+        feature_record_to_triples(record, canonical_uri, mappings=mappings,
+                                  geometry_encoding=geometry_encoding, triples=triples, shape=shape)
+    if shapes is not None and next(shapes, None) is not None:
+        raise RuntimeError("The WFS response for feature {} has changed".format(canonical_uri))
+    for (s, p, o) in iter(triples):
+        g.add((s, p, o))
+    return g
+
+
 def extract_asgs_features_as_geojson(asgs_type, tree):
     geojson_features = wfs_extract_features_as_geojson(
         tree, 'WFS', asgs_type,
@@ -1016,60 +1219,342 @@ def extract_asgs_features_as_rdf(asgs_type, tree, ont_conv, g=None):
     triples, features = wfs_extract_features_with_rdf_converter(
         tree, 'WFS', asgs_type, ont_conv)
     if g is None:
-        g = rdflib.Graph()
+        g = TripleWriter()
     for (s, p, o) in iter(triples):
         g.add((s, p, o))
     return g
 
 def retryable_request(uri, method, retries=3, delay=2):
-    if retries < 0:
-        raise RuntimeError("Too many retries on URL request")
-    try:
-        r = Request(uri, method=method)
-        resp = urlopen(r)  # not using with: so will not automatically close
-        if not (200 <= resp.status <= 299):
-            if resp.status == 404:
+    """
+    Make a WFS request, retrying failures with a capped, jittered backoff.
+    Fails fast with ServiceUnavailableError while the service's circuit breaker is open.
+    """
+    breaker = wfs_breakers.for_url(uri)
+    while True:
+        if not breaker.allow():
+            raise ServiceUnavailableError("WFS service {} is unavailable.".format(breaker.name))
+        try:
+            resp = wfs_pool.request(method, uri)  # not using with: so will not automatically close
+        except Exception as e:
+            print(e)
+            breaker.record_failure(e)
+            error = e
+        else:
+            if 200 <= resp.status <= 299:
+                breaker.record_success()
+                return resp
+            status = resp.status
+            resp.close()
+            print("URL:{}\nHTTP Error: {}".format(uri, status))
+            if status == 404:
+                breaker.record_success()  # the service is up, it just doesn't have it
                 raise NotFoundError()
-            raise RuntimeError("Cannot get feature index from WFS backend.")
-        return resp
-    except HTTPError as he:
-        print("URL:{}\nHTTP Error: {}".format(uri, he.code))
-        if he.code == 404:
-            raise NotFoundError()
-        if retries < 1:
-            raise
-    except Exception as e:
-        print(e)
-        if retries < 1:
+            error = RuntimeError("Cannot get feature from WFS backend.")
+            breaker.record_failure(error)
+        if retries < 1 or breaker.is_open:
+            raise error
+        print("retrying...")
+        time.sleep(min(delay, conf.WFS_RETRY_MAX_DELAY) * random.uniform(0.5, 1.0))
+        retries -= 1
+        delay *= 2
+
+class _PrefixedReader(object):
+    """
+    File-like, reads the bytes already taken from the start of a stream, then the rest of the stream.
+    """
+
+    def __init__(self, prefix, stream):
+        self._prefix = io.BytesIO(prefix)
+        self._stream = stream
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            return self._prefix.read() + self._stream.read()
+        data = self._prefix.read(size)
+        if data:
+            return data
+        return self._stream.read(size)
+
+
+def _peek_wfs_features(resp, chunk_size=65536):
+    """
+    Read the start of a WFS response, as far as its first feature.
+
+    :return: (the bytes read, True if it is a FeatureCollection with at least one member)
+    :rtype: tuple[bytes, bool]
+    """
+    parser = etree.XMLPullParser(events=('start',), huge_tree=True)
+    chunks = []
+    root = None
+    while True:
+        chunk = resp.read(chunk_size)
+        if not chunk:
+            return b"".join(chunks), False
+        chunks.append(chunk)
+        try:
+            parser.feed(chunk)
+        except etree.XMLSyntaxError:
+            return b"".join(chunks), False
+        for _event, element in parser.read_events():
+            if root is not None:
+                return b"".join(chunks), True
+            root = element
+            if root.tag != "{{{}}}FeatureCollection".format(ns['wfs']):
+                return b"".join(chunks), False
+
+
+def cached_wfs_request(uri, retries=3, delay=2):
+    """
+    GET a WFS URL through the disk cache. On a miss the response is streamed
+    into the cache, then read back from it.
+    Only a FeatureCollection with features is cached. An ExceptionReport or an empty collection
+    can come from a backend having trouble, it is returned but not kept for the cache TTL.
+
+    :return: a file-like object of the response body, close it when done
+    """
+    if WFS_DISK_CACHE is None:
+        return retryable_request(uri, 'GET', retries=retries, delay=delay)
+    cached = WFS_DISK_CACHE.open(uri)
+    if cached is not None:
+        return cached
+    try:
+        resp = retryable_request(uri, 'GET', retries=retries, delay=delay)
+    except NotFoundError:
+        raise
+    except Exception:
+        # the WFS is down, an expired copy is better than nothing
+        cached = WFS_DISK_CACHE.open(uri, allow_stale=True)
+        if cached is None:
             raise
-    print("retrying...")
-    time.sleep(delay)
-    return retryable_request(uri, method, retries=retries-1, delay=delay*2)
+        print("Serving stale cached WFS response for: {}".format(uri))
+        return cached
+    try:
+        head, has_features = _peek_wfs_features(resp)
+        if not has_features:
+            return io.BytesIO(head + resp.read())
+        WFS_DISK_CACHE.put_stream(uri, _PrefixedReader(head, resp))
+    finally:
+        resp.close()
+    cached = WFS_DISK_CACHE.open(uri, allow_stale=True)  # we've only just written it
+    if cached is None:
+        raise RuntimeError("Cannot read back cached WFS response for: {}".format(uri))
+    return cached
+
+
+def make_xml_parser(asgs_type):
+    # Some types have _huge_ geometries that blow out the XML parser, enable huge_tree for them
+    if asgs_type in conf.WFS_STREAMING_PARSE_TYPES:
+        return etree.XMLParser(recover=False, huge_tree=True)
+    return etree.XMLParser(recover=False)
+
 
-@lru_cache(maxsize=128)
 def retrieve_asgs_feature(asgs_type, identifier, local=True):
     if identifier.startswith("http:") or identifier.startswith("https:"):
         identifier = identifier.split('/')[-1]
+    cache_key = (asgs_type, identifier)
+    tree = FEATURE_CACHE.get(cache_key)
+    if tree is None:
+        if cache_key in NOT_FOUND_CACHE:
+            raise NotFoundError()
+        try:
+            # Concurrent requests for the same feature share one upstream fetch
+            tree = IN_FLIGHT_FETCHES.do(
+                ('tree', asgs_type, identifier), _retrieve_asgs_feature_to_cache,
+                asgs_type, identifier, local=local)
+        except NotFoundError:
+            NOT_FOUND_CACHE.put(cache_key, True)
+            raise
+    return tree
 
-    tree = None
-    # Some types have _huge_ geometries that blow out the XML parser, enable huge_tree for them
-    if asgs_type in { "STATE", "AUS", "GCCSA", "SUA", "IREG", "SOS" }:
-        parser = etree.XMLParser(recover=False, huge_tree=True)
-    else:
-        parser = etree.XMLParser(recover=False)
-    if local:  # a stub to use a local file for testing
-        xml_file = os.path.join(
-            os.path.dirname(
-                os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
-            'test',
-            asgs_type + '_' + identifier + '.xml')
-        gz_file = xml_file + ".gz"
-        if os.path.exists(gz_file):
-            local_file = gzip.GzipFile(gz_file, 'rb', compresslevel=9)
-        elif os.path.exists(xml_file):
-            local_file = open(xml_file, 'rb')
+
+def _retrieve_asgs_feature_to_cache(asgs_type, identifier, local=True):
+    cache_key = (asgs_type, identifier)
+    tree = FEATURE_CACHE.get(cache_key)  # it may have arrived while we were waiting
+    if tree is None:
+        tree = _retrieve_asgs_feature(asgs_type, identifier, local=local)
+        FEATURE_CACHE.put(cache_key, tree)
+    return tree
+
+
+def retrieve_asgs_feature_records(asgs_type, identifier, local=True):
+    """
+    The feature decoded to FeatureRecords, from the tree retrieve_asgs_feature gives.
+
+    :rtype: list[FeatureRecord]
+    """
+    if identifier.startswith("http:") or identifier.startswith("https:"):
+        identifier = identifier.split('/')[-1]
+    cache_key = (asgs_type, identifier)
+    records = FEATURE_RECORD_CACHE.get(cache_key)
+    if records is None:
+        tree = retrieve_asgs_feature(asgs_type, identifier, local=local)
+        records = extract_asgs_feature_records(asgs_type, tree)
+        FEATURE_RECORD_CACHE.put(cache_key, records)
+    return records
+
+
+def retrieve_asgs_features(asgs_type, identifiers, batch_size=None):
+    """
+    Retrieve many features of the same ASGS type, using one WFS GetFeature
+    request per batch of identifiers rather than one request per identifier.
+    Every feature found is put in the feature cache, so subsequent
+    retrieve_asgs_feature calls for them don't go to the WFS.
+
+    :param asgs_type:
+    :type asgs_type: str
+    :param identifiers:
+    :type identifiers: list[str]
+    :param batch_size: max identifiers per WFS request, defaults to conf.WFS_BATCH_SIZE
+    :type batch_size: int
+    :return: identifier -> FeatureCollection tree, for every identifier that was found
+    :rtype: dict[str, etree._ElementTree]
+    """
+    if batch_size is None:
+        batch_size = conf.WFS_BATCH_SIZE
+    batch_size = max(int(batch_size), 1)
+    wfs_type = ASGS_WFS_LOOKUP[asgs_type]  # type: AsgsWfsType
+    property_name = wfs_type.propertyname.split(':')[-1]
+    found = {}
+    to_fetch = []
+    for identifier in identifiers:
+        identifier = str(identifier)
+        if identifier.startswith("http:") or identifier.startswith("https:"):
+            identifier = identifier.split('/')[-1]
+        tree = FEATURE_CACHE.get((asgs_type, identifier))
+        if tree is not None:
+            found[identifier] = tree
+        elif (asgs_type, identifier) in NOT_FOUND_CACHE:
+            continue
+        elif identifier not in to_fetch:
+            to_fetch.append(identifier)
+    store = get_feature_store()
+    if store is not None:
+        remaining = []
+        for identifier in to_fetch:
+            code = state_code_map.get(identifier, identifier) if asgs_type == "STATE" else identifier
+            body = store.get(asgs_type, code)
+            if body is None:
+                remaining.append(identifier)
+                continue
+            tree = etree.ElementTree(etree.fromstring(body, parser=make_xml_parser(asgs_type)))
+            FEATURE_CACHE.put((asgs_type, identifier), tree)
+            found[identifier] = tree
+        to_fetch = remaining
+    if conf.FEATURE_STORE_OFFLINE:
+        return found
+    for i in range(0, len(to_fetch), batch_size):
+        batch = to_fetch[i:i + batch_size]
+        # The WFS holds states by STATE_CODE_2016, not the name abbrevs they are identified by here
+        if asgs_type == "STATE":
+            codes = [state_code_map.get(identifier, identifier) for identifier in batch]
         else:
-            local_file = None
+            codes = batch
+        wfs_uri = ASGSFeature.construct_wfs_query_for_features(asgs_type, codes)
+        resp = cached_wfs_request(wfs_uri)
+        try:
+            tree = etree.parse(resp, parser=make_xml_parser(asgs_type))
+        except Exception:
+            raise RuntimeError("Cannot decode XML from WFS endpoint")
+        finally:
+            try:
+                resp.close()
+            except:
+                pass
+        if tree.getroot().tag != "{{{}}}FeatureCollection".format(ns['wfs']):
+            # not a FeatureCollection, eg an ExceptionReport, it says nothing about which features exist
+            raise RuntimeError("Unexpected response from WFS endpoint, not a FeatureCollection")
+        split_trees = wfs_split_features(tree, 'WFS', asgs_type, property_name)
+        for identifier, code in zip(batch, codes):
+            try:
+                feature_tree = split_trees[code]
+            except KeyError:
+                NOT_FOUND_CACHE.put((asgs_type, identifier), True)
+                continue
+            FEATURE_CACHE.put((asgs_type, identifier), feature_tree)
+            found[identifier] = feature_tree
+    return found
+
+
+def _open_local_feature_file(asgs_type, identifier):
+    """
+    Open the feature's WFS FeatureCollection XML from a local source,
+    the test fixtures first, then the offline feature store.
+
+    :return: a file-like object, or None if the feature is not held locally
+    """
+    xml_file = os.path.join(
+        os.path.dirname(
+            os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+        'test',
+        asgs_type + '_' + identifier + '.xml')
+    gz_file = xml_file + ".gz"
+    if os.path.exists(gz_file):
+        return gzip.GzipFile(gz_file, 'rb', compresslevel=9)
+    elif os.path.exists(xml_file):
+        return open(xml_file, 'rb')
+    store = get_feature_store()
+    if store is not None:
+        if asgs_type == "STATE":
+            identifier = state_code_map.get(identifier, identifier)
+        return store.open(asgs_type, identifier)
+    return None
+
+
+def _open_wfs_feature(asgs_type, identifier):
+    if conf.FEATURE_STORE_OFFLINE:
+        raise NotFoundError()
+    # The WFS holds states by STATE_CODE_2016, not the name abbrevs they are identified by here
+    code = state_code_map.get(identifier, identifier) if asgs_type == "STATE" else identifier
+    wfs_uri = ASGSFeature.construct_wfs_query_for_feature_type(asgs_type, code)
+    return cached_wfs_request(wfs_uri)
+
+
+def open_raw_asgs_feature(asgs_type, identifier):
+    """
+    Open the feature's WFS FeatureCollection XML as the bytes are held, without parsing it.
+    Looks in the same places as retrieve_asgs_feature, the test fixtures, the feature store,
+    then the WFS through the disk cache.
+
+    :return: (file-like object, True if its content is gzip compressed)
+    :rtype: tuple
+    """
+    xml_file = os.path.join(
+        os.path.dirname(
+            os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+        'test',
+        asgs_type + '_' + identifier + '.xml')
+    if os.path.exists(xml_file + ".gz"):
+        return open(xml_file + ".gz", 'rb'), True
+    elif os.path.exists(xml_file):
+        return open(xml_file, 'rb'), False
+    # The store and the WFS hold states by STATE_CODE_2016, not the name abbrevs they are identified by here
+    code = state_code_map.get(identifier, identifier) if asgs_type == "STATE" else identifier
+    store = get_feature_store()
+    if store is not None:
+        body = store.get_compressed(asgs_type, code)
+        if body is not None:
+            return io.BytesIO(body), True
+    if conf.FEATURE_STORE_OFFLINE:
+        raise NotFoundError()
+    wfs_uri = ASGSFeature.construct_wfs_query_for_feature_type(asgs_type, code)
+    if WFS_DISK_CACHE is None:
+        return retryable_request(wfs_uri, 'GET'), False
+    raw = WFS_DISK_CACHE.open_compressed(wfs_uri)
+    if raw is None:
+        resp = cached_wfs_request(wfs_uri)  # fills the disk cache
+        raw = WFS_DISK_CACHE.open_compressed(wfs_uri, allow_stale=True)
+        if raw is None:
+            # not kept in the disk cache, eg an ExceptionReport
+            return resp, False
+        resp.close()
+    return raw, True
+
+
+def _retrieve_asgs_feature(asgs_type, identifier, local=True):
+    tree = None
+    parser = make_xml_parser(asgs_type)
+    if local:
+        local_file = _open_local_feature_file(asgs_type, identifier)
         if local_file:
             try:
                 tree = etree.parse(local_file, parser=parser)
@@ -1086,9 +1571,7 @@ def retrieve_asgs_feature(asgs_type, identifier, local=True):
                     except Exception:
                         pass
     if tree is None:
-        wfs_uri = ASGSFeature.construct_wfs_query_for_feature_type(
-            asgs_type, identifier)
-        resp = retryable_request(wfs_uri, 'GET', retries=3, delay=2)
+        resp = _open_wfs_feature(asgs_type, identifier)
         try:
             tree = etree.parse(resp, parser=parser)
         except Exception:
@@ -1104,6 +1587,142 @@ def retrieve_asgs_feature(asgs_type, identifier, local=True):
     return tree
 
 
+def retrieve_asgs_feature_streamed(asgs_type, identifier, local=True):
+    """
+    Streaming counterpart of retrieve_asgs_feature_records.
+    The WFS response is parsed one gml:member at a time, each member is decoded to a
+    FeatureRecord as soon as it is complete, and its GML geometry dropped without being decoded.
+    The full XML tree is never held, the records' elements are those of a slim
+    FeatureCollection tree (feature properties without geometry). The geometries are only
+    decoded if they are asked for, by streaming the WFS response again, see _load_streamed_geometries.
+
+    :return: the feature's records
+    :rtype: list[FeatureRecord]
+    """
+    if identifier.startswith("http:") or identifier.startswith("https:"):
+        identifier = identifier.split('/')[-1]
+    cache_key = (asgs_type, identifier)
+    streamed = STREAMED_FEATURE_CACHE.get(cache_key)
+    if streamed is None:
+        if cache_key in NOT_FOUND_CACHE:
+            raise NotFoundError()
+        try:
+            streamed = IN_FLIGHT_FETCHES.do(
+                ('streamed', asgs_type, identifier), _stream_asgs_feature_to_cache,
+                asgs_type, identifier, local=local)
+        except NotFoundError:
+            NOT_FOUND_CACHE.put(cache_key, True)
+            raise
+    return streamed
+
+
+def _stream_asgs_feature_to_cache(asgs_type, identifier, local=True):
+    cache_key = (asgs_type, identifier)
+    streamed = STREAMED_FEATURE_CACHE.get(cache_key)
+    if streamed is None:
+        streamed = _stream_asgs_feature(asgs_type, identifier, local=local)
+        STREAMED_FEATURE_CACHE.put(cache_key, streamed)
+    return streamed
+
+
+def _open_feature_source(asgs_type, identifier, local=True):
+    source = _open_local_feature_file(asgs_type, identifier) if local else None
+    if source is None:
+        source = _open_wfs_feature(asgs_type, identifier)
+    return source
+
+
+def _stream_asgs_feature(asgs_type, identifier, local=True):
+    source = _open_feature_source(asgs_type, identifier, local=local)
+    huge_tree = asgs_type in conf.WFS_STREAMING_PARSE_TYPES
+    plan = get_conversion_plan(asgs_type)
+    FeatureCollection = "{{{}}}FeatureCollection".format(ns['wfs'])
+    member_tag = "{{{}}}member".format(ns['gml'])
+    slim_root = etree.Element(FeatureCollection, nsmap={'wfs': ns['wfs'], 'gml': ns['gml']})
+    records = []
+    try:
+        for object_id, member_object in wfs_iterparse_features(source, 'WFS', asgs_type, huge_tree=huge_tree):
+            record = extract_feature_record(plan, object_id, member_object)
+            for var, c in record.elements:
+                if var == 'shape':
+                    # keep the (now empty) shape element, so the converters still see the feature has one
+                    for g in list(c):
+                        c.remove(g)
+            etree.SubElement(slim_root, member_tag).append(member_object)
+            records.append(record)
+    except etree.XMLSyntaxError:
+        raise RuntimeError("Cannot decode XML from WFS endpoint")
+    finally:
+        try:
+            source.close()
+        except:
+            pass
+    loader = partial(_load_streamed_geometries, asgs_type, identifier, records, local=local)
+    for record in records:
+        record.geometry_loader = loader
+    return records
+
+
+def _load_streamed_geometries(asgs_type, identifier, records, local=True):
+    """
+    Decode the geometries of streamed records, which had their GML dropped, and set them on the records.
+    """
+    # Concurrent requests for the same feature's geometries share one pass over the WFS response
+    geometries = IN_FLIGHT_FETCHES.do(
+        ('geometry', asgs_type, identifier), _stream_asgs_feature_geometries,
+        asgs_type, identifier, local=local)
+    if len(geometries) != len(records):
+        raise RuntimeError("The WFS response for {} {} has changed".format(asgs_type, identifier))
+    for record, (object_id, geometry) in zip(records, geometries):
+        if record.object_id != object_id:
+            raise RuntimeError("The WFS response for {} {} has changed".format(asgs_type, identifier))
+        record.set_geometry(geometry)
+
+
+def _stream_asgs_feature_geometries(asgs_type, identifier, local=True):
+    """
+    Stream the feature's WFS response for just its geometries.
+
+    :return: (object_id, geometry) of each feature member, geometry as FeatureRecord.geometry gives it
+    :rtype: list[tuple]
+    """
+    plan = get_conversion_plan(asgs_type)
+    geometries = []
+    for object_id, shape in iter_streamed_shapes(asgs_type, identifier, local=local):
+        if shape is None or plan.ignore_geom:
+            geometries.append((object_id, {}))
+        else:
+            geometries.append((object_id, gml_extract_geom_to_compact(shape)))
+    return geometries
+
+
+def iter_streamed_shapes(asgs_type, identifier, local=True):
+    """
+    Stream the feature's WFS response again for just its shape elements.
+    Each shape is only valid until the next one is asked for, then its gml:member is dropped.
+
+    :return: generator of (object_id, shape element or None) of each feature member
+    """
+    source = _open_feature_source(asgs_type, identifier, local=local)
+    huge_tree = asgs_type in conf.WFS_STREAMING_PARSE_TYPES
+    plan = get_conversion_plan(asgs_type)
+    shape_tags = {t for t, tag_var in plan.tags.items() if tag_var is not None and tag_var[1] == 'shape'}
+    try:
+        for object_id, member_object in wfs_iterparse_features(source, 'WFS', asgs_type, huge_tree=huge_tree):
+            shape = None
+            for c in member_object.iterchildren():
+                if c.tag in shape_tags:
+                    shape = c
+            yield object_id, shape
+    except etree.XMLSyntaxError:
+        raise RuntimeError("Cannot decode XML from WFS endpoint")
+    finally:
+        try:
+            source.close()
+        except:
+            pass
+
+
 class ASGSFeature(ASGSModel):
     # INDEX_URI_TEMPLATE = conf.WFS_SERVICE_BASE_URI + \
     #     '?service=wfs&version=2.0.0&request=GetFeature&typeName={typename}' \
@@ -1138,6 +1757,15 @@ class ASGSFeature(ASGSModel):
                       '</ogc:PropertyIsEqualTo></ogc:Filter>'
         }, safe="{}")
 
+    FEATURES_URI_TEMPLATE = conf.WFS_SERVICE_BASE_URI + '?' + \
+        urlencode({
+            'service': 'WFS',
+            'version': '2.0.0',
+            'request': 'GetFeature',
+            'typeName': '{typename}',
+            'Filter': '{filter}'
+        }, safe="{}")
+
     @classmethod
     def make_instance_label(cls, instance_uri, instance_id):
         asgs_type = cls.determine_asgs_type(instance_uri)
@@ -1221,26 +1849,43 @@ class ASGSFeature(ASGSModel):
         self._assign_asgs_type()
         if self.asgs_type == "STATE" and self.id in state_id_map.keys():
             self.id = state_id_map[self.id]
-        feature_xml_tree = retrieve_asgs_feature(self.asgs_type, self.id)
-        self.xml_tree = feature_xml_tree
-        feature_collection = extract_asgs_features_as_geojson(
-            self.asgs_type, feature_xml_tree)
-        try:
-            gj_features = feature_collection['features']
-        except (AttributeError, KeyError, TypeError) as e:
-            raise NotFoundError()
-        if gj_features is None or len(gj_features) < 1:
+        # The WFS feature is decoded once, to FeatureRecords, which every view is made from.
+        # Streaming mode never holds the full XML tree, but its records have no GML geometries.
+        # Either way the geometry is only decoded when it is asked for, see the geometry property.
+        self.records_have_gml = self.asgs_type not in conf.WFS_STREAMING_PARSE_TYPES
+        if self.records_have_gml:
+            records = retrieve_asgs_feature_records(self.asgs_type, self.id)
+        else:
+            records = retrieve_asgs_feature_streamed(self.asgs_type, self.id)
+        if len(records) < 1:
+            # an empty FeatureCollection, the WFS doesn't have it
+            NOT_FOUND_CACHE.put((self.asgs_type, self.id), True)
+            FEATURE_CACHE.pop((self.asgs_type, self.id))
+            FEATURE_RECORD_CACHE.pop((self.asgs_type, self.id))
+            STREAMED_FEATURE_CACHE.pop((self.asgs_type, self.id))
             raise NotFoundError()
-        elif len(gj_features) > 1:
-            asgs_feature = combine_geojson_features(feature_collection)
+        self.records = records
+        self._geometry = None
+        self._geometry_summary = None
+        if len(records) > 1:
+            deets = combine_feature_properties([r.properties for r in records])
         else:
-            asgs_feature = gj_features[0]
-        self.geometry = asgs_feature['geometry']
-        deets = asgs_feature['properties']
+            deets = dict(records[0].properties)
         if 'state' in deets and 'state_abbrev' not in deets:
             deets['state_abbrev'] = state_id_map.get(int(deets['state']), "OT")
         self.properties = deets
 
+    @property
+    def geometry(self):
+        """
+        The feature's geometry, decoded from the GML the first time it is asked for.
+
+        :rtype: CompactGeometry | dict
+        """
+        if self._geometry is None:
+            self._geometry = combine_geojson_geometries([r.geometry for r in self.records])
+        return self._geometry
+
     @classmethod
     def determine_asgs_type(cls, instance_uri):
         """
@@ -1299,21 +1944,30 @@ class ASGSFeature(ASGSModel):
     def _assign_asgs_type(self):
         self.asgs_type = self.determine_asgs_type(self.uri)
 
-    def as_geosparql(self, graph=None):
+    def as_geosparql(self, graph=None, geometry_encoding=None):
+        """
+        :param geometry_encoding: 'gml', 'wkt' or 'wkb', defaults to conf.GEOSPARQL_GEOMETRY_ENCODING
+        """
+        if geometry_encoding is None:
+            geometry_encoding = conf.GEOSPARQL_GEOMETRY_ENCODING
         if graph is None:
-            graph = rdflib.Graph()
+            graph = TripleWriter()
             graph.bind('asgs', ASGS)
             graph.bind('geo', GEO)
             graph.bind('geox', GEOX)
             graph.bind('data', DATA)
-        return extract_asgs_features_as_rdf(
-            self.asgs_type, self.xml_tree,
-            partial(asgs_features_triples_converter, self.asgs_type, self.uri, mappings='geosparql'),
-            graph)
+        shapes = None
+        if not self.records_have_gml and self.asgs_type not in {"STATE", "AUS"}:
+            # The GeoSPARQL view embeds the geometry, which the streamed records dropped. The WFS response
+            # is streamed again for their shapes, one member at a time, rather than parsed whole.
+            # (STATE and AUS geometries are never put in the RDF)
+            shapes = iter_streamed_shapes(self.asgs_type, self.id)
+        return feature_records_to_rdf(self.records, self.uri, mappings='geosparql',
+                                      geometry_encoding=geometry_encoding, g=graph, shapes=shapes)
 
     def as_loci(self, graph=None):
         if graph is None:
-            graph = rdflib.Graph()
+            graph = TripleWriter()
             graph.bind('asgs', ASGS)
             graph.bind('geo', GEO)
             graph.bind('geox', GEOX)
@@ -1322,34 +1976,74 @@ class ASGSFeature(ASGSModel):
             graph.bind('dcterms', DCTERMS)
             graph.bind('asgs-cat', ASGS_CAT)
             graph.bind('asgs-id', ASGS_ID)
-        return extract_asgs_features_as_rdf(
-            self.asgs_type, self.xml_tree,
-            partial(asgs_features_triples_converter, self.asgs_type, self.uri, mappings='loci'),
-            graph)
+        # The loci view only links to the geometry service, so the geometry is never decoded
+        return feature_records_to_rdf(self.records, self.uri, mappings='loci', g=graph)
+
+    def get_geometry_summary(self):
+        """
+        The feature's bbox, centroid, area and part/ring/vertex counts, see summarize_geometry().
+        Read from the persisted summaries when they have the feature, computed otherwise.
+
+        :rtype: dict | None
+        """
+        if self._geometry_summary is None:
+            summary = None
+            summaries = get_geometry_summaries()
+            if summaries is not None:
+                code = state_code_map.get(self.id, self.id) if self.asgs_type == "STATE" else self.id
+                summary = summaries.get(self.asgs_type, code)
+            if summary is None and self.geometry:
+                summary = summarize_geometry(self.geometry)
+            self._geometry_summary = summary if summary is not None else {}
+        return self._geometry_summary or None
 
     def get_bbox(self, pad=0):
-        coords = self.geometry['coordinates']
-        crs = self.geometry.get('crs', None)
+        if not pad:
+            summary = self.get_geometry_summary()
+            if summary is not None:
+                return (summary['west'], summary['south'], summary['east'], summary['north'])
+        geometry = self.geometry  # type: CompactGeometry
+        crs = geometry.crs
         if crs:
             p = crs['properties']
             srs = p['name']
         else:
             srs = None
-        json_bbox = calculate_bbox(coords, pad=pad, srs=srs)
+        json_bbox = calculate_bbox(geometry, pad=pad, srs=srs)
         (n, s, e, w) = json_bbox
         return (w,s,e,n) # (minx, miny, maxx, maxy)
 
-    def _get_instance_rdf(self, profile='loci'):
+    def get_simplified_geometry(self, resolution=None):
+        """
+        The geometry simplified for drawing at about resolution pixels across the feature.
+
+        :param resolution: defaults to conf.HTML_MAP_RESOLUTION
+        :rtype: CompactGeometry
+        """
+        if resolution is None:
+            resolution = conf.HTML_MAP_RESOLUTION
+        cache_key = (self.asgs_type, self.id, resolution)
+        simple = SIMPLIFIED_GEOMETRY_CACHE.get(cache_key) if resolution else None
+        if simple is not None:
+            return simple  # without decoding the full geometry
+        if not resolution or not self.geometry:
+            return self.geometry
+        tolerance = extent_tolerance(self.geometry, resolution)
+        simple = simplify_geometry(self.geometry, tolerance)
+        SIMPLIFIED_GEOMETRY_CACHE.put(cache_key, simple)
+        return simple
+
+    def _get_instance_rdf(self, profile='loci', geometry_encoding=None):
         deets = self.properties
         if profile in {'loci', 'asgs', 'geosparql'}:
             is_loci_profile = profile == "loci"
 
             if profile in {'asgs', 'geosparql'}:
-                g = self.as_geosparql()
+                g = self.as_geosparql(geometry_encoding=geometry_encoding)
             elif is_loci_profile:
                 g = self.as_loci()
             else:
-                g = rdflib.Graph()
+                g = TripleWriter()
                 g.bind('asgs', ASGS)
                 g.bind('geo', GEO)
                 g.bind('geox', GEOX)
@@ -1713,11 +2407,11 @@ class ASGSFeature(ASGSModel):
 
     @classmethod
     def get_feature_index(cls, asgs_type, startindex, count):
+        store = get_feature_store()
+        if store is not None and (conf.FEATURE_STORE_OFFLINE or store.count(asgs_type) > 0):
+            return store.codes(asgs_type, offset=startindex, count=count)
         url = cls.construct_wfs_query_for_index(asgs_type, startindex, count)
-        req = Request(url, method='GET')
-        with urlopen(req) as resp:
-            if not (200 <= resp.status <= 299):
-                raise RuntimeError("Cannot get feature index from WFS backend.")
+        with cached_wfs_request(url, retries=0) as resp:
             tree = etree.parse(resp)  # type: lxml._ElementTree
         wfs_type = ASGS_WFS_LOOKUP[asgs_type]  # type: AsgsWfsType
         items = tree.xpath('//{}/text()'.format(wfs_type.propertyname), namespaces=tree.getroot().nsmap)
@@ -1729,6 +2423,12 @@ class ASGSFeature(ASGSModel):
         return wfs_type.populate_string(cls.INDEX_URI_TEMPLATE,
                                         startindex=startindex, count=count)
 
+    def open_wfs_xml(self):
+        """
+        See open_raw_asgs_feature()
+        """
+        return open_raw_asgs_feature(self.asgs_type, self.id)
+
     def get_wfs_query_for_feature_type(self):
         asgs_type = self.asgs_type
         identifier = self.id
@@ -1740,6 +2440,22 @@ class ASGSFeature(ASGSModel):
         return wfs_type.populate_string(cls.FEATURE_URI_TEMPLATE,
                                         featureid=identifier)
 
+    @classmethod
+    def construct_wfs_query_for_features(cls, asgs_type, identifiers):
+        wfs_type = ASGS_WFS_LOOKUP[asgs_type]  # type: AsgsWfsType
+        conditions = "".join(
+            wfs_type.populate_string(
+                '<ogc:PropertyIsEqualTo>'
+                '<ogc:PropertyName>{propertyname}</ogc:PropertyName>'
+                '<ogc:Literal>{featureid}</ogc:Literal>'
+                '</ogc:PropertyIsEqualTo>', featureid=escape(str(i)))
+            for i in identifiers)
+        if len(identifiers) > 1:
+            conditions = '<ogc:Or>' + conditions + '</ogc:Or>'
+        wfs_filter = '<ogc:Filter>' + conditions + '</ogc:Filter>'
+        return wfs_type.populate_string(cls.FEATURES_URI_TEMPLATE,
+                                        filter=quote_plus(wfs_filter))
+
 
 class Req:
     def __init__(self, values):
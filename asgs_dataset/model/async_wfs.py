@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import random
+
+import aiohttp
+from lxml import etree
+
+import asgs_dataset._config as conf
+from asgs_dataset.helpers import wfs_split_features, AsgsWfsType, ns
+from asgs_dataset.model import NotFoundError, ServiceUnavailableError
+from asgs_dataset.model.asgs_feature import ASGSFeature, ASGS_WFS_LOOKUP, \
+    FEATURE_CACHE, NOT_FOUND_CACHE, make_xml_parser, state_code_map
+from asgs_dataset.model.circuit_breaker import wfs_breakers
+
+
+def run_until_complete(coro):
+    """
+    Run a coroutine to completion on a new event loop, like asyncio.run(), which Python 3.6 doesn't have.
+    """
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        asyncio.set_event_loop(None)
+        loop.close()
+
+
+class AsyncWFSClient(object):
+    """
+    asyncio client for bulk pulls from the WFS, eg by feature_store_builder.py.
+    One event loop can have hundreds of WFS requests in flight, bounded by
+    the concurrency limit, rather than one per thread.
+    Unlike the retrieve_asgs_feature functions in asgs_feature, it only ever asks the WFS.
+    The test fixtures, the feature store, the WFS disk cache and conf.FEATURE_STORE_OFFLINE are not used,
+    and every type is parsed whole, none are streamed.
+    Use as an async context manager:
+
+        async with AsyncWFSClient(concurrency=200) as client:
+            trees = await asyncio.gather(*[client.fetch_wfs_feature('MB', c) for c in codes])
+    """
+
+    def __init__(self, concurrency=None, connect_timeout=None, read_timeout=None):
+        if concurrency is None:
+            concurrency = conf.WFS_ASYNC_CONCURRENCY
+        self.concurrency = max(int(concurrency), 1)
+        self.connect_timeout = conf.WFS_CONNECT_TIMEOUT if connect_timeout is None else connect_timeout
+        self.read_timeout = conf.WFS_READ_TIMEOUT if read_timeout is None else read_timeout
+        self._session = None
+        self._semaphore = None
+        self._in_flight = {}
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    async def open(self):
+        if self._session is not None:
+            return
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        connector = aiohttp.TCPConnector(limit=self.concurrency)
+        timeout = aiohttp.ClientTimeout(sock_connect=self.connect_timeout,
+                                        sock_read=self.read_timeout)
+        self._session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def request(self, uri, retries=3, delay=2):
+        """
+        Async equivalent of retryable_request, but returns the whole response body.
+
+        :return: the response body
+        :rtype: bytes
+        """
+        if self._session is None:
+            raise RuntimeError("AsyncWFSClient is not open, use it with 'async with'.")
+        breaker = wfs_breakers.for_url(uri)
+        while True:
+            if not breaker.allow():
+                raise ServiceUnavailableError("WFS service {} is unavailable.".format(breaker.name))
+            try:
+                async with self._semaphore:
+                    async with self._session.get(uri) as resp:
+                        if 200 <= resp.status <= 299:
+                            body = await resp.read()
+                            breaker.record_success()
+                            return body
+                        print("URL:{}\nHTTP Error: {}".format(uri, resp.status))
+                        if resp.status == 404:
+                            breaker.record_success()
+                            raise NotFoundError()
+                        error = RuntimeError("Cannot get feature from WFS backend.")
+                        breaker.record_failure(error)
+            except NotFoundError:
+                raise
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                print(e)
+                breaker.record_failure(e)
+                error = e
+            if retries < 1 or breaker.is_open:
+                raise error
+            print("retrying...")
+            await asyncio.sleep(min(delay, conf.WFS_RETRY_MAX_DELAY) * random.uniform(0.5, 1.0))
+            retries -= 1
+            delay *= 2
+
+    async def _parse(self, asgs_type, body):
+        parser = make_xml_parser(asgs_type)
+
+        def parse():
+            return etree.ElementTree(etree.fromstring(body, parser=parser))
+        try:
+            if asgs_type in conf.WFS_STREAMING_PARSE_TYPES:
+                # Don't stall the event loop on a multi-megabyte document
+                return await asyncio.get_event_loop().run_in_executor(None, parse)
+            return parse()
+        except etree.XMLSyntaxError:
+            raise RuntimeError("Cannot decode XML from WFS endpoint")
+
+    async def _single_flight(self, key, coro_fn, *args):
+        # Concurrent tasks asking for the same feature await the one fetch
+        future = self._in_flight.get(key, None)
+        if future is None:
+            future = asyncio.ensure_future(coro_fn(*args))
+            self._in_flight[key] = future
+            future.add_done_callback(lambda _f: self._in_flight.pop(key, None))
+        return await asyncio.shield(future)
+
+    async def fetch_wfs_feature(self, asgs_type, identifier):
+        """
+        Fetch one feature from the WFS.
+        Results go in (and come from) the same feature cache as asgs_feature.retrieve_asgs_feature.
+
+        :rtype: etree._ElementTree
+        """
+        if identifier.startswith("http:") or identifier.startswith("https:"):
+            identifier = identifier.split('/')[-1]
+        cache_key = (asgs_type, identifier)
+        tree = FEATURE_CACHE.get(cache_key)
+        if tree is not None:
+            return tree
+        if cache_key in NOT_FOUND_CACHE:
+            raise NotFoundError()
+        return await self._single_flight(cache_key, self._fetch_feature, asgs_type, identifier)
+
+    async def _fetch_feature(self, asgs_type, identifier):
+        code = state_code_map.get(identifier, identifier) if asgs_type == "STATE" else identifier
+        wfs_uri = ASGSFeature.construct_wfs_query_for_feature_type(asgs_type, code)
+        try:
+            body = await self.request(wfs_uri)
+        except NotFoundError:
+            NOT_FOUND_CACHE.put((asgs_type, identifier), True)
+            raise
+        tree = await self._parse(asgs_type, body)
+        FEATURE_CACHE.put((asgs_type, identifier), tree)
+        return tree
+
+    async def fetch_wfs_features(self, asgs_type, identifiers, batch_size=None):
+        """
+        Fetch many features of the same ASGS type from the WFS, one GetFeature request per batch
+        like asgs_feature.retrieve_asgs_features, with all of the batches requested concurrently.
+
+        :return: identifier -> FeatureCollection tree, for every identifier that was found
+        :rtype: dict[str, etree._ElementTree]
+        """
+        if batch_size is None:
+            batch_size = conf.WFS_BATCH_SIZE
+        batch_size = max(int(batch_size), 1)
+        found = {}
+        to_fetch = []
+        for identifier in identifiers:
+            identifier = str(identifier).split('/')[-1]
+            tree = FEATURE_CACHE.get((asgs_type, identifier))
+            if tree is not None:
+                found[identifier] = tree
+            elif (asgs_type, identifier) in NOT_FOUND_CACHE:
+                continue
+            elif identifier not in to_fetch:
+                to_fetch.append(identifier)
+        batches = [to_fetch[i:i + batch_size] for i in range(0, len(to_fetch), batch_size)]
+        results = await asyncio.gather(*[self._fetch_batch(asgs_type, b) for b in batches])
+        for r in results:
+            found.update(r)
+        return found
+
+    async def _fetch_batch(self, asgs_type, batch):
+        wfs_type = ASGS_WFS_LOOKUP[asgs_type]  # type: AsgsWfsType
+        property_name = wfs_type.propertyname.split(':')[-1]
+        # The WFS holds states by STATE_CODE_2016, not the name abbrevs they are identified by
+        if asgs_type == "STATE":
+            codes = [state_code_map.get(identifier, identifier) for identifier in batch]
+        else:
+            codes = batch
+        wfs_uri = ASGSFeature.construct_wfs_query_for_features(asgs_type, codes)
+        body = await self.request(wfs_uri)
+        tree = await self._parse(asgs_type, body)
+        if tree.getroot().tag != "{{{}}}FeatureCollection".format(ns['wfs']):
+            # not a FeatureCollection, eg an ExceptionReport, it says nothing about which features exist
+            raise RuntimeError("Unexpected response from WFS endpoint, not a FeatureCollection")
+        split_trees = wfs_split_features(tree, 'WFS', asgs_type, property_name)
+        found = {}
+        for identifier, code in zip(batch, codes):
+            try:
+                feature_tree = split_trees[code]
+            except KeyError:
+                NOT_FOUND_CACHE.put((asgs_type, identifier), True)
+                continue
+            FEATURE_CACHE.put((asgs_type, identifier), feature_tree)
+            found[identifier] = feature_tree
+        return found
+
+    async def get_feature_index(self, asgs_type, startindex, count):
+        """
+        Async equivalent of ASGSFeature.get_feature_index.
+
+        :rtype: list[str]
+        """
+        url = ASGSFeature.construct_wfs_query_for_index(asgs_type, startindex, count)
+        body = await self.request(url, retries=0)
+        tree = etree.ElementTree(etree.fromstring(body))
+        wfs_type = ASGS_WFS_LOOKUP[asgs_type]  # type: AsgsWfsType
+        return tree.xpath('//{}/text()'.format(wfs_type.propertyname), namespaces=tree.getroot().nsmap)
+
+
+def fetch_wfs_features(identifiers_by_type, concurrency=None, batch_size=None):
+    """
+    Blocking entry point for code without an event loop, eg the harvester's prefetch.
+    Fetches all the given features from the WFS with concurrent batched requests, every type
+    on the one event loop, and puts them in the feature cache.
+
+    :param identifiers_by_type: ASGS type -> identifiers of that type
+    :type identifiers_by_type: dict[str, list[str]]
+    :return: ASGS type -> identifier -> FeatureCollection tree, for every identifier that was found
+    :rtype: dict[str, dict[str, etree._ElementTree]]
+    """
+    asgs_types = list(identifiers_by_type.keys())
+
+    async def _run():
+        async with AsyncWFSClient(concurrency=concurrency) as client:
+            return await asyncio.gather(*[
+                client.fetch_wfs_features(t, identifiers_by_type[t], batch_size=batch_size) for t in asgs_types])
+    return dict(zip(asgs_types, run_until_complete(_run())))
@@ -0,0 +1,349 @@
+# -*- coding: utf-8 -*-
+import gzip
+import hashlib
+import io
+import os
+import shutil
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+_MISSING = object()
+
+
+class LRUCache(object):
+    """
+    A small thread-safe least-recently-used cache.
+    Unlike functools.lru_cache, entries can be put in from outside the
+    function being cached, eg when several features come back in one WFS response.
+    With a ttl, entries also expire that many seconds after they were put in.
+    """
+
+    def __init__(self, maxsize=128, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _lookup(self, key):
+        # call with the lock held
+        entry = self._data.get(key, _MISSING)
+        if entry is _MISSING:
+            return _MISSING
+        expires, val = entry
+        if expires is not None and expires < time.monotonic():
+            del self._data[key]
+            return _MISSING
+        self._data.move_to_end(key)
+        return val
+
+    def get(self, key, default=None):
+        with self._lock:
+            val = self._lookup(key)
+            return default if val is _MISSING else val
+
+    def put(self, key, val):
+        expires = None if self.ttl is None else time.monotonic() + self.ttl
+        with self._lock:
+            self._data[key] = (expires, val)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            val = self._lookup(key)
+            if val is _MISSING:
+                return default
+            del self._data[key]
+            return val
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __contains__(self, key):
+        with self._lock:
+            return self._lookup(key) is not _MISSING
+
+    def __len__(self):
+        return len(self._data)
+
+
+class SizedLRUCache(object):
+    """
+    A thread-safe least-recently-used cache bounded by the total size of its entries,
+    rather than by how many there are, for values like response bodies whose sizes vary a lot.
+    """
+
+    def __init__(self, max_bytes, max_item_bytes=None):
+        """
+        :param max_bytes: total size limit of the entries
+        :param max_item_bytes: entries bigger than this are not kept, None for max_bytes
+        """
+        self.max_bytes = max_bytes
+        self.max_item_bytes = max_bytes if max_item_bytes is None else min(max_item_bytes, max_bytes)
+        self._data = OrderedDict()  # key -> (size, val)
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is _MISSING:
+                return default
+            self._data.move_to_end(key)
+            return entry[1]
+
+    def put(self, key, val, size=None):
+        """
+        :param size: the entry's size in bytes, len(val) if not given
+        :return: True if the entry was kept
+        :rtype: bool
+        """
+        if size is None:
+            size = len(val)
+        with self._lock:
+            old = self._data.pop(key, _MISSING)
+            if old is not _MISSING:
+                self._bytes -= old[0]
+            if size > self.max_item_bytes:
+                return False
+            self._data[key] = (size, val)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _key, (old_size, _val) = self._data.popitem(last=False)
+                self._bytes -= old_size
+            return True
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._data.pop(key, _MISSING)
+            if entry is _MISSING:
+                return default
+            self._bytes -= entry[0]
+            return entry[1]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def size(self):
+        return self._bytes
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __len__(self):
+        return len(self._data)
+
+
+class _InFlightCall(object):
+    __slots__ = ("event", "result", "error")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight(object):
+    """
+    Coalesces concurrent calls for the same key.
+    The first caller runs the function, callers arriving while it is still
+    running wait for it and get the same result, or have the same error raised.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn, *args, **kwargs):
+        with self._lock:
+            call = self._calls.get(key, None)
+            leader = call is None
+            if leader:
+                call = _InFlightCall()
+                self._calls[key] = call
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = fn(*args, **kwargs)
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+        return call.result
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._calls)
+
+
+class DiskCache(object):
+    """
+    A persistent cache of response bodies, shared by every process using the same directory.
+    Each entry is one gzip file named after the hash of its key. The file's mtime is
+    when it was written (for the TTL) and its atime is when it was last read (for LRU eviction).
+    Expired entries are kept, and can still be read with allow_stale, until eviction needs the space.
+    Entries are written to a temp file then renamed into place, so readers never see a partial one.
+    A temp file left behind by a process killed mid-write is removed by evict() once it is tmp_grace old.
+    """
+    tmp_grace = 3600  # seconds since a temp file was last written to, before it counts as abandoned
+
+    def __init__(self, directory, ttl=None, max_bytes=None):
+        """
+        :param directory: where the entries are kept, created if it doesn't exist
+        :param ttl: seconds an entry stays valid, None for forever
+        :param max_bytes: total size limit of the entries, None for no limit
+        """
+        self.directory = directory
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._written = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        h = hashlib.sha256(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, h[:2], h[2:] + '.gz')
+
+    def _expired(self, st, now):
+        return self.ttl is not None and now - st.st_mtime > self.ttl
+
+    def open(self, key, allow_stale=False):
+        """
+        :param allow_stale: return the entry even if it has expired
+        :return: a file-like object of the decompressed body, or None on a miss
+        """
+        f = self.open_compressed(key, allow_stale=allow_stale)
+        if f is None:
+            return None
+        return gzip.GzipFile(fileobj=f, mode='rb')
+
+    def open_compressed(self, key, allow_stale=False):
+        """
+        :param allow_stale: return the entry even if it has expired
+        :return: the entry's gzip file, as it is on disk, or None on a miss
+        """
+        path = self._path(key)
+        now = time.time()
+        try:
+            f = open(path, 'rb')
+        except FileNotFoundError:
+            return None
+        st = os.fstat(f.fileno())
+        if not allow_stale and self._expired(st, now):
+            f.close()
+            return None
+        try:
+            os.utime(path, (now, st.st_mtime))
+        except OSError:
+            pass
+        return f
+
+    def get(self, key, allow_stale=False):
+        f = self.open(key, allow_stale=allow_stale)
+        if f is None:
+            return None
+        with f:
+            return f.read()
+
+    def put(self, key, body):
+        self.put_stream(key, io.BytesIO(body))
+
+    def put_stream(self, key, source, chunk_size=65536):
+        """
+        Compress everything read from source into the cache entry for key.
+        """
+        path = self._path(key)
+        dirname = os.path.dirname(path)
+        os.makedirs(dirname, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=dirname, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                with gzip.GzipFile(fileobj=f, mode='wb', compresslevel=6) as gz:
+                    shutil.copyfileobj(source, gz, chunk_size)
+                size = f.tell()
+            os.replace(tmp_path, path)
+        except BaseException:
+            self._remove(tmp_path)
+            raise
+        self._note_written(size)
+
+    def delete(self, key):
+        self._remove(self._path(key))
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def _note_written(self, size):
+        if self.max_bytes is None:
+            return
+        with self._lock:
+            self._written += size
+            # Other processes write here too, so only the occasional full scan knows the real total
+            if self._written < self.max_bytes // 10:
+                return
+            self._written = 0
+        self.evict()
+
+    def _entries(self, suffix='.gz'):
+        for sub in os.listdir(self.directory):
+            subdir = os.path.join(self.directory, sub)
+            if not os.path.isdir(subdir):
+                continue
+            for name in os.listdir(subdir):
+                if not name.endswith(suffix):
+                    continue
+                path = os.path.join(subdir, name)
+                try:
+                    yield path, os.stat(path)
+                except FileNotFoundError:
+                    continue
+
+    def evict(self):
+        """
+        Remove abandoned temp files. Then if the cache is over max_bytes, remove expired entries
+        and then the least recently used ones until it is back under 90% of max_bytes.
+        """
+        now = time.time()
+        entries = []
+        total = 0
+        for path, st in self._entries('.tmp'):
+            if now - st.st_mtime > self.tmp_grace:
+                self._remove(path)
+            else:
+                total += st.st_size  # still being written
+        for path, st in self._entries():
+            # expired entries sort first
+            entries.append((not self._expired(st, now), st.st_atime, st.st_size, path))
+            total += st.st_size
+        if self.max_bytes is None or total <= self.max_bytes:
+            return
+        target = int(self.max_bytes * 0.9)
+        entries.sort()
+        for _live, _atime, size, path in entries:
+            if total <= target:
+                break
+            self._remove(path)
+            total -= size
+
+    def size(self):
+        return sum(st.st_size for _path, st in self._entries())
+
+    def clear(self):
+        for path, _st in list(self._entries()):
+            self._remove(path)
@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+import os
+import threading
+import time
+from collections import deque
+from urllib.parse import urlsplit, urlunsplit
+
+import asgs_dataset._config as conf
+from asgs_dataset.model.wfs_client import wfs_pool
+
+
+class CircuitBreaker(object):
+    """
+    Tracks the outcome of recent requests to one upstream service.
+    When too many of them fail the breaker opens, and requests are refused
+    straight away rather than each one waiting on a service that is down.
+    While it is open, a background thread probes the service and closes the
+    breaker again once a probe succeeds.
+    """
+    CLOSED = "closed"
+    OPEN = "open"
+
+    def __init__(self, name, probe=None, failure_rate=0.5, window=20, min_calls=5, reset_timeout=30.0):
+        """
+        :param name: the service name, eg 'MB'
+        :param probe: no-arg function that raises if the service is still down
+        :param failure_rate: fraction of failures in the window that opens the breaker
+        :param window: number of recent requests the failure rate is measured over
+        :param min_calls: don't open until the window has at least this many requests
+        :param reset_timeout: seconds between recovery probes
+        """
+        self.name = name
+        self.probe = probe
+        self.failure_rate_threshold = failure_rate
+        self.min_calls = min_calls
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.opened_at = None
+        self.last_error = None
+        self.rejected = 0
+        self._outcomes = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self._probe_thread = None
+
+    @property
+    def is_open(self):
+        return self.state == self.OPEN
+
+    def failure_rate(self):
+        with self._lock:
+            return self._failure_rate()
+
+    def _failure_rate(self):
+        if len(self._outcomes) < 1:
+            return 0.0
+        return self._outcomes.count(False) / len(self._outcomes)
+
+    def allow(self):
+        """
+        :return: False if the request should not be made because the service is down
+        :rtype: bool
+        """
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.probe is None:
+                # Nothing probing in the background, so let a request through every reset_timeout as the probe
+                if time.monotonic() - self.opened_at >= self.reset_timeout:
+                    self.opened_at = time.monotonic()
+                    return True
+            else:
+                self._ensure_probing()
+            self.rejected += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._outcomes.append(True)
+            if self.state == self.OPEN:
+                self._close()
+
+    def record_failure(self, error=None):
+        with self._lock:
+            self._outcomes.append(False)
+            self.last_error = repr(error) if error is not None else None
+            if self.state == self.OPEN:
+                return
+            if len(self._outcomes) >= self.min_calls and self._failure_rate() >= self.failure_rate_threshold:
+                print("WFS service {} is failing, opening its circuit breaker.".format(self.name))
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+                if self.probe is not None:
+                    self._ensure_probing()
+
+    def _close(self):
+        # call with the lock held
+        print("WFS service {} has recovered, closing its circuit breaker.".format(self.name))
+        self.state = self.CLOSED
+        self.opened_at = None
+        self._outcomes.clear()
+
+    def _ensure_probing(self):
+        # call with the lock held. The thread is checked each time, it doesn't survive a fork.
+        t = self._probe_thread
+        if t is not None and t[0] == os.getpid() and t[1].is_alive():
+            return
+        thread = threading.Thread(target=self._probe_loop, name="breaker-probe-{}".format(self.name), daemon=True)
+        self._probe_thread = (os.getpid(), thread)
+        thread.start()
+
+    def _probe_loop(self):
+        while True:
+            time.sleep(self.reset_timeout)
+            if self.state != self.OPEN:
+                return
+            try:
+                self.probe()
+            except Exception as e:
+                with self._lock:
+                    self.last_error = repr(e)
+                continue
+            with self._lock:
+                if self.state == self.OPEN:
+                    self._close()
+            return
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "state": self.state,
+                "failure_rate": round(self._failure_rate(), 3),
+                "recent_requests": len(self._outcomes),
+                "open_for": None if self.opened_at is None else round(time.monotonic() - self.opened_at, 1),
+                "rejected": self.rejected,
+                "last_error": self.last_error,
+            }
+
+
+class WFSCircuitBreakers(object):
+    """
+    One CircuitBreaker per WFS service, eg .../ASGS2016/MB/MapServer/WFSServer is service 'MB'.
+    """
+
+    def __init__(self):
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def service_name(url):
+        parts = urlsplit(url)
+        segments = parts.path.split('/')
+        if 'MapServer' in segments:
+            i = segments.index('MapServer')
+            if i > 0:
+                return segments[i - 1]
+        return parts.netloc
+
+    @staticmethod
+    def _make_probe(url):
+        parts = urlsplit(url)
+        probe_url = urlunsplit((parts.scheme, parts.netloc, parts.path,
+                                'service=wfs&version=2.0.0&request=GetCapabilities', ''))
+
+        def probe():
+            with wfs_pool.request('GET', probe_url) as resp:
+                resp.read()
+                if not (200 <= resp.status <= 299):
+                    raise RuntimeError("HTTP {}".format(resp.status))
+        return probe
+
+    def for_url(self, url):
+        """
+        :rtype: CircuitBreaker
+        """
+        name = self.service_name(url)
+        with self._lock:
+            breaker = self._breakers.get(name, None)
+            if breaker is None:
+                breaker = CircuitBreaker(
+                    name, probe=self._make_probe(url),
+                    failure_rate=conf.WFS_BREAKER_FAILURE_RATE,
+                    window=conf.WFS_BREAKER_WINDOW,
+                    min_calls=conf.WFS_BREAKER_MIN_CALLS,
+                    reset_timeout=conf.WFS_BREAKER_RESET_TIMEOUT)
+                self._breakers[name] = breaker
+            return breaker
+
+    def snapshot(self):
+        """
+        :return: service name -> breaker state, for monitoring
+        :rtype: dict
+        """
+        with self._lock:
+            breakers = list(self._breakers.values())
+        return {b.name: b.snapshot() for b in breakers}
+
+
+wfs_breakers = WFSCircuitBreakers()
@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+import gzip
+import io
+import os
+import sqlite3
+import threading
+
+import asgs_dataset._config as conf
+
+
+class FeatureStore(object):
+    """
+    A local snapshot of the ABS WFS, indexed by (asgs_type, code).
+    Each row holds the gzipped WFS FeatureCollection for one feature,
+    exactly as the WFS GetFeature request for that code would return it.
+    Build it with feature_store_builder.py.
+    """
+
+    def __init__(self, path, readonly=True):
+        self.path = path
+        self.readonly = readonly
+        self._local = threading.local()
+        if not readonly:
+            with self._connection() as c:
+                c.execute(
+                    "CREATE TABLE IF NOT EXISTS feature ("
+                    "asgs_type TEXT NOT NULL, code TEXT NOT NULL, body BLOB NOT NULL, "
+                    "PRIMARY KEY (asgs_type, code)) WITHOUT ROWID")
+                # Geometry bounds, for finding the features in a map tile. Built by tile_builder.py
+                c.execute(
+                    "CREATE TABLE IF NOT EXISTS feature_bounds ("
+                    "id INTEGER PRIMARY KEY, asgs_type TEXT NOT NULL, code TEXT NOT NULL, "
+                    "UNIQUE (asgs_type, code))")
+                c.execute(
+                    "CREATE VIRTUAL TABLE IF NOT EXISTS feature_bounds_rtree "
+                    "USING rtree(id, minx, maxx, miny, maxy)")
+
+    def _connection(self):
+        # sqlite connections cannot be shared between threads, so each thread gets its own
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            if self.readonly:
+                uri = "file:{}?mode=ro".format(self.path)
+                conn = sqlite3.connect(uri, uri=True, check_same_thread=True)
+            else:
+                conn = sqlite3.connect(self.path)
+            self._local.conn = conn
+        return conn
+
+    def get(self, asgs_type, code):
+        """
+        :return: the WFS FeatureCollection XML for this feature, or None if it is not in the store
+        :rtype: bytes | None
+        """
+        body = self.get_compressed(asgs_type, code)
+        if body is None:
+            return None
+        return gzip.decompress(body)
+
+    def get_compressed(self, asgs_type, code):
+        """
+        :return: the gzipped WFS FeatureCollection XML, as it is stored, or None
+        :rtype: bytes | None
+        """
+        row = self._connection().execute(
+            "SELECT body FROM feature WHERE asgs_type = ? AND code = ?",
+            (asgs_type, str(code))).fetchone()
+        if row is None:
+            return None
+        return row[0]
+
+    def open(self, asgs_type, code):
+        """
+        :return: a file-like object of the WFS FeatureCollection XML, or None
+        """
+        body = self.get(asgs_type, code)
+        if body is None:
+            return None
+        return io.BytesIO(body)
+
+    def put(self, asgs_type, code, body):
+        self.put_many(asgs_type, [(code, body)])
+
+    def put_many(self, asgs_type, items):
+        """
+        :param items: (code, WFS FeatureCollection XML bytes) pairs
+        :type items: list[tuple[str, bytes]]
+        """
+        rows = [(asgs_type, str(code), gzip.compress(body, compresslevel=9))
+                for code, body in items]
+        with self._connection() as c:
+            c.executemany(
+                "INSERT OR REPLACE INTO feature (asgs_type, code, body) VALUES (?, ?, ?)", rows)
+
+    def codes(self, asgs_type, offset=0, count=None):
+        if count is None:
+            count = -1
+        rows = self._connection().execute(
+            "SELECT code FROM feature WHERE asgs_type = ? "
+            "ORDER BY length(code), code LIMIT ? OFFSET ?",  # numeric order for the all-digit codes, like the WFS
+            (asgs_type, int(count), int(offset)))
+        return [r[0] for r in rows]
+
+    def count(self, asgs_type):
+        row = self._connection().execute(
+            "SELECT COUNT(*) FROM feature WHERE asgs_type = ?", (asgs_type,)).fetchone()
+        return row[0]
+
+    def put_bounds(self, asgs_type, items):
+        """
+        :param items: (code, (minx, miny, maxx, maxy)) pairs, in the geometry's CRS
+        """
+        with self._connection() as c:
+            for code, (minx, miny, maxx, maxy) in items:
+                c.execute(
+                    "INSERT OR IGNORE INTO feature_bounds (asgs_type, code) VALUES (?, ?)",
+                    (asgs_type, str(code)))
+                row = c.execute(
+                    "SELECT id FROM feature_bounds WHERE asgs_type = ? AND code = ?",
+                    (asgs_type, str(code))).fetchone()
+                c.execute(
+                    "INSERT OR REPLACE INTO feature_bounds_rtree (id, minx, maxx, miny, maxy) "
+                    "VALUES (?, ?, ?, ?, ?)", (row[0], minx, maxx, miny, maxy))
+
+    def codes_in_bounds(self, asgs_type, minx, miny, maxx, maxy):
+        """
+        :return: codes of the features whose bounds intersect the box,
+                 empty if the bounds of asgs_type have not been built
+        :rtype: list[str]
+        """
+        try:
+            rows = self._connection().execute(
+                "SELECT b.code FROM feature_bounds_rtree r JOIN feature_bounds b ON b.id = r.id "
+                "WHERE r.maxx >= ? AND r.minx <= ? AND r.maxy >= ? AND r.miny <= ? AND b.asgs_type = ?",
+                (minx, maxx, miny, maxy, asgs_type))
+            return [r[0] for r in rows]
+        except sqlite3.OperationalError:
+            # a store built before the bounds table existed
+            return []
+
+    def count_bounds(self, asgs_type):
+        try:
+            row = self._connection().execute(
+                "SELECT COUNT(*) FROM feature_bounds WHERE asgs_type = ?", (asgs_type,)).fetchone()
+            return row[0]
+        except sqlite3.OperationalError:
+            return 0
+
+    def __contains__(self, key):
+        asgs_type, code = key
+        row = self._connection().execute(
+            "SELECT 1 FROM feature WHERE asgs_type = ? AND code = ?",
+            (asgs_type, str(code))).fetchone()
+        return row is not None
+
+
+_feature_store = None
+_feature_store_lock = threading.Lock()
+
+
+def get_feature_store():
+    """
+    :return: the shared read-only FeatureStore, or None if conf.FEATURE_STORE_PATH does not exist
+    :rtype: FeatureStore | None
+    """
+    global _feature_store
+    path = conf.FEATURE_STORE_PATH
+    if not path:
+        return None
+    with _feature_store_lock:
+        if _feature_store is None or _feature_store.path != path:
+            if not os.path.exists(path):
+                return None
+            _feature_store = FeatureStore(path, readonly=True)
+        return _feature_store
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+import os
+import threading
+
+import numpy as np
+
+import asgs_dataset._config as conf
+from asgs_dataset.geometry import area_and_centroid
+from asgs_dataset.helpers import calculate_bbox, load_gz_pickle
+
+# Columns of the persisted summary arrays
+SUMMARY_FIELDS = ('west', 'south', 'east', 'north', 'centroid_x', 'centroid_y', 'area', 'parts', 'rings', 'vertices')
+_INT_FIELDS = ('parts', 'rings', 'vertices')
+
+
+def summarize_geometry(geom):
+    """
+    :param geom: a feature geometry
+    :type geom: CompactGeometry
+    :return: its bbox (as ASGSFeature.get_bbox gives it), centroid and area in the geometry's CRS units,
+             and its part, ring and vertex counts
+    :rtype: dict
+    """
+    srs = geom.crs['properties']['name'] if geom.crs else None
+    (n, s, e, w) = calculate_bbox(geom, srs=srs)
+    area, centroid = area_and_centroid(geom)
+    if centroid is None:
+        centroid = (None, None)
+    return {
+        'west': w, 'south': s, 'east': e, 'north': n,
+        'centroid_x': centroid[0], 'centroid_y': centroid[1],
+        'area': area,
+        'parts': geom.num_parts,
+        'rings': geom.num_rings,
+        'vertices': len(geom.coords),
+    }
+
+
+def summaries_to_array(summaries):
+    """
+    :param summaries: code -> summarize_geometry() dict
+    :return: (codes, float64 array with one row per code and one column per SUMMARY_FIELDS), for pickling
+    """
+    codes = list(summaries.keys())
+    rows = np.full((len(codes), len(SUMMARY_FIELDS)), np.nan, dtype=np.float64)
+    for i, code in enumerate(codes):
+        s = summaries[code]
+        for j, field in enumerate(SUMMARY_FIELDS):
+            if s[field] is not None:
+                rows[i, j] = s[field]
+    return codes, rows
+
+
+class GeometrySummaries(object):
+    """
+    The precomputed geometry summaries, persisted by lookup_builder.py.
+    Holds one summary array per ASGS type, its code index is built on first use.
+    """
+
+    def __init__(self, types):
+        """
+        :param types: asgs_type -> (codes, array) from summaries_to_array
+        """
+        self._types = types
+        self._index = {}
+        self._lock = threading.Lock()
+
+    def _code_index(self, asgs_type):
+        with self._lock:
+            index = self._index.get(asgs_type, None)
+            if index is None:
+                codes = self._types[asgs_type][0]
+                index = {str(c): i for i, c in enumerate(codes)}
+                self._index[asgs_type] = index
+            return index
+
+    def get(self, asgs_type, code):
+        """
+        :return: the summarize_geometry() dict of the feature, or None if there isn't one
+        :rtype: dict | None
+        """
+        if asgs_type not in self._types:
+            return None
+        i = self._code_index(asgs_type).get(str(code), None)
+        if i is None:
+            return None
+        row = self._types[asgs_type][1][i].tolist()
+        summary = {}
+        for field, val in zip(SUMMARY_FIELDS, row):
+            if val != val:  # nan
+                val = None
+            elif field in _INT_FIELDS:
+                val = int(val)
+            summary[field] = val
+        return summary
+
+
+_summaries = None
+_summaries_lock = threading.Lock()
+
+
+def get_geometry_summaries():
+    """
+    :return: the persisted GeometrySummaries, or None if conf.GEOMETRY_SUMMARIES_PATH does not exist
+    :rtype: GeometrySummaries | None
+    """
+    global _summaries
+    path = conf.GEOMETRY_SUMMARIES_PATH
+    if not path:
+        return None
+    with _summaries_lock:
+        if _summaries is None:
+            if not os.path.exists(path):
+                return None
+            var_name = os.path.basename(path)[:-len(".pickle.gz")]
+            _summaries = GeometrySummaries(load_gz_pickle(var_name, os.path.dirname(path)))
+        return _summaries
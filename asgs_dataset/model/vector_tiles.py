@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+import math
+
+import numpy as np
+
+import asgs_dataset._config as conf
+from asgs_dataset.geometry import clip_ring, concatenate_geometries, douglas_peucker_mask
+from asgs_dataset.helpers import gml_extract_geom_to_compact, wfs_iterparse_features
+from asgs_dataset.model import NotFoundError
+from asgs_dataset.model.asgs_feature import ASGS_WFS_LOOKUP
+from asgs_dataset.model.cache import DiskCache, LRUCache
+from asgs_dataset.model.feature_store import get_feature_store
+from asgs_dataset.mvt import encode_layer, encode_tile, ring_area
+
+# Half the width of the EPSG:3857 world, in metres
+WEB_MERCATOR_HALF_WIDTH = 20037508.342789244
+
+TILE_GEOMETRY_CACHE = LRUCache(maxsize=512)
+# (asgs_type, code) -> CompactGeometry, or None if the feature has none
+
+_tile_cache = None
+
+
+def get_tile_cache():
+    """
+    :return: the DiskCache of rendered tiles, or None if conf.TILE_CACHE_DIR is not set
+    :rtype: DiskCache | None
+    """
+    global _tile_cache
+    if not conf.TILE_CACHE_DIR:
+        return None
+    if _tile_cache is None or _tile_cache.directory != conf.TILE_CACHE_DIR:
+        _tile_cache = DiskCache(conf.TILE_CACHE_DIR, ttl=conf.TILE_CACHE_TTL, max_bytes=conf.TILE_CACHE_MAX_BYTES)
+    return _tile_cache
+
+
+def tile_bounds(z, x, y):
+    """
+    :return: (minx, miny, maxx, maxy) of the XYZ tile, in EPSG:3857 metres
+    :rtype: tuple
+    """
+    size = 2 * WEB_MERCATOR_HALF_WIDTH / (1 << z)
+    minx = -WEB_MERCATOR_HALF_WIDTH + x * size
+    maxy = WEB_MERCATOR_HALF_WIDTH - y * size
+    return minx, maxy - size, minx + size, maxy
+
+
+def tiles_covering(bounds, z):
+    """
+    :param bounds: (minx, miny, maxx, maxy) in EPSG:3857 metres
+    :return: the (x, y) of every tile at zoom z that the bounds touch
+    """
+    n = 1 << z
+    size = 2 * WEB_MERCATOR_HALF_WIDTH / n
+
+    def clamp(v):
+        return min(max(v, 0), n - 1)
+    minx, miny, maxx, maxy = bounds
+    x0 = clamp(int(math.floor((minx + WEB_MERCATOR_HALF_WIDTH) / size)))
+    x1 = clamp(int(math.floor((maxx + WEB_MERCATOR_HALF_WIDTH) / size)))
+    y0 = clamp(int(math.floor((WEB_MERCATOR_HALF_WIDTH - maxy) / size)))
+    y1 = clamp(int(math.floor((WEB_MERCATOR_HALF_WIDTH - miny) / size)))
+    for x in range(x0, x1 + 1):
+        for y in range(y0, y1 + 1):
+            yield x, y
+
+
+def load_store_geometry(store, asgs_type, code):
+    """
+    Parse the geometry of one feature straight out of the feature store.
+
+    :type store: FeatureStore
+    :return: the feature's geometry, or None if it is not in the store or has none
+    :rtype: CompactGeometry | None
+    """
+    cache_key = (asgs_type, code)
+    if cache_key in TILE_GEOMETRY_CACHE:
+        return TILE_GEOMETRY_CACHE.get(cache_key)
+    source = store.open(asgs_type, code)
+    if source is None:
+        return None
+    shape_tags = {"{WFS}Shape", "{WFS}SHAPE"}
+    geoms = []
+    for _object_id, member_object in wfs_iterparse_features(
+            source, 'WFS', asgs_type, huge_tree=asgs_type in conf.WFS_STREAMING_PARSE_TYPES):
+        for c in member_object.iterchildren():
+            if c.tag in shape_tags:
+                geom = gml_extract_geom_to_compact(c)
+                if geom:
+                    geoms.append(geom)
+    if len(geoms) < 1:
+        geometry = None
+    elif len(geoms) == 1:
+        geometry = geoms[0]
+    else:
+        geometry = concatenate_geometries(geoms)
+    TILE_GEOMETRY_CACHE.put(cache_key, geometry)
+    return geometry
+
+
+def geometry_to_tile(geometry, bounds, extent, buffer):
+    """
+    Clip, simplify and quantize a geometry to tile coordinates.
+
+    :type geometry: CompactGeometry
+    :param bounds: (minx, miny, maxx, maxy) of the tile
+    :param extent: tile coordinate range, eg 4096
+    :param buffer: how far past the tile edge to clip, in tile coordinates
+    :return: one list of closed (N, 2) int64 rings per polygon, wound as MVT wants
+    """
+    minx, miny, maxx, maxy = bounds
+    scale = extent / (maxx - minx)
+    pad = buffer / scale
+    tolerance = 1.0 / scale  # one tile coordinate unit
+    polygons = []
+    for rings in geometry.polygons():
+        tile_rings = []
+        for i, ring in enumerate(rings):
+            clipped = clip_ring(ring, minx - pad, miny - pad, maxx + pad, maxy + pad)
+            if len(clipped) >= 4:
+                clipped = clipped[douglas_peucker_mask(clipped, tolerance)]
+            q = np.empty((len(clipped), 2), dtype=np.int64)
+            q[:, 0] = np.rint((clipped[:, 0] - minx) * scale)
+            q[:, 1] = np.rint((maxy - clipped[:, 1]) * scale)  # tile y runs down
+            if len(q) > 1:
+                # drop positions that quantized onto the one before
+                q = q[np.concatenate([[True], np.any(q[1:] != q[:-1], axis=1)])]
+                if np.any(q[-1] != q[0]):
+                    q = np.concatenate([q, q[:1]])
+            area = ring_area(q) if len(q) >= 4 else 0
+            if area == 0:
+                if i == 0:
+                    break  # the exterior is gone, so is the polygon
+                continue
+            # exterior rings clockwise on screen (positive area), interior rings anticlockwise
+            if (area > 0) != (i == 0):
+                q = q[::-1]
+            tile_rings.append(q)
+        if tile_rings:
+            polygons.append(tile_rings)
+    return polygons
+
+
+def render_tile(asgs_type, z, x, y):
+    """
+    Render one Mapbox Vector Tile of asgs_type features from the feature store.
+    The tile has one layer, named after the type, with each feature's code as a property.
+
+    :return: the encoded tile, empty if no features touch it
+    :rtype: bytes
+    """
+    store = get_feature_store()
+    if store is None:
+        raise NotFoundError()
+    bounds = tile_bounds(z, x, y)
+    extent = conf.TILE_EXTENT
+    buffer = conf.TILE_BUFFER
+    pad = buffer * (bounds[2] - bounds[0]) / extent
+    features = []
+    for code in store.codes_in_bounds(asgs_type, bounds[0] - pad, bounds[1] - pad,
+                                      bounds[2] + pad, bounds[3] + pad):
+        geometry = load_store_geometry(store, asgs_type, code)
+        if geometry is None:
+            continue
+        polygons = geometry_to_tile(geometry, bounds, extent, buffer)
+        if polygons:
+            feature_id = int(code) if code.isdigit() else None
+            features.append((feature_id, {"code": code}, polygons))
+    if len(features) < 1:
+        return b""
+    return encode_tile([encode_layer(asgs_type, features, extent=extent)])
+
+
+def get_tile(asgs_type, z, x, y):
+    """
+    A tile from the tile cache, rendered and cached on a miss.
+
+    :return: the encoded tile, empty if no features touch it
+    :rtype: bytes
+    """
+    if asgs_type not in ASGS_WFS_LOOKUP:
+        raise NotFoundError()
+    n = 1 << z
+    if z > conf.TILE_MAX_ZOOM or not (0 <= x < n and 0 <= y < n):
+        raise NotFoundError()
+    if z < conf.TILE_MIN_ZOOM.get(asgs_type, 0):
+        # Too many features to draw at this zoom
+        return b""
+    cache = get_tile_cache()
+    key = "{}/{}/{}/{}".format(asgs_type, z, x, y)
+    if cache is not None:
+        tile = cache.get(key)
+        if tile is not None:
+            return tile
+    tile = render_tile(asgs_type, z, x, y)
+    if cache is not None:
+        cache.put(key, tile)
+    return tile
@@ -0,0 +1,303 @@
+# -*- coding: utf-8 -*-
+import base64
+import os
+import threading
+from http.client import HTTPConnection, HTTPSConnection, HTTPException
+from queue import LifoQueue, Empty, Full
+from urllib.parse import urlsplit, urljoin, unquote
+from urllib.request import getproxies, proxy_bypass
+
+import asgs_dataset._config as conf
+
+REDIRECT_CODES = {301, 302, 303, 307, 308}
+
+
+class PooledResponse(object):
+    """
+    A file-like wrapper around a http.client response.
+    When the response is closed, its connection is handed back to the pool
+    it came from, so the next request to that host can reuse it.
+    """
+    __slots__ = ("_pool", "_conn", "_resp", "url")
+
+    def __init__(self, pool, conn, resp, url):
+        self._pool = pool
+        self._conn = conn
+        self._resp = resp
+        self.url = url
+
+    @property
+    def status(self):
+        return self._resp.status
+
+    @property
+    def reason(self):
+        return self._resp.reason
+
+    @property
+    def headers(self):
+        return self._resp.headers
+
+    def getheader(self, name, default=None):
+        return self._resp.getheader(name, default)
+
+    def read(self, *args):
+        return self._resp.read(*args)
+
+    def readinto(self, b):
+        return self._resp.readinto(b)
+
+    @property
+    def closed(self):
+        return self._conn is None
+
+    def close(self):
+        conn = self._conn
+        if conn is None:
+            return
+        self._conn = None
+        resp = self._resp
+        # Only a connection with a fully consumed body can be reused.
+        reusable = resp.isclosed() and not resp.will_close
+        resp.close()
+        if reusable:
+            self._pool.put_conn(conn)
+        else:
+            self._pool.discard_conn(conn)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __del__(self):
+        # a response that was never closed must still give its connection slot back
+        try:
+            self.close()
+        except Exception:
+            pass
+
+
+def proxy_for(scheme, host):
+    """
+    The proxy to reach scheme://host through, from the http_proxy, https_proxy and no_proxy
+    environment variables, like urllib.request.urlopen does.
+
+    :return: the proxy URL, split, or None to connect directly
+    :rtype: urllib.parse.SplitResult | None
+    """
+    proxy = getproxies().get(scheme)
+    if not proxy or proxy_bypass(host):
+        return None
+    if '://' not in proxy:
+        proxy = 'http://' + proxy
+    return urlsplit(proxy)
+
+
+class HostConnectionPool(object):
+    """
+    Thread-safe pool of keep-alive connections to a single scheme://host:port.
+    At most `maxsize` connections are open at once, a request waits up to `pool_timeout`
+    seconds for one to be free. Idle ones are kept for reuse.
+    """
+
+    def __init__(self, scheme, host, port, maxsize=10,
+                 connect_timeout=None, read_timeout=None, pool_timeout=None, proxy=None):
+        """
+        :param proxy: the proxy to connect through, see proxy_for()
+        """
+        self.scheme = scheme
+        self.host = host
+        self.port = port
+        self.maxsize = maxsize
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.pool_timeout = pool_timeout
+        self.proxy = proxy
+        self._proxy_headers = {}
+        if proxy is not None and proxy.username:
+            credentials = "{}:{}".format(unquote(proxy.username), unquote(proxy.password or ''))
+            self._proxy_headers['Proxy-Authorization'] = \
+                'Basic ' + base64.b64encode(credentials.encode('utf-8')).decode('ascii')
+        self._idle = LifoQueue(maxsize=maxsize)
+        self._slots = threading.BoundedSemaphore(maxsize)
+
+    def _new_conn(self):
+        conn_class = HTTPSConnection if self.scheme == "https" else HTTPConnection
+        if self.proxy is None:
+            conn = conn_class(self.host, self.port, timeout=self.connect_timeout)
+        else:
+            conn = conn_class(self.proxy.hostname, self.proxy.port or 80, timeout=self.connect_timeout)
+            if self.scheme == "https":
+                # TLS to the host, through a CONNECT tunnel
+                conn.set_tunnel(self.host, self.port, headers=self._proxy_headers)
+        conn.connect()
+        conn.sock.settimeout(self.read_timeout)
+        return conn
+
+    def get_conn(self):
+        """
+        Check out a connection, waiting for a free slot if maxsize are already out.
+        Give it back with put_conn() or discard_conn().
+
+        :return: (connection, was_reused)
+        :rtype: tuple[HTTPConnection, bool]
+        """
+        if not self._slots.acquire(timeout=self.pool_timeout):
+            raise RuntimeError("No free connection to {} after {} seconds.".format(self.host, self.pool_timeout))
+        try:
+            return self._idle.get_nowait(), True
+        except Empty:
+            pass
+        try:
+            return self._new_conn(), False
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def put_conn(self, conn):
+        try:
+            self._idle.put_nowait(conn)
+        except Full:
+            conn.close()
+        self._slots.release()
+
+    def discard_conn(self, conn):
+        conn.close()
+        self._slots.release()
+
+    def _request_target(self, path):
+        if self.proxy is not None and self.scheme == "http":
+            # a plain HTTP proxy is sent the absolute URL
+            return "http://{}:{}{}".format(self.host, self.port, path)
+        return path
+
+    def urlopen(self, method, path, headers):
+        target = self._request_target(path)
+        if self.proxy is not None and self.scheme == "http" and self._proxy_headers:
+            headers = dict(headers, **self._proxy_headers)
+        conn, reused = self.get_conn()
+        try:
+            conn.request(method, target, headers=headers)
+            resp = conn.getresponse()
+        except (HTTPException, ConnectionError) as e:
+            conn.close()
+            if not reused:
+                self._slots.release()
+                raise
+            # The server dropped an idle keep-alive connection, try once on a fresh one, in the same slot.
+            try:
+                conn = self._new_conn()
+            except BaseException:
+                self._slots.release()
+                raise
+            try:
+                conn.request(method, target, headers=headers)
+                resp = conn.getresponse()
+            except Exception:
+                self.discard_conn(conn)
+                raise
+        except Exception:
+            self.discard_conn(conn)
+            raise
+        return conn, resp
+
+    def clear(self):
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except Empty:
+                break
+            conn.close()
+
+
+class WFSConnectionPool(object):
+    """
+    Shared, per-host pool of keep-alive HTTP(S) connections.
+    All requests to the ABS WFS backends go through one of these, so repeated
+    requests to geo.abs.gov.au don't pay a new TCP and TLS handshake each time.
+    """
+
+    def __init__(self, maxsize=10, connect_timeout=None, read_timeout=None, pool_timeout=None,
+                 max_redirects=3, headers=None):
+        self.maxsize = maxsize
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.pool_timeout = pool_timeout
+        self.max_redirects = max_redirects
+        self.headers = headers or {}
+        self._pools = {}
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+
+    def _get_host_pool(self, scheme, host, port):
+        key = (scheme, host, port)
+        with self._lock:
+            if self._pid != os.getpid():
+                # We've been forked, sockets inherited from the parent cannot be shared.
+                self._pools = {}
+                self._pid = os.getpid()
+            try:
+                return self._pools[key]
+            except KeyError:
+                pool = HostConnectionPool(
+                    scheme, host, port, maxsize=self.maxsize,
+                    connect_timeout=self.connect_timeout,
+                    read_timeout=self.read_timeout,
+                    pool_timeout=self.pool_timeout,
+                    proxy=proxy_for(scheme, host))
+                self._pools[key] = pool
+                return pool
+
+    def request(self, method, url, headers=None):
+        """
+        :param method: HTTP method, eg 'GET'
+        :type method: str
+        :param url: absolute http or https URL
+        :type url: str
+        :return: the response, close it to release the connection
+        :rtype: PooledResponse
+        """
+        _headers = dict(self.headers)
+        if headers:
+            _headers.update(headers)
+        redirects = 0
+        while True:
+            parts = urlsplit(url)
+            scheme = parts.scheme.lower()
+            if scheme not in ("http", "https"):
+                raise ValueError("Cannot request a non-HTTP URL: {}".format(url))
+            port = parts.port or (443 if scheme == "https" else 80)
+            path = parts.path or "/"
+            if parts.query:
+                path = "{}?{}".format(path, parts.query)
+            pool = self._get_host_pool(scheme, parts.hostname, port)
+            conn, resp = pool.urlopen(method, path, _headers)
+            pooled = PooledResponse(pool, conn, resp, url)
+            if resp.status in REDIRECT_CODES and redirects < self.max_redirects:
+                location = resp.getheader('Location')
+                if location:
+                    resp.read()
+                    pooled.close()
+                    url = urljoin(url, location)
+                    redirects += 1
+                    if resp.status == 303:
+                        method = 'GET'
+                    continue
+            return pooled
+
+    def clear(self):
+        with self._lock:
+            pools = list(self._pools.values())
+            self._pools = {}
+        for p in pools:
+            p.clear()
+
+
+wfs_pool = WFSConnectionPool(
+    maxsize=conf.WFS_POOL_SIZE,
+    connect_timeout=conf.WFS_CONNECT_TIMEOUT,
+    read_timeout=conf.WFS_READ_TIMEOUT,
+    pool_timeout=conf.WFS_POOL_TIMEOUT,
+)
@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+"""
+A minimal Mapbox Vector Tile (v2.1) encoder, for polygon layers.
+See https://github.com/mapbox/vector-tile-spec/tree/master/2.1
+"""
+import struct
+
+import numpy as np
+
+# protobuf wire types
+_VARINT = 0
+_LENGTH_DELIMITED = 2
+
+# geometry commands
+_MOVE_TO = 1
+_LINE_TO = 2
+_CLOSE_PATH = 7
+
+POLYGON = 3
+
+
+def _varint(n):
+    out = bytearray()
+    while n > 0x7f:
+        out.append((n & 0x7f) | 0x80)
+        n >>= 7
+    out.append(n)
+    return bytes(out)
+
+
+def _packed_varints(values):
+    """
+    :param values: non-negative integers, less than 2**35
+    :type values: np.ndarray
+    :rtype: bytes
+    """
+    v = np.asarray(values, dtype=np.uint64)
+    if len(v) < 1:
+        return b""
+    nbytes = np.ones(len(v), dtype=np.int64)
+    for k in range(1, 5):
+        nbytes += v >= (1 << (7 * k))
+    out = np.empty((len(v), 5), dtype=np.uint8)
+    for k in range(5):
+        byte = (v >> np.uint64(7 * k)) & np.uint64(0x7f)
+        more = (nbytes > k + 1).astype(np.uint64) << np.uint64(7)
+        out[:, k] = byte | more
+    return out[np.arange(5) < nbytes[:, None]].tobytes()
+
+
+def _key(field, wire_type):
+    return _varint((field << 3) | wire_type)
+
+
+def _bytes_field(field, payload):
+    return _key(field, _LENGTH_DELIMITED) + _varint(len(payload)) + payload
+
+
+def _uint_field(field, n):
+    return _key(field, _VARINT) + _varint(n)
+
+
+def _command(cmd, count):
+    return (count << 3) | cmd
+
+
+def _zigzag(a):
+    return (a << 1) ^ (a >> 63)
+
+
+def ring_area(ring):
+    """
+    Twice the signed area of a closed ring by the surveyor's formula, in tile coordinates (y down).
+    Positive is clockwise on screen, which is what MVT wants for exterior rings.
+    """
+    x = ring[:, 0]
+    y = ring[:, 1]
+    return int(np.sum(x[:-1] * y[1:] - x[1:] * y[:-1]))
+
+
+def encode_polygon_geometry(polygons):
+    """
+    :param polygons: one list of rings per polygon, each ring a closed (N, 2) int64 array of tile coordinates.
+                     Exterior rings must wind clockwise on screen and interior rings anticlockwise.
+    :return: the packed geometry command integers
+    :rtype: bytes
+    """
+    parts = []
+    cursor = np.zeros(2, dtype=np.int64)
+    for rings in polygons:
+        for ring in rings:
+            pts = ring[:-1]  # ClosePath stands in for the closing position
+            deltas = np.diff(pts, axis=0, prepend=cursor[None, :])
+            cursor = pts[-1]
+            zz = _zigzag(deltas.astype(np.int64))
+            parts.append(np.array([_command(_MOVE_TO, 1)], dtype=np.int64))
+            parts.append(zz[0])
+            parts.append(np.array([_command(_LINE_TO, len(pts) - 1)], dtype=np.int64))
+            parts.append(zz[1:].ravel())
+            parts.append(np.array([_command(_CLOSE_PATH, 1)], dtype=np.int64))
+    if not parts:
+        return b""
+    return _packed_varints(np.concatenate(parts))
+
+
+def _encode_value(value):
+    if isinstance(value, bool):
+        return _uint_field(7, int(value))
+    elif isinstance(value, int) and value >= 0:
+        return _uint_field(5, value)
+    elif isinstance(value, float):
+        return _key(3, 1) + struct.pack('<d', value)
+    return _bytes_field(1, str(value).encode('utf-8'))
+
+
+def encode_layer(name, features, extent=4096):
+    """
+    :param name: the layer name
+    :param features: (id or None, properties dict, polygons) tuples, polygons as for encode_polygon_geometry
+    :param extent: tile coordinate range
+    :return: the encoded Layer message
+    :rtype: bytes
+    """
+    keys = {}
+    values = {}
+    body = [_uint_field(15, 2), _bytes_field(1, name.encode('utf-8'))]
+    for feature_id, properties, polygons in features:
+        geometry = encode_polygon_geometry(polygons)
+        if not geometry:
+            continue
+        tags = []
+        for k, v in properties.items():
+            tags.append(keys.setdefault(k, len(keys)))
+            tags.append(values.setdefault((type(v), v), len(values)))
+        feature = []
+        if feature_id is not None:
+            feature.append(_uint_field(1, feature_id))
+        if tags:
+            feature.append(_bytes_field(2, _packed_varints(np.array(tags))))
+        feature.append(_uint_field(3, POLYGON))
+        feature.append(_bytes_field(4, geometry))
+        body.append(_bytes_field(2, b"".join(feature)))
+    for k in keys:
+        body.append(_bytes_field(3, k.encode('utf-8')))
+    for (_t, v) in values:
+        body.append(_bytes_field(4, _encode_value(v)))
+    body.append(_uint_field(5, extent))
+    return b"".join(body)
+
+
+def encode_tile(layers):
+    """
+    :param layers: encoded Layer messages, from encode_layer
+    :return: the encoded Tile
+    :rtype: bytes
+    """
+    return b"".join(_bytes_field(3, layer) for layer in layers)
@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+import re
+
+import rdflib
+from rdflib import BNode, Literal
+from rdflib.namespace import RDF
+
+RDF_TYPE = RDF.term('type')
+
+NTRIPLES_FORMATS = {'application/n-triples', 'nt', 'nt11', 'ntriples'}
+TURTLE_FORMATS = {'text/turtle', 'turtle', 'ttl'}
+
+# Prefixed names are only used when the local part is plainly safe
+_SAFE_LOCAL_NAME = re.compile(r'^[A-Za-z_][A-Za-z0-9_\-]*$')
+
+
+def escape_literal(text):
+    """
+    Backslash-escape the characters a quoted N-Triples/Turtle string can't hold as they are.
+    str.replace is used rather than str.translate, which is very slow on the huge GML literals.
+
+    :type text: str
+    :rtype: str
+    """
+    return text.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n').replace('\r', '\\r')
+
+
+def quote_literal(lit):
+    """
+    :type lit: Literal
+    :return: the literal in N-Triples form, which is also valid Turtle
+    :rtype: str
+    """
+    text = '"%s"' % escape_literal(str(lit))
+    if lit.language:
+        return '%s@%s' % (text, lit.language)
+    if lit.datatype:
+        return '%s^^<%s>' % (text, lit.datatype)
+    return text
+
+
+class TripleWriter(object):
+    """
+    Collects triples like an rdflib.Graph does for add() and bind(), but writes them straight
+    out as N-Triples or Turtle text, without building a Graph store or running rdflib's serializers.
+    Other formats go through a real rdflib.Graph, see to_graph().
+    Like a Graph, adding the same triple twice keeps one of it.
+    """
+
+    def __init__(self):
+        self._triples = {}  # an ordered set, the values are unused
+        self._namespaces = {}  # prefix -> namespace
+
+    def bind(self, prefix, namespace, override=True):
+        if override or prefix not in self._namespaces:
+            self._namespaces[prefix] = str(namespace)
+
+    def namespaces(self):
+        return iter(self._namespaces.items())
+
+    def add(self, triple):
+        self._triples[triple] = None
+        return self
+
+    def __iter__(self):
+        return iter(self._triples)
+
+    def __len__(self):
+        return len(self._triples)
+
+    def __contains__(self, triple):
+        return triple in self._triples
+
+    def to_graph(self):
+        """
+        :rtype: rdflib.Graph
+        """
+        g = rdflib.Graph()
+        for prefix, namespace in self._namespaces.items():
+            g.bind(prefix, namespace)
+        for triple in self._triples:
+            g.add(triple)
+        return g
+
+    def serialize(self, destination=None, format='xml', encoding='utf-8', **kwargs):
+        if format in NTRIPLES_FORMATS:
+            text = self.to_ntriples()
+        elif format in TURTLE_FORMATS:
+            text = self.to_turtle()
+        else:
+            return self.to_graph().serialize(destination=destination, format=format, encoding=encoding, **kwargs)
+        data = text.encode(encoding or 'utf-8')
+        if destination is None:
+            return data
+        if hasattr(destination, 'write'):
+            destination.write(data)
+        else:
+            with open(destination, 'wb') as f:
+                f.write(data)
+
+    @staticmethod
+    def _nt_term(term, cache):
+        s = cache.get(term, None)
+        if s is None:
+            if isinstance(term, Literal):
+                s = quote_literal(term)
+            elif isinstance(term, BNode):
+                s = '_:%s' % term
+            else:
+                s = '<%s>' % term
+            cache[term] = s
+        return s
+
+    def to_ntriples(self):
+        """
+        :rtype: str
+        """
+        cache = {}
+        term = self._nt_term
+        lines = [' '.join((term(s, cache), term(p, cache), term(o, cache), '.\n')) for (s, p, o) in self._triples]
+        return ''.join(lines)
+
+    def to_turtle(self):
+        """
+        Turtle with the bound prefixes, the triples grouped by subject then predicate.
+
+        :rtype: str
+        """
+        namespaces = sorted(self._namespaces.items(), key=lambda kv: len(kv[1]), reverse=True)
+        used_prefixes = set()
+        cache = {}
+
+        def iri(uri):
+            s = cache.get(uri, None)
+            if s is None:
+                s = '<%s>' % uri
+                for prefix, namespace in namespaces:
+                    if uri.startswith(namespace) and _SAFE_LOCAL_NAME.match(uri[len(namespace):]):
+                        s = '%s:%s' % (prefix, uri[len(namespace):])
+                        used_prefixes.add(prefix)
+                        break
+                cache[uri] = s
+            return s
+
+        def term(t):
+            if isinstance(t, Literal):
+                s = cache.get(t, None)
+                if s is None:
+                    s = '"%s"' % escape_literal(str(t))
+                    if t.language:
+                        s = '%s@%s' % (s, t.language)
+                    elif t.datatype:
+                        s = '%s^^%s' % (s, iri(t.datatype))
+                    cache[t] = s
+                return s
+            elif isinstance(t, BNode):
+                return '_:%s' % t
+            return iri(t)
+
+        subjects = {}
+        for (s, p, o) in self._triples:
+            subjects.setdefault(s, {}).setdefault(p, []).append(o)
+        blocks = []
+        for s, predicates in subjects.items():
+            pred_lines = []
+            for p, objects in predicates.items():
+                pred = 'a' if p == RDF_TYPE else term(p)
+                pred_lines.append(pred + ' ' + ',\n        '.join(term(o) for o in objects))
+            blocks.append(term(s) + ' ' + ' ;\n    '.join(pred_lines) + ' .\n')
+        header = ''.join('@prefix {}: <{}> .\n'.format(prefix, namespace)
+                         for prefix, namespace in self._namespaces.items() if prefix in used_prefixes)
+        return header + '\n' + '\n'.join(blocks)
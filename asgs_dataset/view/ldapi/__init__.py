@@ -1,10 +1,18 @@
 # -*- coding: utf-8 -*-
 
+import gzip
+import hashlib
+import io
+import os
+
 from flask import render_template, Response, redirect
+from werkzeug.wsgi import wrap_file
 
 import pyldapi
-from asgs_dataset.model import ASGSModel, NotFoundError
+from asgs_dataset.model import ASGSModel, NotFoundError, ServiceUnavailableError
 from asgs_dataset.model.asgs_feature import ASGSFeature
+from asgs_dataset.model.cache import DiskCache, SizedLRUCache
+import asgs_dataset._config as conf
 
 ASGSView = pyldapi.View('ASGS',
     'View of an ASGS Feature using the ASGS ontology and those it imports',
@@ -37,6 +45,96 @@ WFSView = pyldapi.View('Web Feature Service',
 )
 
 
+RESPONSE_CACHE = SizedLRUCache(conf.RESPONSE_CACHE_MAX_BYTES, max_item_bytes=conf.RESPONSE_CACHE_MAX_ITEM_BYTES)
+# response cache key -> (mimetype, body) of a rendered asgs, loci or geosparql view
+CACHED_VIEWS = {'asgs', 'loci', 'geosparql'}
+
+
+def _code_version():
+    """
+    A hash of the package's code and templates, so responses rendered by another deploy's are never served.
+
+    :rtype: str
+    """
+    h = hashlib.sha256(conf.RESPONSE_CACHE_VERSION.encode('utf-8'))
+    for root, dirs, files in os.walk(conf.APP_DIR):
+        dirs.sort()
+        for name in sorted(files):
+            if name.endswith(('.py', '.html')):
+                path = os.path.join(root, name)
+                h.update(os.path.relpath(path, conf.APP_DIR).encode('utf-8'))
+                with open(path, 'rb') as f:
+                    h.update(f.read())
+    return h.hexdigest()[:16]
+
+
+RESPONSE_CACHE_CODE_VERSION = _code_version()
+
+_response_disk_cache = None
+
+
+def get_response_disk_cache():
+    """
+    :return: the DiskCache of rendered responses, or None if conf.RESPONSE_CACHE_DIR is not set
+    :rtype: DiskCache | None
+    """
+    global _response_disk_cache
+    if not conf.RESPONSE_CACHE_DIR:
+        return None
+    if _response_disk_cache is None or _response_disk_cache.directory != conf.RESPONSE_CACHE_DIR:
+        _response_disk_cache = DiskCache(conf.RESPONSE_CACHE_DIR, ttl=conf.RESPONSE_CACHE_DISK_TTL,
+                                         max_bytes=conf.RESPONSE_CACHE_DISK_MAX_BYTES)
+    return _response_disk_cache
+
+
+def get_cached_response(key):
+    """
+    :param key: from ASGSClassRenderer._response_cache_key()
+    :return: (mimetype, body), or None on a miss
+    :rtype: tuple | None
+    """
+    cached = RESPONSE_CACHE.get(key)
+    if cached is not None:
+        return cached
+    disk_cache = get_response_disk_cache()
+    if disk_cache is None:
+        return None
+    entry = disk_cache.get(key)
+    if entry is None:
+        return None
+    # Disk entries are the mimetype line then the body
+    mimetype, _, body = entry.partition(b'\n')
+    cached = (mimetype.decode('utf-8'), body)
+    RESPONSE_CACHE.put(key, cached, size=len(body))
+    return cached
+
+
+def cache_response(key, response):
+    """
+    Keep a rendered response for get_cached_response(), if it is a complete successful one.
+
+    :type response: Response
+    """
+    if not isinstance(response, Response) or response.status_code != 200 \
+            or response.direct_passthrough or response.is_streamed:
+        return
+    body = response.get_data()
+    mimetype = response.mimetype
+    RESPONSE_CACHE.put(key, (mimetype, body), size=len(body))
+    disk_cache = get_response_disk_cache()
+    if disk_cache is not None:
+        disk_cache.put(key, mimetype.encode('utf-8') + b'\n' + body)
+
+
+def _content_length(f):
+    if isinstance(f, io.BytesIO):
+        return f.getbuffer().nbytes
+    try:
+        return os.fstat(f.fileno()).st_size
+    except (AttributeError, OSError, io.UnsupportedOperation):
+        return None
+
+
 def render_error(request, e):
     try:
         print(e)
@@ -56,6 +154,10 @@ def render_error(request, e):
         error_type = 'Not Implemented'
         error_code = 406
         error_message = e.args[0] or "No message"
+    elif isinstance(e, ServiceUnavailableError):
+        error_type = 'Service Unavailable'
+        error_code = 503
+        error_message = e.args[0] or "No message"
     elif isinstance(e, RuntimeError):
         error_type = 'Server Error'
         error_code = 500
@@ -99,10 +201,35 @@ class ASGSClassRenderer(pyldapi.Renderer):
         #self.identifier = None  # inheriting classes will need to add the Identifier themselves.
         #self.instance = None  # inheriting classes will need to add the Instance themselves.
 
+    def _response_cache_key(self):
+        """
+        :return: the key the rendered response is cached under, or None if it is not cached
+        :rtype: str | None
+        """
+        if conf.RESPONSE_CACHE_MAX_BYTES <= 0 and not conf.RESPONSE_CACHE_DIR:
+            return None
+        if getattr(self, 'vf_error', None) or self.view not in CACHED_VIEWS or self.format == '_internal':
+            return None
+        # The HTML links back to the request's base_url, and _geometry changes the RDF geometries
+        geometry_encoding = self.request.values.get('_geometry', '').lower()
+        return '|'.join((RESPONSE_CACHE_CODE_VERSION, self.uri, self.view, self.format,
+                         geometry_encoding, self.request.base_url))
+
     def render(self):
         response = super(ASGSClassRenderer, self).render()
         if response is not None:
             return response
+        cache_key = getattr(self, 'response_cache_key', None)
+        cached = getattr(self, 'cached_response', None)
+        if cached is not None:
+            (mimetype, body) = cached
+            return Response(body, mimetype=mimetype, headers=self.headers)
+        response = self._render_view()
+        if cache_key is not None:
+            cache_response(cache_key, response)
+        return response
+
+    def _render_view(self):
         try:
             instance = self.instance
             if instance is None:
@@ -180,7 +307,22 @@ class ASGSClassRenderer(pyldapi.Renderer):
             raise RuntimeError("Cannot render 'wfs' View with format '{}'.".format(self.format))
 
     def _render_wfs_view_xml(self):
-        return redirect(self.instance.get_wfs_query_for_feature_type(), 303)
+        if not conf.WFS_VIEW_PASSTHROUGH:
+            return redirect(self.instance.get_wfs_query_for_feature_type(), 303)
+        # Pass the WFS response bytes through as they are held, gzip and all if the client takes it
+        source, is_gzip = self.instance.open_wfs_xml()
+        send_gzip = is_gzip and self.request.accept_encodings['gzip'] > 0
+        if is_gzip and not send_gzip:
+            source = gzip.GzipFile(fileobj=source, mode='rb')
+        resp = Response(wrap_file(self.request.environ, source), mimetype=self.format, headers=self.headers,
+                        direct_passthrough=True)
+        if send_gzip:
+            resp.headers['Content-Encoding'] = 'gzip'
+            length = _content_length(source)
+            if length is not None:
+                resp.content_length = length
+        resp.vary.add('Accept-Encoding')
+        return resp
 
     def _render_geosparql_view(self):
         if self.format == 'text/html':
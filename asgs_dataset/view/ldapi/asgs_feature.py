@@ -1,7 +1,8 @@
 # -*- coding: utf-8 -*-
 from asgs_dataset.model import NotFoundError
 from asgs_dataset.model import asgs_feature
-from asgs_dataset.view.ldapi import ASGSClassRenderer
+from asgs_dataset.helpers import GEOMETRY_ENCODINGS
+from asgs_dataset.view.ldapi import ASGSClassRenderer, get_cached_response
 import asgs_dataset._config as config
 
 
@@ -17,17 +18,26 @@ class ASGSFeatureRenderer(ASGSClassRenderer):
         else:
             _uri = ''.join([config.URI_ASGSFEATURE_INSTANCE_BASE, identifier])
         self.identifier = identifier
+        template_given = 'asgs_template' in kwargs
+        kwargs.setdefault('asgs_template',
+                          'asgs-' + asgs_feature.ASGSFeature.determine_asgs_type(_uri) + '-en.html')
+        super(ASGSFeatureRenderer, self).__init__(
+            request, _uri, _views, *args,
+            default_view_token=default_view_token, **kwargs)
+        # The view and format are negotiated now, a cached rendering of them needs no ASGSFeature
+        self.response_cache_key = self._response_cache_key()
+        self.cached_response = None
+        if self.response_cache_key is not None:
+            self.cached_response = get_cached_response(self.response_cache_key)
+        if self.cached_response is not None:
+            self.instance = None
+            return
         try:
             self.instance = asgs_feature.ASGSFeature(_uri)
-            kwargs.setdefault('asgs_template',
-                              'asgs-' + self.instance.asgs_type + '-en.html')
         except Exception as e:
             self.instance = e
-            kwargs.setdefault('asgs_template',
-                              'asgs-error-en.html')
-        super(ASGSFeatureRenderer, self).__init__(
-            request, _uri, _views, *args,
-            default_view_token=default_view_token, **kwargs)
+            if not template_given:
+                self.asgs_template = 'asgs-error-en.html'
         if isinstance(self.instance, Exception) and self.view == "_internal":
             raise self.instance
 
@@ -38,13 +48,14 @@ class ASGSFeatureRenderer(ASGSClassRenderer):
             'deets': self.instance.properties,
             'instance_id': self.identifier
         }
-        geometry = self.instance.geometry
-        if len(geometry) > 0:
-            (w, s, e, n) = self.instance.get_bbox()  # (minx, miny, maxx, maxy)
-            bbox = [[w,s],[e,n]]
+        # The map's bounds come from the geometry summary, which is usually precomputed,
+        # and the geometry drawn is the simplified one, which is usually cached
+        summary = self.instance.get_geometry_summary()
+        geometry = self.instance.get_simplified_geometry() if summary is not None else None
+        if geometry:
             _template_context.update({
-                'geometry': geometry,
-                'bbox': bbox,
+                'geometry': geometry.to_geojson(precision=config.GEOJSON_COORDINATE_PRECISION),
+                'bbox': [[summary['west'], summary['south']], [summary['east'], summary['north']]],
             })
         else:
             _template_context.update({
@@ -58,15 +69,27 @@ class ASGSFeatureRenderer(ASGSClassRenderer):
         return super(ASGSFeatureRenderer, self).\
             _render_asgs_view_html(_template_context)
 
+    def _geometry_encoding(self):
+        # the _geometry query parameter picks how the asgs and geosparql views serialize geometries
+        encoding = self.request.values.get('_geometry', None)
+        if encoding is None:
+            return None
+        encoding = encoding.lower()
+        if encoding not in GEOMETRY_ENCODINGS:
+            raise NotImplementedError(
+                "Geometry encoding \"{}\" is not implemented, use one of: {}".format(
+                    encoding, ", ".join(GEOMETRY_ENCODINGS)))
+        return encoding
+
     def _render_asgs_view_rdf(self, g=None):
         # Renders both the 'asgs' view or the 'loci' view
         profile = self.view
-        g = self.instance._get_instance_rdf(profile=profile)
+        g = self.instance._get_instance_rdf(profile=profile, geometry_encoding=self._geometry_encoding())
         return super(ASGSFeatureRenderer, self)._render_asgs_view_rdf(g=g)
 
     def _render_geosparql_view_rdf(self, g=None):
         profile = 'geosparql'
-        g = self.instance._get_instance_rdf(profile=profile)
+        g = self.instance._get_instance_rdf(profile=profile, geometry_encoding=self._geometry_encoding())
         return super(ASGSFeatureRenderer, self)._render_geosparql_view_rdf(g=g)
 
     def _render_alternates_view_html(self, template_context=None):
@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+#
+# Builds the offline feature store (conf.FEATURE_STORE_PATH) with a bulk pull of every feature from the ABS WFS.
+# Re-running it resumes, features already in the store are not fetched again.
+#
+#$> python3 feature_store_builder.py            # all ASGS types
+#$> python3 feature_store_builder.py SA1 SA2    # just these types
+import sys
+
+from lxml import etree
+
+import asgs_dataset._config as conf
+from asgs_dataset.model.asgs_feature import ASGS_WFS_LOOKUP, FEATURE_CACHE
+from asgs_dataset.model.async_wfs import AsyncWFSClient, run_until_complete
+from asgs_dataset.model.feature_store import FeatureStore
+
+INDEX_PAGE_SIZE = 1000  # codes per WFS index request
+CONCURRENCY = 20  # WFS requests in flight at once, be nice to geo.abs.gov.au
+
+
+async def build_type(client, store, asgs_type):
+    # Types with huge geometries are fetched one feature per request
+    batch_size = 1 if asgs_type in conf.WFS_STREAMING_PARSE_TYPES else conf.WFS_BATCH_SIZE
+    startindex = 0
+    added = 0
+    missing = []
+    while True:
+        # the index must come from the WFS, ASGSFeature.get_feature_index would read the store
+        codes = await client.get_feature_index(asgs_type, startindex, INDEX_PAGE_SIZE)
+        if len(codes) < 1:
+            break
+        startindex += len(codes)
+        to_fetch = [c for c in codes if (asgs_type, c) not in store]
+        if len(to_fetch) < 1:
+            continue
+        trees = await client.fetch_wfs_features(asgs_type, to_fetch, batch_size=batch_size)
+        store.put_many(asgs_type, [
+            (code, etree.tostring(tree, xml_declaration=True, encoding='utf-8'))
+            for code, tree in trees.items()])
+        FEATURE_CACHE.clear()  # don't hold on to the trees, they're in the store now
+        added += len(trees)
+        missing.extend(c for c in to_fetch if c not in trees)
+        print("{}: {} features indexed, {} added".format(asgs_type, startindex, added))
+    if missing:
+        print("{}: WFS did not return {} features: {}".format(asgs_type, len(missing), missing[:20]))
+    print("{}: done, {} features in the store".format(asgs_type, store.count(asgs_type)))
+
+
+async def build(asgs_types, path):
+    store = FeatureStore(path, readonly=False)
+    async with AsyncWFSClient(concurrency=CONCURRENCY) as client:
+        for asgs_type in asgs_types:
+            await build_type(client, store, asgs_type)
+
+
+if __name__ == "__main__":
+    types = sys.argv[1:] or sorted(ASGS_WFS_LOOKUP.keys())
+    for t in types:
+        if t not in ASGS_WFS_LOOKUP:
+            raise RuntimeError("Unknown ASGS type: {}".format(t))
+    run_until_complete(build(types, conf.FEATURE_STORE_PATH))
@@ -264,6 +264,29 @@ def do_mb_to_lga():
     with open("mb_to_lga.pickle", "wb") as f1:
         pickle.dump(pickle_struct, f1, protocol=4)
 
+def do_geometry_summaries(asgs_types=None):
+    # Needs the feature store, see feature_store_builder.py. Writes the .gz directly, it is built locally, not shipped.
+    import asgs_dataset._config as conf
+    from asgs_dataset.model.asgs_feature import ASGS_WFS_LOOKUP
+    from asgs_dataset.model.feature_store import FeatureStore
+    from asgs_dataset.model.geometry_summary import summarize_geometry, summaries_to_array
+    from asgs_dataset.model.vector_tiles import TILE_GEOMETRY_CACHE, load_store_geometry
+    store = FeatureStore(conf.FEATURE_STORE_PATH)
+    pickle_struct = dict()
+    for asgs_type in (asgs_types or sorted(ASGS_WFS_LOOKUP.keys())):
+        summaries = dict()
+        for code in store.codes(asgs_type):
+            geometry = load_store_geometry(store, asgs_type, code)
+            TILE_GEOMETRY_CACHE.clear()
+            if geometry is None:
+                continue
+            summaries[code] = summarize_geometry(geometry)
+        if summaries:
+            pickle_struct[asgs_type] = summaries_to_array(summaries)
+        print("{}: {} geometry summaries".format(asgs_type, len(summaries)))
+    with gzip.open(conf.GEOMETRY_SUMMARIES_PATH, "wb", compresslevel=9) as f1:
+        pickle.dump(pickle_struct, f1, protocol=4)
+
 def load_sa1_to_ucl():
     with gzip.open("sa1_to_ucl.pickle.gz", "rb", compresslevel=9) as fp:
         a = pickle.load(fp)
@@ -278,6 +301,7 @@ if __name__ == "__main__":
     # do_mb_to_ssc()
     # do_mb_to_nrmr()
     do_mb_to_lga()
+    # do_geometry_summaries()
 
 # To compress these:
 #$> gzip --rsyncable --best -k ./sa1_to_iloc.pickle
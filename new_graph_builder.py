@@ -11,9 +11,13 @@ import pyldapi
 import time
 from pyldapi.exceptions import RegOfRegTtlError
 from asgs_dataset.app import app
+import asgs_dataset._config as conf
 
 # --- CONFIGURABLE OPTIONS
 from asgs_dataset.model import NotFoundError
+from asgs_dataset.model.asgs_feature import ASGSFeature, ASGS_WFS_LOOKUP, retrieve_asgs_features
+from asgs_dataset.model.async_wfs import fetch_wfs_features
+from asgs_dataset.model.feature_store import get_feature_store
 
 OUTPUT_DIRECTORY = "./instance"  # Relative path from pwd
 INSTANCES_PER_FILE = 1000
@@ -21,6 +25,11 @@ HARVESTABLE_INSTANCE_VIEW = "loci"
 MULTI_PROCESSING = True
 MULTI_THREADING = True
 USE_SAVED_REGISTER_INDEX = True
+PREFETCH_BATCH_SIZE = 12  # Features fetched per batched WFS request, 0 to disable. Keep threads*this under the feature cache size.
+# When there is no feature store, prefetch with concurrent asyncio WFS requests of PREFETCH_ASYNC_BATCH_SIZE features,
+# rather than one blocking request per type. The async client doesn't read the WFS disk cache.
+PREFETCH_ASYNC = True
+PREFETCH_ASYNC_BATCH_SIZE = 3
 DEBUG_MODE = False  # Does nothing for now.
 VERBOSE_MODE = True
 #TODO: Automate this, somehow.
@@ -210,7 +219,9 @@ def _harvest_register_worker_fn(worker_index, reg_uri, instances, serial_chunk_s
             instance_s_group = list(instance_s_group)
         with open("{}/{}_p{}_s{}.nt".format(OUTPUT_DIRECTORY, reg_uri_to_filename(reg_uri), str(worker_index+1), str(iig+1)),
                   'ab+') as inst_file:
-            for inst in instance_s_group:
+            for i_inst, inst in enumerate(instance_s_group):
+                if PREFETCH_BATCH_SIZE and i_inst % PREFETCH_BATCH_SIZE == 0:
+                    prefetch_instances(instance_s_group[i_inst:i_inst+PREFETCH_BATCH_SIZE])
                 start_instance_time = 0 if first_group else time.perf_counter()
                 local_instance_url = str(inst).replace(replace_s, replace_r)
                 info_message = "{} Inst: {}/{}, ".format(info_message_pref, done_in_group+1, total_in_group)
@@ -299,6 +310,34 @@ def _harvest_register_worker_fn(worker_index, reg_uri, instances, serial_chunk_s
     return True
 
 
+def prefetch_instances(instances):
+    # Warm the feature cache for the next few instances, with batched WFS requests per ASGS type
+    by_type = {}
+    for inst in instances:
+        inst = str(inst)
+        if not (inst.startswith('http://') or inst.startswith('https://')):
+            continue
+        asgs_type = ASGSFeature.determine_asgs_type(inst)
+        if asgs_type in {'STATE', 'AUS'} or asgs_type not in ASGS_WFS_LOOKUP:
+            continue
+        by_type.setdefault(asgs_type, []).append(inst.split('/')[-1])
+    if len(by_type) < 1:
+        return
+    if PREFETCH_ASYNC and get_feature_store() is None and not conf.FEATURE_STORE_OFFLINE:
+        try:
+            fetch_wfs_features(by_type, batch_size=PREFETCH_ASYNC_BATCH_SIZE)
+        except Exception as e:
+            # Not fatal, each instance will just be fetched on its own
+            warn("Could not prefetch {} features: {}".format(sum(len(i) for i in by_type.values()), repr(e)))
+        return
+    for asgs_type, identifiers in by_type.items():
+        try:
+            retrieve_asgs_features(asgs_type, identifiers, batch_size=PREFETCH_BATCH_SIZE)
+        except Exception as e:
+            # Not fatal, each instance will just be fetched on its own
+            warn("Could not prefetch {} {} features: {}".format(len(identifiers), asgs_type, repr(e)))
+
+
 def find_matching_app_route(url):
     for rule in app.url_map.iter_rules():
         m = rule.match("|"+url)
@@ -0,0 +1,105 @@
+import threading
+import time
+
+from asgs_dataset.model.circuit_breaker import CircuitBreaker, WFSCircuitBreakers
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.005)
+    return True
+
+
+def test_opens_at_failure_rate():
+    breaker = CircuitBreaker('MB', failure_rate=0.5, window=10, min_calls=4, reset_timeout=60)
+    # under min_calls, all failures don't open it
+    for _ in range(3):
+        breaker.record_failure(RuntimeError("down"))
+    assert not breaker.is_open
+    assert breaker.allow()
+    breaker.record_failure(RuntimeError("down"))
+    assert breaker.is_open
+    breaker.record_success()  # a late success closes it again
+    assert not breaker.is_open
+    assert breaker.failure_rate() == 0.0
+
+
+def test_stays_closed_under_failure_rate():
+    breaker = CircuitBreaker('MB', failure_rate=0.75, window=4, min_calls=4, reset_timeout=60)
+    for _ in range(20):
+        breaker.record_success()
+        breaker.record_success()
+        breaker.record_failure()
+    assert not breaker.is_open
+    # the window only holds the last 4 requests
+    breaker.record_failure()
+    assert not breaker.is_open
+    breaker.record_failure()
+    assert breaker.is_open
+    assert breaker.failure_rate() == 0.75
+
+
+def test_half_open_without_probe():
+    breaker = CircuitBreaker('MB', failure_rate=0.5, window=10, min_calls=2, reset_timeout=0.05)
+    breaker.record_failure(RuntimeError("down"))
+    breaker.record_failure(RuntimeError("down"))
+    assert breaker.is_open
+    assert not breaker.allow()
+    assert not breaker.allow()
+    assert breaker.snapshot()['rejected'] == 2
+    assert breaker.snapshot()['last_error'] == "RuntimeError('down')"
+
+    # after reset_timeout, one trial request goes through
+    time.sleep(0.06)
+    assert breaker.allow()
+    assert not breaker.allow()
+    breaker.record_failure()
+    assert breaker.is_open  # still down, wait another reset_timeout
+
+    time.sleep(0.06)
+    assert breaker.allow()
+    breaker.record_success()
+    assert not breaker.is_open
+    assert breaker.allow()
+    assert breaker.snapshot()['state'] == CircuitBreaker.CLOSED
+    assert breaker.snapshot()['recent_requests'] == 0
+
+
+def test_half_open_probe_closes():
+    probes = []
+    recovered = threading.Event()
+
+    def probe():
+        probes.append(time.monotonic())
+        if not recovered.is_set():
+            raise RuntimeError("still down")
+
+    breaker = CircuitBreaker('SA1', probe=probe, failure_rate=0.5, window=10, min_calls=2, reset_timeout=0.02)
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.is_open
+    # requests are refused while the probe runs in the background, none go through as a trial
+    assert wait_for(lambda: len(probes) >= 2)
+    assert not breaker.allow()
+    assert breaker.is_open
+    assert breaker.snapshot()['last_error'] == "RuntimeError('still down')"
+
+    recovered.set()
+    assert wait_for(lambda: not breaker.is_open)
+    assert breaker.allow()
+    thread = breaker._probe_thread[1]
+    thread.join(1.0)
+    assert not thread.is_alive()
+
+
+def test_breakers_per_service():
+    breakers = WFSCircuitBreakers()
+    mb = 'https://geo.abs.gov.au/arcgis/services/ASGS2016/MB/MapServer/WFSServer'
+    assert breakers.service_name(mb) == 'MB'
+    assert breakers.service_name('http://localhost:3000/wfs') == 'localhost:3000'
+    assert breakers.for_url(mb) is breakers.for_url(mb + '?request=GetFeature')
+    assert breakers.for_url(mb) is not breakers.for_url(mb.replace('/MB/', '/SA1/'))
+    assert sorted(breakers.snapshot()) == ['MB', 'SA1']
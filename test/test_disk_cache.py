@@ -0,0 +1,154 @@
+import io
+import os
+import time
+
+import pytest
+
+from asgs_dataset.helpers import ns
+from asgs_dataset.model import asgs_feature
+from asgs_dataset.model.cache import DiskCache
+
+
+def age(cache, key, mtime_ago=0, atime_ago=0):
+    # set when the entry was written (mtime) and last read (atime), this many seconds ago
+    now = time.time()
+    os.utime(cache._path(key), (now - atime_ago, now - mtime_ago))
+
+
+def test_put_get(tmp_path):
+    cache = DiskCache(str(tmp_path / 'cache'))
+    assert cache.get('a') is None
+    cache.put('a', b'alpha' * 1000)
+    assert cache.get('a') == b'alpha' * 1000
+    with cache.open_compressed('a') as f:
+        assert f.read(2) == b'\x1f\x8b'  # kept as gzip on disk
+    cache.delete('a')
+    assert cache.get('a') is None
+
+
+def test_ttl_and_stale_reads(tmp_path):
+    cache = DiskCache(str(tmp_path), ttl=60)
+    cache.put('fresh', b'1')
+    cache.put('old', b'2')
+    age(cache, 'old', mtime_ago=120)
+    assert cache.get('fresh') == b'1'
+    assert cache.get('old') is None
+    assert cache.open('old') is None
+    # an expired entry is kept, for when the WFS is down
+    assert cache.get('old', allow_stale=True) == b'2'
+    # a stale read does not make it fresh again
+    assert cache.get('old') is None
+    cache.put('old', b'3')
+    assert cache.get('old') == b'3'
+
+
+def test_no_ttl_never_expires(tmp_path):
+    cache = DiskCache(str(tmp_path), ttl=None)
+    cache.put('a', b'1')
+    age(cache, 'a', mtime_ago=10 * 365 * 24 * 3600)
+    assert cache.get('a') == b'1'
+
+
+def test_read_refreshes_lru(tmp_path):
+    cache = DiskCache(str(tmp_path))
+    cache.put('a', b'1')
+    age(cache, 'a', mtime_ago=1000, atime_ago=1000)
+    before = os.stat(cache._path('a'))
+    assert cache.get('a') == b'1'
+    after = os.stat(cache._path('a'))
+    assert after.st_atime > before.st_atime
+    assert after.st_mtime == before.st_mtime
+
+
+def test_evict_lru_down_to_90_percent(tmp_path):
+    cache = DiskCache(str(tmp_path))
+    for i in range(10):
+        cache.put(str(i), os.urandom(1000))  # random bytes don't compress, so each entry is a bit over 1000
+        age(cache, str(i), atime_ago=100 - i)  # 0 is the least recently used
+    entry_size = os.stat(cache._path('0')).st_size
+    total = cache.size()
+    assert total == 10 * entry_size
+
+    cache.max_bytes = total
+    cache.evict()
+    assert cache.size() == total  # not over, nothing goes
+
+    cache.max_bytes = total - 1
+    cache.evict()
+    # back under 90% of max_bytes, least recently used first
+    assert cache.size() <= 0.9 * cache.max_bytes
+    kept = [str(i) for i in range(10) if cache.get(str(i)) is not None]
+    assert kept == [str(i) for i in range(2, 10)]
+
+
+def test_evict_expired_first(tmp_path):
+    cache = DiskCache(str(tmp_path), ttl=60)
+    for i in range(10):
+        cache.put(str(i), os.urandom(1000))
+        age(cache, str(i), atime_ago=100 - i)
+    # recently read, but expired
+    age(cache, '9', mtime_ago=120, atime_ago=0)
+    cache.max_bytes = cache.size() - 1
+    cache.evict()
+    assert cache.get('9', allow_stale=True) is None
+    assert cache.get('0') is None
+    assert [str(i) for i in range(10) if cache.get(str(i)) is not None] == [str(i) for i in range(1, 9)]
+
+
+def test_put_evicts_when_over(tmp_path):
+    cache = DiskCache(str(tmp_path), max_bytes=5000)
+    for i in range(20):
+        cache.put(str(i), os.urandom(1000))
+        age(cache, str(i), atime_ago=100 - i)
+    assert cache.size() <= 5000
+    assert cache.get('19') is not None
+    assert cache.get('0') is None
+    cache.clear()
+    assert cache.size() == 0
+
+
+
+def test_evict_removes_abandoned_temp_files(tmp_path):
+    cache = DiskCache(str(tmp_path))
+    cache.put('a', os.urandom(1000))
+    subdir = os.path.dirname(cache._path('a'))
+    abandoned = os.path.join(subdir, 'abandoned.tmp')
+    writing = os.path.join(subdir, 'writing.tmp')
+    for path in (abandoned, writing):
+        with open(path, 'wb') as f:
+            f.write(os.urandom(1000))
+    old = time.time() - cache.tmp_grace - 10
+    os.utime(abandoned, (old, old))
+    cache.max_bytes = 10 ** 6
+    cache.evict()
+    assert not os.path.exists(abandoned)
+    assert os.path.exists(writing)
+    assert cache.get('a') is not None
+    # a temp file still being written counts towards max_bytes
+    cache.max_bytes = cache.size() + 500
+    cache.evict()
+    assert cache.get('a') is None
+    assert os.path.exists(writing)
+
+EXCEPTION_REPORT = b'<?xml version="1.0"?><ows:ExceptionReport xmlns:ows="http://www.opengis.net/ows/1.1">' \
+                   b'<ows:Exception exceptionCode="NoApplicableCode"/></ows:ExceptionReport>'
+EMPTY_COLLECTION = '<?xml version="1.0"?><wfs:FeatureCollection xmlns:wfs="{}"/>'.format(ns['wfs']).encode()
+# a member that doesn't start until well past the first chunk read
+FEATURE_COLLECTION = '<?xml version="1.0"?><wfs:FeatureCollection xmlns:wfs="{}" xmlns:gml="{}">{}' \
+                     '<gml:member><MB>1</MB></gml:member></wfs:FeatureCollection>'.format(
+                         ns['wfs'], ns['gml'], ' ' * 200000).encode()
+
+
+@pytest.mark.parametrize('body,cached', [
+    (EXCEPTION_REPORT, False),
+    (EMPTY_COLLECTION, False),
+    (b'not xml', False),
+    (FEATURE_COLLECTION, True),
+])
+def test_cached_wfs_request_only_keeps_features(tmp_path, monkeypatch, body, cached):
+    cache = DiskCache(str(tmp_path))
+    monkeypatch.setattr(asgs_feature, 'WFS_DISK_CACHE', cache)
+    monkeypatch.setattr(asgs_feature, 'retryable_request', lambda uri, method, **kwargs: io.BytesIO(body))
+    with asgs_feature.cached_wfs_request('http://wfs/?q') as resp:
+        assert resp.read() == body
+    assert cache.get('http://wfs/?q') == (body if cached else None)
@@ -0,0 +1,87 @@
+import struct
+
+import shapely.geometry
+import shapely.wkb
+import shapely.wkt
+
+from asgs_dataset.geometry import CompactGeometry
+
+EXTERIOR = [(0.0, 0.0), (10.0, 0.0), (10.0, 10.0), (0.0, 10.0), (0.0, 0.0)]
+HOLE = [(2.5, 2.5), (2.5, 7.5), (7.5, 7.5), (7.5, 2.5), (2.5, 2.5)]
+# not exactly representable, so WKT must print the shortest text that reads back to the same float
+TRIANGLE = [(16543210.12345679, -4012345.1), (16543220.7, -4012345.1), (16543215.3, -4012340.000001),
+            (16543210.12345679, -4012345.1)]
+
+
+def wkb_ring(ring):
+    return struct.pack('<I', len(ring)) + b"".join(struct.pack('<' + 'd' * len(p), *p) for p in ring)
+
+
+def wkb_polygon(rings, geom_type=3):
+    return struct.pack('<BII', 1, geom_type, len(rings)) + b"".join(wkb_ring(r) for r in rings)
+
+
+def test_polygon_wkt():
+    geom = CompactGeometry.from_geojson({'type': "Polygon", 'coordinates': [EXTERIOR, HOLE]})
+    assert geom.to_wkt() == (
+        "POLYGON ((0.0 0.0, 10.0 0.0, 10.0 10.0, 0.0 10.0, 0.0 0.0), "
+        "(2.5 2.5, 2.5 7.5, 7.5 7.5, 7.5 2.5, 2.5 2.5))")
+
+
+def test_multipolygon_wkt():
+    geom = CompactGeometry.from_geojson({'type': "MultiPolygon", 'coordinates': [[EXTERIOR, HOLE], [TRIANGLE]]})
+    wkt = geom.to_wkt()
+    assert wkt.startswith("MULTIPOLYGON (((0.0 0.0, 10.0 0.0, ")
+    assert wkt.endswith(", 2.5 2.5)), ((16543210.12345679 -4012345.1, 16543220.7 -4012345.1, "
+                        "16543215.3 -4012340.000001, 16543210.12345679 -4012345.1)))")
+
+
+def test_wkt_round_trips_floats():
+    geom = CompactGeometry.from_geojson({'type': "Polygon", 'coordinates': [TRIANGLE]})
+    body = geom.to_wkt()[len("POLYGON (("):-len("))")]
+    positions = [tuple(float(v) for v in p.split()) for p in body.split(", ")]
+    assert positions == TRIANGLE
+
+
+def test_wkt_z_and_empty():
+    ring = [(0.0, 0.0, 1.0), (1.0, 0.0, 2.0), (1.0, 1.0, 3.0), (0.0, 0.0, 1.0)]
+    geom = CompactGeometry.from_geojson({'type': "Polygon", 'dims': 3, 'coordinates': [ring]})
+    assert geom.to_wkt() == "POLYGON Z ((0.0 0.0 1.0, 1.0 0.0 2.0, 1.0 1.0 3.0, 0.0 0.0 1.0))"
+    assert CompactGeometry.from_polygons("MultiPolygon", []).to_wkt() == "MULTIPOLYGON EMPTY"
+    assert CompactGeometry.from_polygons("Polygon", []).to_wkt() == "POLYGON EMPTY"
+
+
+def test_polygon_wkb():
+    geom = CompactGeometry.from_geojson({'type': "Polygon", 'coordinates': [EXTERIOR, HOLE]})
+    assert geom.to_wkb() == wkb_polygon([EXTERIOR, HOLE])
+
+
+def test_multipolygon_wkb():
+    geom = CompactGeometry.from_geojson({'type': "MultiPolygon", 'coordinates': [[EXTERIOR, HOLE], [TRIANGLE]]})
+    expected = struct.pack('<BII', 1, 6, 2) + wkb_polygon([EXTERIOR, HOLE]) + wkb_polygon([TRIANGLE])
+    assert geom.to_wkb() == expected
+
+
+def test_wkb_z_and_empty():
+    ring = [(0.0, 0.0, 1.0), (1.0, 0.0, 2.0), (1.0, 1.0, 3.0), (0.0, 0.0, 1.0)]
+    geom = CompactGeometry.from_geojson({'type': "MultiPolygon", 'dims': 3, 'coordinates': [[ring]]})
+    assert geom.to_wkb() == struct.pack('<BII', 1, 1006, 1) + wkb_polygon([ring], geom_type=1003)
+    assert CompactGeometry.from_polygons("MultiPolygon", []).to_wkb() == struct.pack('<BII', 1, 6, 0)
+    assert CompactGeometry.from_polygons("Polygon", []).to_wkb() == struct.pack('<BII', 1, 3, 0)
+
+
+def test_encodings_match_shapely():
+    geojson = {'type': "MultiPolygon", 'coordinates': [[EXTERIOR, HOLE], [TRIANGLE]]}
+    geom = CompactGeometry.from_geojson(geojson)
+    expected = shapely.geometry.shape(geojson)
+    assert shapely.wkb.loads(geom.to_wkb()).equals_exact(expected, 0)
+    assert shapely.wkt.loads(geom.to_wkt()).equals_exact(expected, 0)
+
+
+def test_z_encodings_match_shapely():
+    ring = [(0.0, 0.0, 1.0), (1.0, 0.0, 2.0), (1.0, 1.0, 3.0), (0.0, 0.0, 1.0)]
+    geom = CompactGeometry.from_geojson({'type': "Polygon", 'dims': 3, 'coordinates': [ring]})
+    for decoded in (shapely.wkb.loads(geom.to_wkb()), shapely.wkt.loads(geom.to_wkt())):
+        assert decoded.geom_type == "Polygon"
+        assert decoded.has_z
+        assert list(decoded.exterior.coords) == ring
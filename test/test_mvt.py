@@ -0,0 +1,215 @@
+import struct
+
+import numpy as np
+
+import asgs_dataset._config as conf
+from asgs_dataset.geometry import CompactGeometry
+from asgs_dataset.model.asgs_feature import ASGS_WFS_LOOKUP
+from asgs_dataset.model.vector_tiles import geometry_to_tile, get_tile_cache, tile_bounds
+from asgs_dataset.mvt import _packed_varints, encode_layer, encode_tile, ring_area
+
+
+# A minimal protobuf wire format reader, enough to decode the vector_tile.proto messages
+
+
+def read_varint(buf, pos):
+    result = 0
+    shift = 0
+    while True:
+        b = buf[pos]
+        pos += 1
+        result |= (b & 0x7f) << shift
+        if not b & 0x80:
+            return result, pos
+        shift += 7
+
+
+def read_fields(buf):
+    """
+    :return: (field number, value) pairs, value is an int for varints and bytes otherwise
+    """
+    fields = []
+    pos = 0
+    while pos < len(buf):
+        key, pos = read_varint(buf, pos)
+        field, wire_type = key >> 3, key & 7
+        if wire_type == 0:
+            value, pos = read_varint(buf, pos)
+        elif wire_type == 1:
+            value, pos = buf[pos:pos + 8], pos + 8
+        elif wire_type == 2:
+            length, pos = read_varint(buf, pos)
+            value, pos = buf[pos:pos + length], pos + length
+        elif wire_type == 5:
+            value, pos = buf[pos:pos + 4], pos + 4
+        else:
+            raise AssertionError("unexpected wire type {}".format(wire_type))
+        fields.append((field, value))
+    assert pos == len(buf)
+    return fields
+
+
+def read_packed(buf):
+    values = []
+    pos = 0
+    while pos < len(buf):
+        v, pos = read_varint(buf, pos)
+        values.append(v)
+    return values
+
+
+def unzigzag(n):
+    return (n >> 1) ^ -(n & 1)
+
+
+def decode_value(buf):
+    (field, value), = read_fields(buf)
+    if field == 1:
+        return value.decode('utf-8')
+    elif field == 3:
+        return struct.unpack('<d', value)[0]
+    elif field == 5:
+        return value
+    elif field == 7:
+        return bool(value)
+    raise AssertionError("unexpected Value field {}".format(field))
+
+
+def decode_geometry(commands):
+    """
+    :return: the rings, each a closed list of absolute (x, y)
+    """
+    rings = []
+    x = y = 0
+    i = 0
+    ring = None
+    while i < len(commands):
+        cmd, count = commands[i] & 7, commands[i] >> 3
+        i += 1
+        if cmd == 7:
+            assert count == 1
+            ring.append(ring[0])
+            rings.append(ring)
+            ring = None
+            continue
+        assert cmd in (1, 2)
+        if cmd == 1:
+            assert count == 1 and ring is None
+            ring = []
+        for _ in range(count):
+            x += unzigzag(commands[i])
+            y += unzigzag(commands[i + 1])
+            i += 2
+            ring.append([x, y])
+    assert ring is None
+    return rings
+
+
+def decode_tile(buf):
+    layers = {}
+    for field, layer_buf in read_fields(buf):
+        assert field == 3
+        layer = {'features': [], 'keys': [], 'values': []}
+        for f, v in read_fields(layer_buf):
+            if f == 15:
+                layer['version'] = v
+            elif f == 1:
+                layer['name'] = v.decode('utf-8')
+            elif f == 2:
+                layer['features'].append(read_fields(v))
+            elif f == 3:
+                layer['keys'].append(v.decode('utf-8'))
+            elif f == 4:
+                layer['values'].append(decode_value(v))
+            elif f == 5:
+                layer['extent'] = v
+        features = []
+        for feature_fields in layer['features']:
+            feature = {'id': None, 'properties': {}}
+            for f, v in feature_fields:
+                if f == 1:
+                    feature['id'] = v
+                elif f == 2:
+                    tags = read_packed(v)
+                    feature['properties'] = {layer['keys'][k]: layer['values'][t]
+                                             for k, t in zip(tags[::2], tags[1::2])}
+                elif f == 3:
+                    feature['type'] = v
+                elif f == 4:
+                    feature['rings'] = decode_geometry(read_packed(v))
+            features.append(feature)
+        layer['features'] = features
+        layers[layer['name']] = layer
+    return layers
+
+
+def ring(*positions):
+    return np.array(positions + positions[:1], dtype=np.int64)
+
+
+def test_packed_varints():
+    values = [0, 1, 127, 128, 300, 16383, 16384, 2 ** 28, 2 ** 35 - 1]
+    assert read_packed(_packed_varints(np.array(values))) == values
+    assert _packed_varints(np.array([], dtype=np.int64)) == b""
+
+
+def test_encode_tile_round_trip():
+    square = ring((0, 0), (4096, 0), (4096, 4096), (0, 4096))
+    hole = ring((1000, 1000), (1000, 3000), (3000, 3000), (3000, 1000))
+    # negative and multi-byte deltas, from positions in the buffer past the tile edge
+    far = ring((-64, -64), (5000, -64), (5000, 20000), (-64, 20000))
+    assert ring_area(square) > 0 and ring_area(hole) < 0 and ring_area(far) > 0
+    features = [
+        (80101, {'name': "Queanbeyan", 'area': 12.5, 'count': 300, 'urban': True}, [[square, hole]]),
+        (None, {'name': "Ōtautahi"}, [[far], [square]]),
+        (7, {'name': "gone"}, []),  # no geometry left, so not encoded
+    ]
+    tile = encode_tile([encode_layer("SA2", features, extent=4096), encode_layer("empty", [], extent=512)])
+    layers = decode_tile(tile)
+    assert sorted(layers) == ["SA2", "empty"]
+    assert layers["empty"]['extent'] == 512
+    assert layers["empty"]['features'] == []
+
+    layer = layers["SA2"]
+    assert layer['version'] == 2
+    assert layer['extent'] == 4096
+    assert len(layer['features']) == 2
+    first, second = layer['features']
+    assert first['id'] == 80101
+    assert first['type'] == 3
+    assert first['properties'] == {'name': "Queanbeyan", 'area': 12.5, 'count': 300, 'urban': True}
+    assert first['rings'] == [square.tolist(), hole.tolist()]
+    assert second['id'] is None
+    assert second['properties'] == {'name': "Ōtautahi"}
+    assert second['rings'] == [far.tolist(), square.tolist()]
+    # the repeated key is only stored once
+    assert layer['keys'].count('name') == 1
+
+
+def test_geometry_to_tile_winding():
+    z, x, y = 10, 925, 600
+    minx, miny, maxx, maxy = tile_bounds(z, x, y)
+    w = maxx - minx
+    # an anticlockwise (GeoJSON) exterior, with a clockwise hole, inside the tile
+    exterior = [(minx + 0.1 * w, miny + 0.1 * w), (minx + 0.9 * w, miny + 0.1 * w),
+                (minx + 0.9 * w, miny + 0.9 * w), (minx + 0.1 * w, miny + 0.9 * w), (minx + 0.1 * w, miny + 0.1 * w)]
+    interior = [(minx + 0.4 * w, miny + 0.4 * w), (minx + 0.4 * w, miny + 0.6 * w),
+                (minx + 0.6 * w, miny + 0.6 * w), (minx + 0.6 * w, miny + 0.4 * w), (minx + 0.4 * w, miny + 0.4 * w)]
+    geometry = CompactGeometry.from_geojson({'type': "Polygon", 'coordinates': [exterior, interior]})
+    polygons = geometry_to_tile(geometry, (minx, miny, maxx, maxy), 4096, 64)
+    assert len(polygons) == 1 and len(polygons[0]) == 2
+    outer, inner = polygons[0]
+    assert ring_area(outer) > 0
+    assert ring_area(inner) < 0
+    layers = decode_tile(encode_tile([encode_layer("SA2", [(1, {}, polygons)])]))
+    rings = layers["SA2"]['features'][0]['rings']
+    assert rings == [outer.tolist(), inner.tolist()]
+    xs = [p[0] for p in rings[0]]
+    assert min(xs) == 410 and max(xs) == 3686
+
+
+def test_tile_config(tmp_path, monkeypatch):
+    # every type with a min zoom can be served by the tile route
+    assert set(conf.TILE_MIN_ZOOM) <= set(ASGS_WFS_LOOKUP)
+    monkeypatch.setattr(conf, 'TILE_CACHE_DIR', str(tmp_path))
+    assert get_tile_cache().ttl == conf.TILE_CACHE_TTL
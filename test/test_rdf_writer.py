@@ -0,0 +1,59 @@
+import glob
+import os
+
+import pytest
+from rdflib import Graph, Literal, URIRef
+from rdflib.compare import isomorphic
+
+import asgs_dataset._config as conf
+from asgs_dataset.model.asgs_feature import ASGSFeature
+from asgs_dataset.rdf_writer import TripleWriter, escape_literal
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+INSTANCE_BASES = {
+    'MB': conf.URI_MESHBLOCK_INSTANCE_BASE,
+    'SA1': conf.URI_SA1_INSTANCE_BASE,
+    'SA2': conf.URI_SA2_INSTANCE_BASE,
+    'SA3': conf.URI_SA3_INSTANCE_BASE,
+    'SA4': conf.URI_SA4_INSTANCE_BASE,
+    'GCCSA': conf.URI_GCCSA_INSTANCE_BASE,
+    'STATE': conf.URI_STATE_INSTANCE_BASE,
+}
+
+
+def fixture_feature_uris(profile):
+    uris = []
+    for path in sorted(glob.glob(os.path.join(TEST_DIR, '*.xml*'))):
+        asgs_type, identifier = os.path.basename(path).split('.')[0].split('_', 1)
+        # rdflib takes minutes to parse the multi-megabyte GML literals of the streamed types
+        if profile == 'geosparql' and asgs_type in conf.WFS_STREAMING_PARSE_TYPES:
+            continue
+        uris.append((profile, INSTANCE_BASES[asgs_type] + identifier))
+    return uris
+
+
+def test_escape_literal():
+    assert escape_literal('a\\b"c\nd\re') == 'a\\\\b\\"c\\nd\\re'
+    assert escape_literal('plain') == 'plain'
+
+
+@pytest.mark.parametrize('profile,uri', fixture_feature_uris('loci') + fixture_feature_uris('geosparql'))
+def test_writer_matches_graph(profile, uri):
+    writer = ASGSFeature(uri)._get_instance_rdf(profile=profile)
+    assert isinstance(writer, TripleWriter)
+    expected = writer.to_graph()
+    ntriples = Graph().parse(data=writer.to_ntriples(), format='nt')
+    assert isomorphic(ntriples, expected)
+    turtle = Graph().parse(data=writer.to_turtle(), format='turtle')
+    assert isomorphic(turtle, expected)
+
+
+def test_writer_escapes_literals():
+    writer = TripleWriter()
+    writer.bind('ex', 'http://example.com/')
+    writer.add((URIRef('http://example.com/a'), URIRef('http://example.com/b'),
+                Literal('quote " backslash \\ newline \n return \r')))
+    writer.add((URIRef('http://example.com/a'), URIRef('http://example.com/c'), Literal('en', lang='en')))
+    expected = writer.to_graph()
+    assert isomorphic(Graph().parse(data=writer.to_ntriples(), format='nt'), expected)
+    assert isomorphic(Graph().parse(data=writer.to_turtle(), format='turtle'), expected)
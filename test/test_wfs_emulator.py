@@ -0,0 +1,95 @@
+import io
+import json
+import os
+import subprocess
+import sys
+import threading
+
+import pytest
+
+import wfs_emulator
+from asgs_dataset.model import asgs_feature
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Run in a fresh interpreter, the WFS URL templates are made from ASGS_WFS_SERVICE_BASE_URI at import
+CLIENT_SCRIPT = r'''
+import json
+import asgs_dataset._config as conf
+conf.WFS_DISK_CACHE_DIR = None
+conf.FEATURE_STORE_PATH = None
+from asgs_dataset.model.asgs_feature import retrieve_asgs_feature, retrieve_asgs_features, NOT_FOUND_CACHE
+
+
+def codes(tree, property_name='MB_CODE_2016'):
+    return sorted(tree.xpath('//*[local-name()="{}"]/text()'.format(property_name)))
+
+
+single = retrieve_asgs_features('MB', ['80006300000'])
+batched = retrieve_asgs_features('MB', ['80006500000', '80010000000', '80000000000'], batch_size=25)
+unbatched = retrieve_asgs_feature('SA1', '80101100403', local=False)
+state = retrieve_asgs_feature('STATE', 'ACT', local=False)
+print(json.dumps({
+    'single': {k: codes(t) for k, t in single.items()},
+    'batched': {k: codes(t) for k, t in batched.items()},
+    'unbatched': codes(unbatched, 'SA1_MAINCODE_2016'),
+    'state': codes(state, 'STATE_CODE_2016'),
+    'not_found': ('MB', '80000000000') in NOT_FOUND_CACHE,
+}))
+'''
+
+
+@pytest.fixture
+def emulator_server():
+    server = wfs_emulator.serve(port=0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_retrieve_through_emulator(emulator_server):
+    env = dict(os.environ)
+    env['ASGS_WFS_SERVICE_BASE_URI'] = \
+        'http://127.0.0.1:{}/arcgis/services/ASGS2016/{{service}}/MapServer/WFSServer'.format(
+            emulator_server.server_address[1])
+    result = subprocess.run([sys.executable, '-c', CLIENT_SCRIPT], cwd=REPO_DIR, env=env,
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=120)
+    assert result.returncode == 0, result.stderr.decode('utf-8', 'replace')
+    found = json.loads(result.stdout.decode('utf-8').strip().splitlines()[-1])
+    assert found['single'] == {'80006300000': ['80006300000']}
+    assert found['batched'] == {'80006500000': ['80006500000'], '80010000000': ['80010000000']}
+    assert found['unbatched'] == ['80101100403']
+    # the WFS is asked for the state by its code, not its abbrev
+    assert found['state'] == ['8']
+    assert found['not_found']
+    # one request each, the batch of three included
+    assert emulator_server.emulator.requests == 4
+
+
+def test_batched_response(emulator_server):
+    emulator = emulator_server.emulator
+    status, body = emulator.handle(
+        '/arcgis/services/ASGS2016/MB/MapServer/WFSServer',
+        'service=WFS&request=GetFeature&typeName=MB&Filter=<ogc:Or>'
+        '<ogc:Literal>80006300000</ogc:Literal><ogc:Literal>80006500000</ogc:Literal></ogc:Or>')
+    assert status == 200
+    assert body.count(b'80006300000') >= 1 and body.count(b'80006500000') >= 1
+    assert emulator.handle('/not/a/wfs', '')[0] == 404
+
+
+def test_state_queried_by_code(monkeypatch):
+    requested = []
+
+    def fake_request(uri, method, **kwargs):
+        requested.append(uri)
+        return io.BytesIO(b"")
+    monkeypatch.setattr(asgs_feature, 'get_feature_store', lambda: None)
+    monkeypatch.setattr(asgs_feature, 'WFS_DISK_CACHE', None)
+    monkeypatch.setattr(asgs_feature, 'retryable_request', fake_request)
+    # no TAS fixture, so both go to the WFS
+    asgs_feature._open_wfs_feature('STATE', 'TAS')
+    asgs_feature.open_raw_asgs_feature('STATE', 'TAS')
+    expected = asgs_feature.ASGSFeature.construct_wfs_query_for_feature_type('STATE', '6')
+    assert requested == [expected, expected]
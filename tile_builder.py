@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+#
+# Builds the geometry bounds index in the feature store (conf.FEATURE_STORE_PATH), which the
+# /tiles/<type>/<z>/<x>/<y>.mvt endpoint needs, and optionally pre-renders tiles into conf.TILE_CACHE_DIR.
+# Run feature_store_builder.py first. Rebuilding the index clears the tile cache.
+#
+#$> python3 tile_builder.py SA4 SA3                  # just the bounds index of these types
+#$> python3 tile_builder.py --max-zoom 10 SA4 SA3    # and pre-render their tiles up to zoom 10
+import argparse
+
+import asgs_dataset._config as conf
+from asgs_dataset.model.asgs_feature import ASGS_WFS_LOOKUP
+from asgs_dataset.model.feature_store import FeatureStore
+from asgs_dataset.model.vector_tiles import TILE_GEOMETRY_CACHE, get_tile_cache, load_store_geometry, \
+    render_tile, tiles_covering
+
+PAGE_SIZE = 500  # features indexed per transaction
+
+
+def build_bounds(store, asgs_type):
+    all_bounds = {}
+    offset = 0
+    while True:
+        codes = store.codes(asgs_type, offset, PAGE_SIZE)
+        if len(codes) < 1:
+            break
+        offset += len(codes)
+        page = []
+        for code in codes:
+            geometry = load_store_geometry(store, asgs_type, code)
+            TILE_GEOMETRY_CACHE.clear()  # only the bounds are needed
+            if geometry is None:
+                continue
+            mins = geometry.coords[:, :2].min(axis=0)
+            maxs = geometry.coords[:, :2].max(axis=0)
+            bounds = (float(mins[0]), float(mins[1]), float(maxs[0]), float(maxs[1]))
+            page.append((code, bounds))
+            all_bounds[code] = bounds
+        store.put_bounds(asgs_type, page)
+        print("{}: {} features indexed".format(asgs_type, offset))
+    return all_bounds
+
+
+def prerender(asgs_type, all_bounds, max_zoom):
+    cache = get_tile_cache()
+    if cache is None:
+        raise RuntimeError("conf.TILE_CACHE_DIR is not set, there is nowhere to put the tiles.")
+    for z in range(conf.TILE_MIN_ZOOM.get(asgs_type, 0), max_zoom + 1):
+        tiles = set()
+        for bounds in all_bounds.values():
+            tiles.update(tiles_covering(bounds, z))
+        for x, y in sorted(tiles):
+            key = "{}/{}/{}/{}".format(asgs_type, z, x, y)
+            cache.put(key, render_tile(asgs_type, z, x, y))
+        print("{}: {} tiles rendered at zoom {}".format(asgs_type, len(tiles), z))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the vector tile index, and pre-render tiles.")
+    parser.add_argument('types', nargs='*', help="ASGS types, default all of them")
+    parser.add_argument('--max-zoom', type=int, default=None, help="pre-render tiles up to this zoom")
+    args = parser.parse_args()
+    types = args.types or sorted(ASGS_WFS_LOOKUP.keys())
+    for t in types:
+        if t not in ASGS_WFS_LOOKUP:
+            raise RuntimeError("Unknown ASGS type: {}".format(t))
+    store = FeatureStore(conf.FEATURE_STORE_PATH, readonly=False)
+    tile_cache = get_tile_cache()
+    if tile_cache is not None:
+        tile_cache.clear()  # the tiles were drawn from the old index
+    for t in types:
+        bounds = build_bounds(store, t)
+        if args.max_zoom is not None:
+            prerender(t, bounds, min(args.max_zoom, conf.TILE_MAX_ZOOM))
@@ -0,0 +1,348 @@
+#!/usr/bin/env python3
+#
+# A local stand-in for the ABS WFS, for load testing and offline development.
+# It answers the GetFeature requests ASGSFeature makes (single feature, batched and index)
+# from the fixtures in test/, and optionally with generated synthetic features,
+# with configurable latency and error injection.
+#
+#$> python3 wfs_emulator.py --port 8081 --synthetic --latency 50 --error-rate 0.01
+#$> ASGS_WFS_SERVICE_BASE_URI='http://127.0.0.1:8081/arcgis/services/ASGS2016/{service}/MapServer/WFSServer' python3 app.py
+import argparse
+import gzip
+import hashlib
+import math
+import os
+import random
+import re
+import socketserver
+import threading
+import time
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+from xml.sax.saxutils import unescape
+
+from lxml import etree
+
+from asgs_dataset.helpers import ns
+from asgs_dataset.model.asgs_feature import ASGS_WFS_LOOKUP, tag_map_lookup, state_id_map, state_code_map, \
+    LOCAL_DATA_VAL_LOOKUPS, LOCAL_LOOKUP_TOKEN, DERIVE_TOKEN
+
+HERE_DIR = os.path.dirname(os.path.abspath(__file__))
+FIXTURES_DIR = os.path.join(HERE_DIR, "test")
+FEATURE_NS = "WFS"  # the ABS WFS really does use this as its feature namespace URI
+SRS_NAME = "urn:ogc:def:crs:EPSG:6.9:3857"
+# Synthetic features are put somewhere inside Australia, in EPSG:3857 metres
+SYNTHETIC_EXTENT = (12700000.0, -4900000.0, 17000000.0, -1300000.0)
+SYNTHETIC_CODE_BASE = 900000000
+LITERAL_RE = re.compile(r"<ogc:Literal>(.*?)</ogc:Literal>", re.S)
+SERVICE_RE = re.compile(r"/([^/]+)/MapServer/WFSServer/?$")
+
+
+class ThreadingHTTPServer(socketserver.ThreadingMixIn, HTTPServer):
+    # http.server has its own from Python 3.7, this runs on 3.6 too
+    daemon_threads = True
+
+
+class FixtureSet(object):
+    """
+    The test/<TYPE>_<code>.xml[.gz] WFS responses, keyed by (asgs_type, code).
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.files = {}
+        self._members = {}
+        self._lock = threading.Lock()
+        for name in os.listdir(directory):
+            m = re.match(r"^([A-Z0-9]+)_(.+?)\.xml(\.gz)?$", name)
+            if m:
+                self.files[(m.group(1), m.group(2))] = os.path.join(directory, name)
+
+    def _key(self, asgs_type, code):
+        if asgs_type == "STATE":
+            # the fixtures are named by state abbrev, the WFS only knows states by state code
+            code = state_id_map.get(code, None)
+        if (asgs_type, code) in self.files:
+            return asgs_type, code
+        return None
+
+    def __contains__(self, key):
+        return self._key(*key) is not None
+
+    def codes(self, asgs_type):
+        codes = [c for t, c in self.files if t == asgs_type]
+        if asgs_type == "STATE":
+            codes = [state_code_map[c] for c in codes if c in state_code_map]
+        return codes
+
+    def read(self, asgs_type, code):
+        path = self.files[self._key(asgs_type, code)]
+        opener = gzip.open if path.endswith(".gz") else open
+        with opener(path, "rb") as f:
+            return f.read()
+
+    def members(self, asgs_type, code):
+        key = self._key(asgs_type, code)
+        with self._lock:
+            members = self._members.get(key, None)
+        if members is None:
+            root = etree.fromstring(self.read(asgs_type, code), parser=etree.XMLParser(huge_tree=True))
+            members = root.findall("{{{}}}member".format(ns['gml']))
+            with self._lock:
+                self._members[key] = members
+        return members
+
+
+class SyntheticFeatures(object):
+    """
+    Generates a plausible WFS feature for any code, from the type's tag map.
+    Types whose tag map needs a local lookup table (MB, SA1, SA2) only get codes that are in those tables.
+    """
+
+    def __init__(self, count=1000, vertices=64):
+        self.count = count
+        self.vertices = max(int(vertices), 3)
+        self._valid_codes = {}
+
+    def _lookup_tables(self, asgs_type):
+        tables = []
+        for var in tag_map_lookup[asgs_type].values():
+            if isinstance(var, tuple) and var[0] is LOCAL_LOOKUP_TOKEN:
+                name = "{}_to_{}".format(asgs_type.lower(), var[-1].lower())
+                tables.append(LOCAL_DATA_VAL_LOOKUPS[name])
+        return tables
+
+    def valid_codes(self, asgs_type):
+        """
+        :return: the codes a synthetic feature can have, or None for any code
+        """
+        if asgs_type not in self._valid_codes:
+            tables = self._lookup_tables(asgs_type)
+            codes = None
+            if tables:
+                codes = set(tables[0].keys())
+                for t in tables[1:]:
+                    codes.intersection_update(t.keys())
+                codes = {str(c) for c in codes}
+            self._valid_codes[asgs_type] = codes
+        return self._valid_codes[asgs_type]
+
+    def has(self, asgs_type, code):
+        valid = self.valid_codes(asgs_type)
+        return valid is None or code in valid
+
+    def codes(self, asgs_type):
+        valid = self.valid_codes(asgs_type)
+        if valid is None:
+            return [str(SYNTHETIC_CODE_BASE + i) for i in range(self.count)]
+        return sorted(valid, key=lambda c: (len(c), c))[:self.count]
+
+    def _ring(self, code):
+        h = int(hashlib.md5(code.encode("utf-8")).hexdigest(), 16)
+        minx, miny, maxx, maxy = SYNTHETIC_EXTENT
+        cx = minx + (h % 10000) / 10000.0 * (maxx - minx)
+        cy = miny + ((h // 10000) % 10000) / 10000.0 * (maxy - miny)
+        r = 500.0 + (h % 4500)
+        n = self.vertices
+        ring = [(cx + r * math.cos(2 * math.pi * i / n), cy + r * math.sin(2 * math.pi * i / n)) for i in range(n)]
+        ring.append(ring[0])
+        return ring
+
+    def member(self, asgs_type, code, object_id):
+        ring = self._ring(code)
+        area = 0.5 * abs(sum(x0 * y1 - x1 * y0 for (x0, y0), (x1, y1) in zip(ring, ring[1:])))
+        length = sum(math.hypot(x1 - x0, y1 - y0) for (x0, y0), (x1, y1) in zip(ring, ring[1:]))
+        gml = "{{{}}}".format(ns['gml'])
+        member = etree.Element(gml + "member", nsmap={'gml': ns['gml'], asgs_type: FEATURE_NS})
+        feature = etree.SubElement(member, "{{{}}}{}".format(FEATURE_NS, asgs_type))
+        feature.set(gml + "id", "F3__{}".format(object_id))
+        seen = set()
+        for tag, var in tag_map_lookup[asgs_type].items():
+            if isinstance(var, tuple):
+                if var[0] is LOCAL_LOOKUP_TOKEN or var[0] is DERIVE_TOKEN:
+                    continue  # the model fills these in itself
+                var = var[-1]
+            if var in seen:
+                continue  # eg Shape and SHAPE
+            seen.add(var)
+            elem = etree.SubElement(feature, tag)
+            if var == 'shape':
+                multi = etree.SubElement(elem, gml + "MultiSurface", srsName=SRS_NAME)
+                poly = etree.SubElement(etree.SubElement(multi, gml + "surfaceMember"), gml + "Polygon")
+                ring_elem = etree.SubElement(etree.SubElement(poly, gml + "exterior"), gml + "LinearRing")
+                etree.SubElement(ring_elem, gml + "posList").text = " ".join(
+                    "{!r} {!r}".format(x, y) for x, y in ring)
+            elif var == 'code':
+                elem.text = code
+            elif var == 'object_id':
+                elem.text = str(object_id)
+            elif var == 'shape_area':
+                elem.text = repr(area)
+            elif var == 'shape_length':
+                elem.text = repr(length)
+            elif var == 'albers_area':
+                elem.text = repr(area / 1e6)
+            elif var == 'state':
+                elem.text = code[0] if code[0] in "123456789" else "1"
+            elif 'name' in var:
+                elem.text = "Synthetic {} {}".format(asgs_type, code)
+            else:
+                elem.text = "1"
+        return member
+
+
+class WFSEmulator(object):
+    def __init__(self, fixtures, synthetic=None, latency=0.0, jitter=0.0,
+                 error_rate=0.0, error_status=503, drop_rate=0.0):
+        """
+        :param synthetic: SyntheticFeatures, or None to serve only the fixtures
+        :param latency: seconds added to every response
+        :param jitter: up to this many more seconds, at random
+        :param error_rate: fraction of requests answered with error_status
+        :param drop_rate: fraction of requests whose connection is closed without a response
+        """
+        self.fixtures = fixtures
+        self.synthetic = synthetic
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.drop_rate = drop_rate
+        self.requests = 0
+
+    @staticmethod
+    def _collection(asgs_type, members):
+        nsmap = {'wfs': ns['wfs'], 'gml': ns['gml'], asgs_type: FEATURE_NS}
+        root = etree.Element("{{{}}}FeatureCollection".format(ns['wfs']), nsmap=nsmap)
+        for m in members:
+            root.append(m)
+        return etree.tostring(root, xml_declaration=True, encoding="UTF-8")
+
+    def _feature_members(self, asgs_type, code):
+        if (asgs_type, code) in self.fixtures:
+            return self.fixtures.members(asgs_type, code)
+        if self.synthetic is not None and self.synthetic.has(asgs_type, code):
+            object_id = int(hashlib.md5(code.encode("utf-8")).hexdigest()[:6], 16)
+            return [self.synthetic.member(asgs_type, code, object_id)]
+        return []
+
+    def get_features(self, asgs_type, codes):
+        if len(codes) == 1 and (asgs_type, codes[0]) in self.fixtures:
+            return self.fixtures.read(asgs_type, codes[0])  # as-is, no need to parse it
+        members = []
+        for code in codes:
+            # deep copies, the cached fixture members can't be moved into a new tree
+            members.extend(etree.fromstring(etree.tostring(m)) for m in self._feature_members(asgs_type, code))
+        return self._collection(asgs_type, members)
+
+    def get_index(self, asgs_type, property_name, startindex, count):
+        codes = set(self.fixtures.codes(asgs_type))
+        if self.synthetic is not None:
+            codes.update(self.synthetic.codes(asgs_type))
+        codes = sorted(codes, key=lambda c: (len(c), c))[startindex:startindex + count]
+        gml = "{{{}}}".format(ns['gml'])
+        members = []
+        for i, code in enumerate(codes):
+            member = etree.Element(gml + "member", nsmap={'gml': ns['gml']})
+            feature = etree.SubElement(member, "{{{}}}{}".format(FEATURE_NS, asgs_type))
+            feature.set(gml + "id", "F3__{}".format(startindex + i + 1))
+            etree.SubElement(feature, "{{{}}}{}".format(FEATURE_NS, property_name)).text = code
+            members.append(member)
+        return self._collection(asgs_type, members)
+
+    def handle(self, path, query):
+        """
+        :return: (status, body), or None to drop the connection
+        """
+        self.requests += 1
+        delay = self.latency + (random.uniform(0, self.jitter) if self.jitter else 0.0)
+        if delay > 0:
+            time.sleep(delay)
+        if self.drop_rate and random.random() < self.drop_rate:
+            return None
+        if self.error_rate and random.random() < self.error_rate:
+            return self.error_status, b"Injected error"
+        m = SERVICE_RE.search(path)
+        if not m:
+            return 404, b"Not a WFS endpoint"
+        args = {k.lower(): v[0] for k, v in parse_qs(query).items()}
+        req = args.get('request', '').lower()
+        if req == 'getcapabilities':
+            return 200, b'<?xml version="1.0"?><wfs:WFS_Capabilities xmlns:wfs="' + ns['wfs'].encode() + b'"/>'
+        if req != 'getfeature':
+            return 400, b"Unsupported request"
+        asgs_type = args.get('typename', '').split(':')[-1]
+        if asgs_type not in ASGS_WFS_LOOKUP:
+            return 400, b"Unknown typeName"
+        if 'filter' in args:
+            codes = [unescape(c).strip() for c in LITERAL_RE.findall(args['filter'])]
+            return 200, self.get_features(asgs_type, codes)
+        property_name = args.get('propertyname', ASGS_WFS_LOOKUP[asgs_type].propertyname).split(':')[-1]
+        startindex = int(args.get('startindex', 0))
+        count = int(args.get('count', 1000))
+        return 200, self.get_index(asgs_type, property_name, startindex, count)
+
+
+def make_handler(emulator):
+    class WFSEmulatorHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            parts = urlsplit(self.path)
+            try:
+                result = emulator.handle(parts.path, parts.query)
+            except Exception as e:
+                print(repr(e))
+                result = 500, repr(e).encode("utf-8")
+            if result is None:
+                self.close_connection = True
+                return
+            status, body = result
+            self.send_response(status)
+            self.send_header("Content-Type", "text/xml; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            if VERBOSE:
+                super(WFSEmulatorHandler, self).log_message(format, *args)
+
+    return WFSEmulatorHandler
+
+
+VERBOSE = False
+
+
+def serve(host="127.0.0.1", port=8081, **kwargs):
+    emulator = WFSEmulator(FixtureSet(FIXTURES_DIR), **kwargs)
+    server = ThreadingHTTPServer((host, port), make_handler(emulator))
+    server.emulator = emulator
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local stand-in for the ABS ASGS WFS.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--synthetic", action="store_true", help="answer for generated features too, not just the fixtures")
+    parser.add_argument("--synthetic-count", type=int, default=1000, help="synthetic features per type in the index")
+    parser.add_argument("--synthetic-vertices", type=int, default=64, help="vertices in each synthetic polygon")
+    parser.add_argument("--latency", type=float, default=0.0, help="milliseconds added to every response")
+    parser.add_argument("--jitter", type=float, default=0.0, help="up to this many more milliseconds, at random")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests that get --error-status")
+    parser.add_argument("--error-status", type=int, default=503)
+    parser.add_argument("--drop-rate", type=float, default=0.0, help="fraction of requests that get no response")
+    parser.add_argument("--verbose", action="store_true")
+    a = parser.parse_args()
+    VERBOSE = a.verbose
+    synthetic = SyntheticFeatures(a.synthetic_count, a.synthetic_vertices) if a.synthetic else None
+    server = serve(a.host, a.port, synthetic=synthetic, latency=a.latency / 1000.0, jitter=a.jitter / 1000.0,
+                   error_rate=a.error_rate, error_status=a.error_status, drop_rate=a.drop_rate)
+    print("WFS emulator listening, use:\n"
+          "ASGS_WFS_SERVICE_BASE_URI='http://{}:{}/arcgis/services/ASGS2016/{{service}}/MapServer/WFSServer'"
+          .format(a.host, a.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass